@@ -0,0 +1,119 @@
+"""
+This file measures the wall-clock time of the cleaning of the .dta files
+with different numbers of worker processes. Run it from the root of the
+project with "python -m benchmarks.bench_cleaning".
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from src.config import SRC
+from src.data_management.ingestion import clean_stata
+
+
+def _digest(path):
+    """Returns the md5 hash of a file."""
+    return hashlib.md5(Path(path).read_bytes()).hexdigest()
+
+
+def _clean(args):
+    """Cleans one dataset with one worker and returns the hash of the output."""
+    path, produces, i = args
+    clean_stata(path, produces, i)
+    return _digest(produces)
+
+
+def bench_columns(files, workers, repeat, folder):
+    """This function times the cleaning of each dataset with its columns split
+    between the given numbers of workers. It checks that every run saves the
+    same file as the run with one worker.
+    """
+    rows = []
+    for path in files:
+        i = path.name.split("_")[0]
+        expected = None
+        for n_workers in workers:
+            produces = folder / f"{i}_{n_workers}.parquet"
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                clean_stata(path, produces, i, n_workers=n_workers)
+                times.append(time.perf_counter() - start)
+            digest = _digest(produces)
+            expected = expected or digest
+            if digest != expected:
+                raise RuntimeError(
+                    f"The output of {i} differs with {n_workers} workers."
+                )
+            rows.append(
+                {
+                    "level": "columns",
+                    "dataset": i,
+                    "n_workers": n_workers,
+                    "seconds": min(times),
+                }
+            )
+    return rows
+
+
+def bench_datasets(files, workers, repeat, folder):
+    """This function times the cleaning of all datasets with one dataset per
+    worker process, which is what "pytask -n" does with the cleaning tasks.
+    """
+    rows = []
+    jobs = [
+        (
+            path,
+            folder / f"{path.name.split('_')[0]}_datasets.parquet",
+            path.name.split("_")[0],
+        )
+        for path in files
+    ]
+    for n_workers in workers:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            if n_workers == 1:
+                list(map(_clean, jobs))
+            else:
+                with ProcessPoolExecutor(max_workers=n_workers) as pool:
+                    list(pool.map(_clean, jobs))
+            times.append(time.perf_counter() - start)
+        rows.append(
+            {
+                "level": "datasets",
+                "dataset": "all",
+                "n_workers": n_workers,
+                "seconds": min(times),
+            }
+        )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--data", type=Path, default=SRC / "original_data")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    workers = [n for n in args.workers if n <= (os.cpu_count() or 1)] or [1]
+    files = sorted(args.data.glob("*_cf_W*.dta"))
+    with tempfile.TemporaryDirectory() as folder:
+        folder = Path(folder)
+        rows = bench_columns(files, workers, args.repeat, folder)
+        rows += bench_datasets(files, workers, args.repeat, folder)
+    result = pd.DataFrame(rows)
+    base = result.groupby(["level", "dataset"])["seconds"].transform("first")
+    result["speedup"] = (base / result["seconds"]).round(2)
+    print(result.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+"""
+This file contains the functions to store and load the datasets
+which are produced in "BLD" by the tasks
+"""
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src import config
+
+PARTITION_COLUMN = "wave"
+ROW_COLUMN = "__row__"
+CHUNK_ROW_COLUMN = "__chunk_row__"
+MANIFEST_SUFFIX = ".manifest.json"
+
+# datasets loaded or saved in this process, see load_artifact
+_cache = OrderedDict()
+_cache_sizes = {}
+_pending = {}
+_lock = threading.RLock()
+_prefetcher = ThreadPoolExecutor(max_workers=4, thread_name_prefix="prefetch")
+
+
+def _partition_values(df, partition_on):
+    """Returns the values of the partition column whether it is a column or an index level."""
+    if partition_on in df.columns:
+        return df[partition_on].to_numpy()
+    if partition_on in df.index.names:
+        return df.index.get_level_values(partition_on).to_numpy()
+    return None
+
+
+def save_artifact(df, path, partition_on=PARTITION_COLUMN):
+    """This function saves a dataset in columnar Parquet format.
+    The rows are written as one row group per value of the partition column
+    (by default "wave"), so that readers filtering on this column only read the
+    row groups they need. Datasets without the partition column are written
+    as they are. Files ending with ".pickle" are still written as pickles.
+    Args:
+        df (pandas.DataFrame): The dataframe to be saved.
+        path (str, path object): The path of the file.
+        partition_on (str): The column or index level whose values define the
+        row groups. Default value is "wave".
+    """
+    path = Path(path)
+    _forget(path)
+    if path.suffix == ".pickle":
+        df.to_pickle(path)
+        _remember(_cache_key(path), df)
+        return
+    saved = df
+    values = _partition_values(df, partition_on) if partition_on else None
+    codes = None
+    if values is not None:
+        codes = pd.factorize(values, sort=True)[0]
+        order = np.argsort(codes, kind="stable")
+        codes = codes[order]
+        if (order != np.arange(len(order))).any():
+            # the original row order is restored on load with the row positions
+            df = df.take(order)
+            df[ROW_COLUMN] = order.astype(np.int64)
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    with pq.ParquetWriter(path, table.schema) as writer:
+        _write_row_groups(writer, table, codes)
+    # the next task usually loads the dataset again, so it is kept in the cache
+    if config.ARTIFACT_CACHE_BYTES > 0:
+        loaded = _loaded_form(saved, table.schema)
+        if loaded is not None:
+            _remember(_cache_key(path), loaded)
+
+
+def _loaded_form(df, schema):
+    """Returns a saved dataframe with the dtypes it is loaded with from a file
+    with the schema, or None if the dtypes of its columns differ. The dtypes are
+    taken from the empty table of the schema, so the table is not converted, and
+    only the index levels are converted (e.g. Int8 levels are loaded as int64)."""
+    empty = schema.empty_table().to_pandas().drop(columns=ROW_COLUMN, errors="ignore")
+    if not empty.dtypes.astype(str).equals(df.dtypes.astype(str)):
+        return None
+    try:
+        levels = [
+            df.index.get_level_values(level).astype(
+                empty.index.get_level_values(level).dtype
+            )
+            for level in range(empty.index.nlevels)
+        ]
+    except (TypeError, ValueError):
+        return None
+    index = levels[0] if len(levels) == 1 else pd.MultiIndex.from_arrays(levels)
+    return df.set_axis(index.set_names(empty.index.names), axis=0, copy=False)
+
+
+def _write_row_groups(writer, table, codes):
+    """Writes one row group for each run of equal partition codes."""
+    if codes is None:
+        writer.write_table(table)
+        return
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    lengths = np.diff(np.r_[starts, len(codes)])
+    for start, length in zip(starts, lengths):
+        writer.write_table(table.slice(start, length))
+
+
+def _parquet_ranges(path):
+    """Reads the lowest and highest value and whether there are missing values
+    for each integer column from the row group statistics of a Parquet file."""
+    metadata = pq.ParquetFile(path).metadata
+    observed = {}
+    has_missing = {}
+    for row_group in range(metadata.num_row_groups):
+        for j in range(metadata.num_columns):
+            column = metadata.row_group(row_group).column(j)
+            name = column.path_in_schema
+            statistics = column.statistics
+            if statistics is None:
+                has_missing[name] = True
+                continue
+            has_missing[name] = has_missing.get(name, False) or bool(
+                statistics.null_count
+            )
+            if statistics.has_min_max and column.physical_type in ("INT32", "INT64"):
+                low, high = observed.get(name, (statistics.min, statistics.max))
+                observed[name] = (min(low, statistics.min), max(high, statistics.max))
+    return observed, has_missing
+
+
+def save_artifact_chunks(
+    chunks, path, index, partition_on=PARTITION_COLUMN, plan_dtypes=None
+):
+    """This function saves a dataset which is produced in chunks of rows.
+    The result is the same as saving the concatenated chunks, indexed by index
+    and sorted, with save_artifact. However, only one chunk or one partition is
+    held in memory at once. The chunks are first written to a temporary file
+    with one row group per chunk and partition value. Then the sorted row
+    positions are computed from the index columns alone and the partitions are
+    written to the final file one after another.
+    Args:
+        chunks (iterable): DataFrames with the same columns and dtypes which
+        contain the index as columns.
+        path (str, path object): The path of the file.
+        index (list): The columns which form the index of the dataset.
+        partition_on (str): The column whose values define the row groups.
+        Default value is "wave".
+        plan_dtypes (function): Function which chooses the dtypes of the columns from
+        their current dtypes, their observed ranges and whether they contain missing
+        values (see src.data_management.dtypes.dtype_plan). The ranges are read from
+        the statistics of the chunks. Default value is None, which keeps the dtypes.
+    Returns:
+        memory (pandas.DataFrame): The dtype and the bytes used by each column of the
+        saved dataset.
+    """
+    path = Path(path)
+    _forget(path)
+    spill = path.with_suffix(".chunks.parquet")
+    try:
+        n_rows = 0
+        writer = None
+        for chunk in chunks:
+            chunk = chunk.reset_index(drop=True)
+            chunk[CHUNK_ROW_COLUMN] = np.arange(n_rows, n_rows + len(chunk))
+            n_rows += len(chunk)
+            codes = pd.factorize(chunk[partition_on], sort=True)[0]
+            order = np.argsort(codes, kind="stable")
+            table = pa.Table.from_pandas(chunk.take(order), preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(spill, table.schema)
+            _write_row_groups(writer, table, codes[order])
+        if writer is None:
+            raise ValueError("There are no chunks to be saved.")
+        writer.close()
+
+        dtypes = pq.read_schema(spill).empty_table().to_pandas().dtypes
+        dtypes = dtypes.drop(CHUNK_ROW_COLUMN)
+        plan = None
+        if plan_dtypes is not None:
+            plan = plan_dtypes(dtypes, *_parquet_ranges(spill))
+        keys = pq.read_table(spill, columns=index + [CHUNK_ROW_COLUMN]).to_pandas()
+        rows = keys.sort_values(index + [CHUNK_ROW_COLUMN])[CHUNK_ROW_COLUMN]
+        rank = np.empty(n_rows, dtype=np.int64)
+        rank[rows.to_numpy()] = np.arange(n_rows)
+        partitions = sorted(int(value) for value in keys[partition_on].unique())
+        del keys
+
+        writer = None
+        memory = None
+        for value in partitions:
+            part = pq.read_table(
+                spill, filters=[(partition_on, "==", value)], use_pandas_metadata=True
+            ).to_pandas()
+            rows = rank[part.pop(CHUNK_ROW_COLUMN).to_numpy()]
+            order = np.argsort(rows, kind="stable")
+            part = part.take(order)
+            if plan is not None:
+                part = part.astype(
+                    {
+                        column: dtype
+                        for column, dtype in plan.items()
+                        if str(part[column].dtype) != str(dtype)
+                    }
+                )
+            part = part.set_index(index)
+            usage = part.memory_usage(index=False, deep=True)
+            memory = usage if memory is None else memory + usage
+            part[ROW_COLUMN] = rows[order]
+            table = pa.Table.from_pandas(part, preserve_index=True)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+        writer.close()
+    finally:
+        spill.unlink(missing_ok=True)
+    return pd.DataFrame({"dtype": part.dtypes.astype(str), "bytes": memory}).drop(
+        ROW_COLUMN
+    )
+
+
+def _read_artifact(path, columns=None, filters=None):
+    """Reads a dataset saved by save_artifact from the file."""
+    if path.suffix == ".pickle":
+        df = pd.read_pickle(path)
+        if filters is not None:
+            raise ValueError("Filters are only supported for Parquet artifacts.")
+        return df if columns is None else df[list(columns)]
+    if columns is not None:
+        columns = list(columns)
+        if ROW_COLUMN in pq.read_schema(path).names:
+            columns.append(ROW_COLUMN)
+    df = pq.read_table(
+        path, columns=columns, filters=filters, use_pandas_metadata=True
+    ).to_pandas()
+    return _restore_order(df)
+
+
+def _restore_order(df):
+    """Restores the original row order of a dataset with the row positions."""
+    if ROW_COLUMN in df:
+        df = df.take(np.argsort(df[ROW_COLUMN].to_numpy(), kind="stable"))
+        df = df.drop(columns=ROW_COLUMN)
+    return df
+
+
+def _cache_key(path, columns=None, filters=None):
+    """Returns the key of a dataset in the cache. It contains the size and the
+    modification time of the file, so that changed files are read again."""
+    path = Path(path).resolve()
+    stat = path.stat()
+    if filters is not None:
+        filters = tuple(
+            (column, operator, tuple(value) if isinstance(value, list) else value)
+            for column, operator, value in filters
+        )
+    return (
+        str(path),
+        stat.st_size,
+        stat.st_mtime_ns,
+        None if columns is None else tuple(columns),
+        filters,
+    )
+
+
+def _remember(key, df, copy=True):
+    """Puts a dataset into the cache and removes the least recently used datasets
+    until the cache fits into ARTIFACT_CACHE_BYTES in "src/config.py"."""
+    budget = config.ARTIFACT_CACHE_BYTES
+    if budget <= 0:
+        return
+    size = int(df.memory_usage(index=True, deep=True).sum())
+    if size > budget:
+        return
+    with _lock:
+        _cache[key] = df.copy() if copy else df
+        _cache_sizes[key] = size
+        _cache.move_to_end(key)
+        while sum(_cache_sizes.values()) > budget:
+            oldest, _ = _cache.popitem(last=False)
+            del _cache_sizes[oldest]
+
+
+def _forget(path):
+    """Removes all versions of a dataset from the cache."""
+    path = str(Path(path).resolve())
+    with _lock:
+        for key in [key for key in _cache if key[0] == path]:
+            del _cache[key]
+            del _cache_sizes[key]
+
+
+def _from_cache(key):
+    """Returns a copy of a cached dataset or None. A projection of a dataset or a
+    selection of its waves is taken from the whole dataset if it is cached."""
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key].copy()
+        whole = _cache.get(key[:3] + (None, None))
+        if whole is None:
+            return None
+        _cache.move_to_end(key[:3] + (None, None))
+    columns, filters = key[3], key[4]
+    if filters is not None:
+        if (
+            not all(
+                column == PARTITION_COLUMN and operator in ("==", "in")
+                for column, operator, _ in filters
+            )
+            or PARTITION_COLUMN not in whole.index.names
+        ):
+            return None
+        selected = np.ones(len(whole), dtype=bool)
+        waves = whole.index.get_level_values(PARTITION_COLUMN)
+        for _, operator, value in filters:
+            selected &= waves.isin(list(value) if operator == "in" else [value])
+        whole = whole[selected]
+    if columns is not None:
+        if not set(columns).issubset(whole.columns):
+            return None
+        whole = whole[list(columns)]
+    return whole.copy()
+
+
+def load_artifact(path, columns=None, filters=None):
+    """This function loads a dataset saved by save_artifact.
+    Only the requested columns are read from the file (the index is always
+    restored) and row groups which do not match the filters are skipped.
+    The datasets loaded and saved in this process are kept in a cache of at most
+    ARTIFACT_CACHE_BYTES in "src/config.py", so a dataset which is used by
+    several tasks is only read once. The least recently used datasets are removed
+    first and a file which was changed is read again. The cache returns copies,
+    so the loaded dataframes can be changed.
+    Args:
+        path (str, path object): The path of the file.
+        columns (list): The columns to be loaded. Default value is None,
+        which loads all columns.
+        filters (list): Filters in the pyarrow format, e.g. [("wave", "==", 11)].
+        Default value is None, which loads all rows.
+    Returns:
+        df (pandas.DataFrame): The loaded dataframe.
+    """
+    path = Path(path)
+    key = _cache_key(path, columns, filters)
+    with _lock:
+        pending = _pending.get(key)
+    if pending is not None:
+        pending.result()
+    df = _from_cache(key)
+    if df is None:
+        df = _read_artifact(path, columns, filters)
+        _remember(key, df)
+    return df
+
+
+def _prefetch(key, path, columns, filters):
+    """Reads a dataset into the cache."""
+    try:
+        if _from_cache(key) is None:
+            _remember(key, _read_artifact(path, columns, filters), copy=False)
+    finally:
+        with _lock:
+            _pending.pop(key, None)
+
+
+def prefetch_artifacts(paths, columns=None, filters=None):
+    """This function starts reading datasets into the cache on background threads.
+    A later load_artifact of a dataset waits until it is read. Reading the Parquet
+    files releases the GIL, so the datasets are read at the same time.
+    Args:
+        paths (list): The paths of the files.
+        columns (list): The columns to be loaded. Default value is None,
+        which loads all columns.
+        filters (list): Filters in the pyarrow format. Default value is None,
+        which loads all rows.
+    """
+    for path in paths:
+        path = Path(path)
+        key = _cache_key(path, columns, filters)
+        with _lock:
+            if key in _pending or key in _cache:
+                continue
+            _pending[key] = _prefetcher.submit(_prefetch, key, path, columns, filters)
+
+
+def load_artifacts(paths, columns=None, filters=None):
+    """This function loads several datasets at the same time (see prefetch_artifacts).
+    Args:
+        paths (list): The paths of the files.
+        columns (list): The columns to be loaded. Default value is None,
+        which loads all columns.
+        filters (list): Filters in the pyarrow format. Default value is None,
+        which loads all rows.
+    Returns:
+        dfs (list): The loaded dataframes in the order of the paths.
+    """
+    paths = list(paths)
+    prefetch_artifacts(paths, columns, filters)
+    return [load_artifact(path, columns, filters) for path in paths]
+
+
+def clear_artifact_cache():
+    """This function removes all datasets from the cache."""
+    with _lock:
+        _cache.clear()
+        _cache_sizes.clear()
+
+
+def manifest_path(path):
+    """Returns the path of the manifest of a dataset."""
+    path = Path(path)
+    return path.with_name(path.name + MANIFEST_SUFFIX)
+
+
+def write_manifest(path, waves):
+    """This function writes the manifest of a dataset saved by save_artifact.
+    The manifest records a digest for each wave of the dataset, which describes
+    the inputs the wave was built from, and the number of rows of the file.
+    Args:
+        path (str, path object): The path of the dataset.
+        waves (dict): Dictionary with waves as keys and their digests as values.
+    """
+    manifest = {
+        "rows": pq.ParquetFile(path).metadata.num_rows,
+        "waves": {str(wave): digest for wave, digest in sorted(waves.items())},
+    }
+    manifest_path(path).write_text(json.dumps(manifest, indent=1))
+
+
+def read_manifest(path):
+    """This function reads the manifest of a dataset (see write_manifest).
+    Args:
+        path (str, path object): The path of the dataset.
+    Returns:
+        waves (dict): Dictionary with waves as keys and their digests as values.
+        Empty if the dataset or its manifest does not exist or if the dataset
+        was changed after the manifest was written.
+    """
+    path = Path(path)
+    if not path.exists() or not manifest_path(path).exists():
+        return {}
+    manifest = json.loads(manifest_path(path).read_text())
+    if manifest["rows"] != pq.ParquetFile(path).metadata.num_rows:
+        return {}
+    return {int(wave): digest for wave, digest in manifest["waves"].items()}
@@ -0,0 +1,387 @@
+"""
+This file contains the benchmark suite which times and memory-profiles the cleaning
+functions and the tasks of the pipeline on synthetic datasets of different sizes
+(see src/data_management/synthetic.py)
+"""
+import argparse
+import gc
+import inspect
+import shutil
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.artifacts import clear_artifact_cache
+from src.config import BLD
+from src.data_management import cleaning_functions
+from src.data_management import task_cleaning
+from src.data_management.catalog import catalog_sources
+from src.data_management.metadata import load_dummies
+from src.data_management.synthetic import write_synthetic_data
+from src.final import task_graph
+from src.final import task_stat
+
+BENCHMARK_COLUMNS = ["scale", "kind", "name", "rows", "seconds", "peak_mb"]
+
+
+def measure(function, *args, repeat=1, memory=True, **kwargs):
+    """This function times a function and measures the peak of the memory it
+    allocates. The time is the fastest of repeat runs. The memory is measured with
+    tracemalloc in a separate run, because tracing slows the function down. It
+    covers the memory allocated by Python, numpy and pandas, but not by pyarrow.
+    Args:
+        function (function): The function.
+        args: The arguments of the function.
+        repeat (int): The number of timed runs. Default value is 1.
+        memory (bool): Whether the memory is measured. Default value is True.
+        kwargs: The keyword arguments of the function.
+    Returns:
+        measurement (dict): The time in seconds "seconds" and the peak of the
+        allocated memory in MB "peak_mb" (NaN without memory).
+    """
+    timings = [_seconds(function, *args, **kwargs) for _ in range(repeat)]
+    return {
+        "seconds": min(timings),
+        "peak_mb": _peak_mb(function, *args, **kwargs) if memory else np.nan,
+    }
+
+
+def _seconds(function, *args, **kwargs):
+    """Returns the time a function takes in seconds."""
+    gc.collect()
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def _peak_mb(function, *args, **kwargs):
+    """Returns the peak of the memory a function allocates in MB."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1] / 1024**2
+    finally:
+        tracemalloc.stop()
+
+
+def _inputs(original_data):
+    """Returns the datasets the cleaning functions are benchmarked with. They are
+    the inputs of the functions in the pipeline (see aggregate_waves)."""
+    cf = cleaning_functions
+    raw_p = pd.read_stata(
+        cf.get_release("PENDDAT", original_data), convert_categoricals=False
+    )
+    raw_h = pd.read_stata(
+        cf.get_release("HHENDDAT", original_data), convert_categoricals=False
+    )
+    clean_p = cf.clean_data(raw_p, "PENDDAT")
+    clean_h = cf.clean_data(raw_h, "HHENDDAT")
+    reversed_p = cf.reverse_code(clean_p)
+    depr_h = cf.create_dummies_depr(clean_h)
+    items = load_dummies("HHENDDAT").deprivation
+    return {
+        "raw_p": raw_p,
+        "raw_h": raw_h,
+        "clean_p": clean_p,
+        "clean_h": clean_h,
+        "reversed_p": reversed_p,
+        "scales_p": cf.aggregate_scales(reversed_p),
+        "depr_h": depr_h,
+        "depr_dummies": depr_h[[f"{item}_dummy" for item in items]].to_numpy(),
+        "specs_p": load_dummies("PENDDAT").specs,
+    }
+
+
+# The arguments of each function of cleaning_functions.py in the benchmark.
+FUNCTION_CASES = {
+    "get_names_dataset": lambda d, path: (path,),
+    "get_release": lambda d, path: ("PENDDAT", path),
+    "read_renaming": lambda d, path: ("PENDDAT",),
+    "mask_missing_codes": lambda d, path: (d["raw_p"],),
+    "clean_data": lambda d, path: (d["raw_p"], "PENDDAT"),
+    "reverse_code": lambda d, path: (d["clean_p"],),
+    "aggregate_scales": lambda d, path: (d["reversed_p"],),
+    "average_big5": lambda d, path: (d["reversed_p"],),
+    "average_eri": lambda d, path: (d["reversed_p"],),
+    "average_genrole": lambda d, path: (d["reversed_p"],),
+    "encode_dummies": lambda d, path: (d["clean_p"], d["specs_p"]),
+    "create_dummies": lambda d, path: (d["scales_p"], d["clean_h"]),
+    "deprivation_weights": lambda d, path: (d["depr_dummies"],),
+    "create_dummies_depr": lambda d, path: (d["clean_h"],),
+    "update_deprivation_weights": lambda d, path: (d["depr_h"],),
+}
+
+
+def cleaning_function_names():
+    """This function returns the names of the public functions of
+    cleaning_functions.py."""
+    return [
+        name
+        for name, function in inspect.getmembers(cleaning_functions, inspect.isfunction)
+        if function.__module__ == cleaning_functions.__name__
+        and not name.startswith("_")
+    ]
+
+
+def benchmark_functions(original_data, repeat=3, memory=True):
+    """This function benchmarks each function of cleaning_functions.py on the
+    datasets in original_data (see measure and FUNCTION_CASES).
+    Args:
+        original_data (str, path object): The folder of the .dta files.
+        repeat (int): The number of timed runs. Default value is 3.
+        memory (bool): Whether the memory is measured. Default value is True.
+    Returns:
+        results (list): Dictionaries with the name, the time and the memory of
+        each function.
+    """
+    inputs = _inputs(original_data)
+    results = []
+    for name in cleaning_function_names():
+        args = FUNCTION_CASES[name](inputs, Path(original_data))
+        function = getattr(cleaning_functions, name)
+        measurement = measure(function, *args, repeat=repeat, memory=memory)
+        results.append({"kind": "function", "name": name, **measurement})
+    return results
+
+
+def pipeline_tasks(original_data, bld):
+    """This function lists the tasks of the pipeline in the order pytask runs them,
+    with their dependencies in original_data and their products in bld instead of
+    "original_data" and "BLD".
+    Args:
+        original_data (str, path object): The folder of the .dta files.
+        bld (str, path object): The folder of the products.
+    Returns:
+        tasks (list): Tuples of the name of the task, the task function and its
+        keyword arguments.
+    """
+    bld = Path(bld)
+    names = cleaning_functions.get_names_dataset(original_data)
+    tasks = [
+        (
+            "task_variable_catalog",
+            task_cleaning.task_variable_catalog,
+            {
+                "depends_on": catalog_sources(),
+                "produces": bld / "catalog" / "variable_catalog.pickle",
+            },
+        )
+    ]
+    for i in names:
+        tasks.append(
+            (
+                f"task_basic_cleaning[{i}]",
+                task_cleaning.task_basic_cleaning,
+                {
+                    "depends_on": cleaning_functions.get_release(i, original_data),
+                    "produces": {
+                        "data": bld / "cleaned_data" / f"{i}_clean.parquet",
+                        "memory": bld / "cleaned_data" / f"{i}_memory.csv",
+                        "labels": bld / "cleaned_data" / f"{i}_labels.json",
+                    },
+                    "i": i,
+                },
+            )
+        )
+    tasks.append(
+        (
+            "task_aggregation_and_dummy",
+            task_cleaning.task_aggregation_and_dummy,
+            {
+                "depends_on": {
+                    "first": bld / "cleaned_data" / "PENDDAT_clean.parquet",
+                    "second": bld / "cleaned_data" / "HHENDDAT_clean.parquet",
+                },
+                "produces": {
+                    "first": bld / "aggregated_data" / "PENDDAT_aggregated.parquet",
+                    "second": bld / "aggregated_data" / "HHENDDAT_aggregated.parquet",
+                },
+            },
+        )
+    )
+    tasks.append(
+        (
+            "task_merging",
+            task_cleaning.task_merging,
+            {
+                "depends_on": {
+                    "first": bld / "cleaned_data" / "hweights_clean.parquet",
+                    "second": bld / "cleaned_data" / "pweights_clean.parquet",
+                    "third": bld / "aggregated_data" / "HHENDDAT_aggregated.parquet",
+                    "fourth": bld / "aggregated_data" / "PENDDAT_aggregated.parquet",
+                },
+                "produces": {
+                    "first": bld / "final_data" / "merged_clean.parquet",
+                    "second": bld / "weighted_data" / "HHENDDAT_weighted.parquet",
+                    "third": bld / "weighted_data" / "PENDDAT_weighted.parquet",
+                    "fourth": bld / "final_data" / "merge_report.csv",
+                },
+            },
+        )
+    )
+    for i in ["HHENDDAT", "PENDDAT"]:
+        tasks.append(
+            (
+                f"task_creating_summary_stat_tex[{i}]",
+                task_stat.task_creating_summary_stat_tex,
+                {
+                    "depends_on": bld / "weighted_data" / f"{i}_weighted.parquet",
+                    "produces": {
+                        "table": bld / "paper" / f"{i}_stat.tex",
+                        "weighted": bld / "paper" / f"{i}_stat_weighted.tex",
+                        "waves": bld / "paper" / f"{i}_stat_waves.tex",
+                        "stats": bld / "paper" / f"{i}_stat.csv",
+                    },
+                    "i": i,
+                },
+            )
+        )
+    cubes = {
+        "first": bld / "figures" / "PENDDAT_cube.parquet",
+        "second": bld / "figures" / "HHENDDAT_cube.parquet",
+    }
+    tasks.append(
+        (
+            "task_aggregate_cube",
+            task_graph.task_aggregate_cube,
+            {
+                "depends_on": {
+                    "first": bld / "weighted_data" / "PENDDAT_weighted.parquet",
+                    "second": bld / "weighted_data" / "HHENDDAT_weighted.parquet",
+                },
+                "produces": cubes,
+            },
+        )
+    )
+    figures = task_graph.figure_jobs(folder=bld / "figures")
+    tasks.append(
+        (
+            "task_plotting_graphs",
+            task_graph.task_plotting_graphs,
+            {
+                "depends_on": {
+                    **cubes,
+                    "labels": bld / "cleaned_data" / "PENDDAT_labels.json",
+                },
+                "produces": {job: path for job, (_, _, path) in figures.items()},
+            },
+        )
+    )
+    return tasks
+
+
+def run_tasks(tasks, measure_task=None):
+    """This function runs tasks (see pipeline_tasks) like pytask does, after
+    creating the folders of their products.
+    Args:
+        tasks (list): Tuples of the name of the task, the task function and its
+        keyword arguments.
+        measure_task (function): Function which runs a task and returns its
+        measurement (e.g. the time). Default value is None, which only runs the
+        tasks.
+    Returns:
+        measurements (dict): Dictionary with the names of the tasks as keys and
+        the values returned by measure_task as values.
+    """
+    measurements = {}
+    for name, task, kwargs in tasks:
+        products = kwargs["produces"]
+        for path in products.values() if isinstance(products, dict) else [products]:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        if measure_task is None:
+            measurements[name] = task(**kwargs)
+        else:
+            measurements[name] = measure_task(task, **kwargs)
+    return measurements
+
+
+def _run_pipeline(original_data, bld, memory):
+    """Runs the tasks of the pipeline in an empty bld and measures each task once.
+    The tasks only process new waves, so a second run would not measure them."""
+    shutil.rmtree(bld, ignore_errors=True)
+    clear_artifact_cache()
+    tasks = pipeline_tasks(original_data, bld)
+    return run_tasks(tasks, _peak_mb if memory else _seconds)
+
+
+def benchmark_tasks(original_data, bld, repeat=1, memory=True):
+    """This function benchmarks each task of the pipeline on the datasets in
+    original_data. The pipeline is run repeat times in an empty bld and the fastest
+    run of each task is kept. The memory is measured in another run.
+    Args:
+        original_data (str, path object): The folder of the .dta files.
+        bld (str, path object): The folder of the products.
+        repeat (int): The number of timed runs. Default value is 1.
+        memory (bool): Whether the memory is measured. Default value is True.
+    Returns:
+        results (list): Dictionaries with the name, the time and the memory of
+        each task.
+    """
+    runs = [_run_pipeline(original_data, bld, memory=False) for _ in range(repeat)]
+    peaks = _run_pipeline(original_data, bld, memory=True) if memory else {}
+    return [
+        {
+            "kind": "task",
+            "name": name,
+            "seconds": min(run[name] for run in runs),
+            "peak_mb": peaks.get(name, np.nan),
+        }
+        for name in runs[0]
+    ]
+
+
+def run_benchmarks(scales=(1,), folder=BLD / "benchmarks", repeat=3, memory=True):
+    """This function runs the benchmark suite. For each scale it writes synthetic
+    datasets (see write_synthetic_data) and benchmarks the cleaning functions and
+    the tasks on them.
+    Args:
+        scales (list): The sizes of the datasets relative to the campus file
+        (e.g. [1, 10, 100]). Default value is (1,).
+        folder (str, path object): The folder of the synthetic datasets, the
+        products of the tasks and the results. Default value is
+        BLD/"benchmarks".
+        repeat (int): The number of timed runs of each function. The pipeline is
+        run once for the times of the tasks. Default value is 3.
+        memory (bool): Whether the memory is measured. Default value is True.
+    Returns:
+        results (pandas.DataFrame): The time and the memory of each function and
+        task at each scale (BENCHMARK_COLUMNS). They are also saved in
+        "benchmark.csv" in folder.
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    results = []
+    for scale in scales:
+        original_data = folder / f"original_data_{scale:g}"
+        paths = write_synthetic_data(original_data, scale)
+        rows = pd.read_stata(paths["PENDDAT"], columns=["pnr"]).shape[0]
+        measurements = benchmark_functions(original_data, repeat, memory)
+        measurements += benchmark_tasks(
+            original_data, folder / f"bld_{scale:g}", 1, memory
+        )
+        results += [
+            {"scale": scale, "rows": rows, **measurement}
+            for measurement in measurements
+        ]
+    results = pd.DataFrame(results, columns=BENCHMARK_COLUMNS)
+    results.to_csv(folder / "benchmark.csv", sep=";", index=False)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the cleaning functions and the tasks on synthetic data."
+    )
+    parser.add_argument("--scale", type=float, nargs="+", default=[1])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true")
+    arguments = parser.parse_args()
+    print(
+        run_benchmarks(
+            arguments.scale, repeat=arguments.repeat, memory=not arguments.no_memory
+        ).to_string(index=False)
+    )
@@ -1,5 +1,56 @@
+import os
 from pathlib import Path
 
 ROOT = Path(__file__).parent.parent
 SRC = Path(__file__).parent
-BLD = ROOT / "bld"
+
+# Share of the households of "original_data" which a development run uses, e.g.
+# 0.05. The sample keeps all waves and all persons of the sampled households (see
+# src/data_management/sampling.py) and the run is built in "bld/sample_{share}"
+# instead of "bld". It can also be set for one run with PASS_SAMPLE=0.05. None
+# uses all households.
+SAMPLE_FRACTION = (
+    float(os.environ["PASS_SAMPLE"]) if "PASS_SAMPLE" in os.environ else None
+)
+SAMPLE_SEED = 0
+
+if SAMPLE_FRACTION is None:
+    BLD = ROOT / "bld"
+    ORIGINAL_DATA = SRC / "original_data"
+else:
+    BLD = ROOT / "bld" / f"sample_{SAMPLE_FRACTION:g}"
+    ORIGINAL_DATA = BLD / "original_data"
+
+# Number of rows which are read at once from the .dta files in "original_data".
+# None reads the whole file at once, an integer streams the file in chunks.
+STATA_CHUNKSIZE = None
+
+# Number of processes which clean the columns of a .dta file in parallel.
+# 1 cleans each file in the process of its task. When the tasks themselves run
+# in parallel ("pytask -n 4" with pytask-parallel), keep this small.
+N_WORKERS = 1
+
+# Memory in bytes which the datasets loaded and saved by the tasks may use in the
+# cache of src/artifacts.py. 0 turns the cache off.
+ARTIFACT_CACHE_BYTES = 2 * 1024**3
+
+# Folder where the parsed renaming and .yaml files are saved by src/data_management/
+# metadata.py, so that other processes and later runs do not parse them again.
+# None keeps them in memory only.
+METADATA_CACHE = BLD / ".metadata_cache"
+
+# Number of bootstrap replicates and their seed for the standard errors of the
+# weighted means in the summary statistics (see src/final/variance.py). The
+# replicates are computed by N_WORKERS processes.
+BOOTSTRAP_REPLICATES = 200
+BOOTSTRAP_SEED = 0
+
+# Waves for which the figures by wave in src/final/figures.py are drawn, each as
+# its own file "{figure}_W{wave}.png" in "bld/figures".
+FIGURE_WAVES = [11]
+
+# Whether each call of the tasks and of the functions in cleaning_functions.py is
+# recorded in a run report in INSTRUMENTATION_FOLDER (see src/instrumentation.py).
+# It can also be turned on for one run with PASS_INSTRUMENTATION=1.
+INSTRUMENTATION = os.environ.get("PASS_INSTRUMENTATION", "0") == "1"
+INSTRUMENTATION_FOLDER = BLD / "instrumentation"
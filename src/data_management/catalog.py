@@ -0,0 +1,266 @@
+"""
+This file contains the functions which compile the metadata of all variables
+(renaming files, ranges, dummies and scales) into one variable catalog
+"""
+import pickle
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+from pathlib import Path
+
+import pandas as pd
+
+from src.config import BLD
+from src.config import SRC
+from src.data_management import dtypes
+from src.data_management import metadata
+from src.data_management.dtypes import declared_ranges
+from src.data_management.dtypes import plan_dtypes
+from src.data_management.metadata import load_dummies
+from src.data_management.metadata import load_ranges
+from src.data_management.metadata import load_renaming
+from src.data_management.metadata import read_scales
+from src.data_management.metadata import stage_digest
+
+CATALOG_PATH = BLD / "catalog" / "variable_catalog.pickle"
+
+CATALOG_COLUMNS = [
+    "raw_name",
+    "label",
+    "dtype",
+    "low",
+    "high",
+    "missing_codes",
+    "reverse",
+    "reversed_name",
+    "scale",
+    "facet",
+    "dummy",
+]
+
+_catalogs = {}
+_digests = {}
+
+
+@dataclass(frozen=True)
+class Catalog:
+    """The compiled variable catalog.
+    Attributes:
+        variables (pandas.DataFrame): One row for each variable of each dataset with
+        the index "dataset" and "name" and the columns of CATALOG_COLUMNS.
+        reverse (dict): Dictionary with dataset names as keys and dictionaries which
+        map the variables to be reversed to their reversed name and their declared
+        range (None if the range is not declared) as values.
+        facets (dict): Dictionary with the facets of the scale registry as keys and
+        the sets of their item columns as values.
+        registry (dict): The scale registry (see read_scales).
+        digest (str): The digest of the files the catalog was compiled from.
+    """
+
+    variables: pd.DataFrame
+    reverse: dict
+    facets: dict
+    registry: dict
+    digest: str
+
+    def variable(self, i, name):
+        """Returns the entry of a variable of a dataset as a dictionary or None."""
+        try:
+            return self.variables.loc[(i, name)].to_dict()
+        except KeyError:
+            return None
+
+
+def catalog_datasets():
+    """This function returns the names of the datasets which have a renaming file."""
+    return sorted(
+        path.parent.name
+        for path in (SRC / "data_management").glob("*/*_renaming.csv")
+        if path.name == f"{path.parent.name}_renaming.csv"
+    )
+
+
+def catalog_sources(names=None):
+    """This function returns the paths of the files the catalog is compiled from.
+    Args:
+        names (list): The names of the datasets. Default value is None, which uses
+        all datasets with a renaming file.
+    Returns:
+        sources (list): The paths of the renaming files, the existing .yaml files
+        and the modules which compile the catalog.
+    """
+    if names is None:
+        names = catalog_datasets()
+    sources = [SRC / f"data_management/{i}/{i}_renaming.csv" for i in names]
+    for folder in ["ranges", "dummies"]:
+        paths = [SRC / f"data_management/{folder}/{i}_{folder}.yaml" for i in names]
+        sources += [path for path in paths if path.exists()]
+    sources.append(SRC / "data_management/scales/PENDDAT_scales.yaml")
+    modules = [metadata.__file__, dtypes.__file__, __file__]
+    return sources + [Path(module) for module in modules]
+
+
+def _facets(registry):
+    """Returns the facets of the registry as (scale, facet, pattern, exclude)."""
+    return [
+        (scale, facet, pattern, specification.get("exclude"))
+        for scale, specification in registry.items()
+        for facet, pattern in specification["facets"].items()
+    ]
+
+
+def _dummy_specs(i):
+    """Returns the dummy specification of each variable of a dataset."""
+    path = SRC / f"data_management/dummies/{i}_dummies.yaml"
+    if not path.exists():
+        return {}
+    dummies = load_dummies(i, path)
+    specs = dict(dummies.specs)
+    for item in dummies.deprivation:
+        for answer in "ab":
+            specs[f"{item}{answer}"] = {"deprivation": item}
+    return specs
+
+
+def _dataset_variables(i, facets):
+    """Returns the entries of the variables of a dataset."""
+    renaming = load_renaming(i)
+    table = renaming.table
+    labels = table["labels"] if "labels" in table else [None] * len(table)
+    names = [
+        new_name if pd.notna(new_name) else raw_name
+        for raw_name, new_name in zip(table["raw_name"], table["new_name"])
+    ]
+    reversed_names = {
+        name: name.replace("_neg", "") for name in names if "_neg" in str(name)
+    }
+    bounds = declared_ranges(names + list(reversed_names.values()), load_ranges(i))
+    declared = {name: bounds[name] for name in names if name in bounds}
+    planned = plan_dtypes(pd.Series("float64", index=list(declared)), declared, {})
+    dummies = _dummy_specs(i)
+    rows = []
+    for raw_name, label, name in zip(table["raw_name"], labels, names):
+        # the items of a scale are the reversed versions of the reversed variables
+        item = reversed_names.get(name, name)
+        scale = facet = None
+        if i == "PENDDAT":
+            for scale_name, facet_name, pattern, exclude in facets:
+                if fnmatchcase(item, pattern) and not (
+                    exclude and fnmatchcase(item, exclude)
+                ):
+                    scale, facet = scale_name, facet_name
+                    break
+        low, high = declared.get(name, (None, None))
+        rows.append(
+            {
+                "dataset": i,
+                "name": name,
+                "raw_name": raw_name,
+                "label": label if pd.notna(label) else None,
+                "dtype": planned.get(name),
+                "low": low,
+                "high": high,
+                "missing_codes": renaming.missing_codes.get(name),
+                "reverse": name in reversed_names,
+                "reversed_name": reversed_names.get(name),
+                "scale": scale,
+                "facet": facet,
+                "dummy": dummies.get(name),
+            }
+        )
+    reverse = {
+        name: (reversed_name, bounds.get(name))
+        for name, reversed_name in reversed_names.items()
+    }
+    return rows, reverse
+
+
+def compile_catalog(names=None):
+    """This function compiles the metadata of the variables of the datasets into
+    one catalog. For each variable it holds the raw and the new name, the label,
+    the dtype of its declared range, its range and missing codes, whether it is
+    reversed (new names ending in "_neg"), the scale and facet it belongs to and
+    the specification of its dummy. The naming conventions are resolved once
+    here, so that the cleaning functions look the variables up instead of
+    matching patterns against the columns of each dataset.
+    Args:
+        names (list): The names of the datasets. Default value is None, which uses
+        all datasets with a renaming file.
+    Returns:
+        catalog (Catalog): The compiled catalog.
+    """
+    if names is None:
+        names = catalog_datasets()
+    registry = read_scales()
+    facets = _facets(registry)
+    rows, reverse = [], {}
+    for i in names:
+        dataset_rows, reverse[i] = _dataset_variables(i, facets)
+        rows += dataset_rows
+    variables = pd.DataFrame(rows, columns=["dataset", "name"] + CATALOG_COLUMNS)
+    variables = variables.astype({"low": "Int64", "high": "Int64"}).set_index(
+        ["dataset", "name"]
+    )
+    members = {facet: set() for _, facet, _, _ in facets}
+    for (_, name), reversed_name, facet in variables.loc[
+        variables["facet"].notna(), ["reversed_name", "facet"]
+    ].itertuples():
+        members[facet].add(reversed_name if reversed_name else name)
+    return Catalog(
+        variables,
+        reverse,
+        {facet: frozenset(items) for facet, items in members.items()},
+        registry,
+        stage_digest(*catalog_sources(names)),
+    )
+
+
+def save_catalog(catalog, path=CATALOG_PATH):
+    """This function saves the catalog as a pickle file."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as stream:
+        pickle.dump(catalog, stream, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_catalog(path=CATALOG_PATH):
+    """This function loads the variable catalog. The catalog saved in path is used
+    if it was compiled from the current renaming and .yaml files. Otherwise it is
+    compiled again (see compile_catalog). The digest of the files is computed once
+    in each process (see catalog_digest) and the catalog is kept in memory for
+    each digest, so that the later calls neither read nor hash any file.
+    Args:
+        path (str, path object): The path of the saved catalog. Default value is
+        CATALOG_PATH.
+    Returns:
+        catalog (Catalog): The variable catalog.
+    """
+    digest = catalog_digest()
+    catalog = _catalogs.get(digest)
+    if catalog is None:
+        path = Path(path)
+        if path.exists():
+            with open(path, "rb") as stream:
+                catalog = pickle.load(stream)
+        if catalog is None or catalog.digest != digest:
+            catalog = compile_catalog()
+        _catalogs[digest] = catalog
+    return catalog
+
+
+def catalog_digest():
+    """This function returns the digest of the sources of the catalog (see
+    catalog_sources). It is computed once in each process, since the sources do
+    not change during a run. A process which changes them has to call
+    clear_catalog_cache.
+    Returns:
+        digest (str): The digest of the sources (see stage_digest).
+    """
+    if "sources" not in _digests:
+        _digests["sources"] = stage_digest(*catalog_sources())
+    return _digests["sources"]
+
+
+def clear_catalog_cache():
+    """This function removes the loaded catalogs and the digest of their sources
+    from memory. The catalog saved in CATALOG_PATH is kept."""
+    _catalogs.clear()
+    _digests.clear()
@@ -1,137 +1,373 @@
-import glob
+from fnmatch import fnmatchcase
+from functools import lru_cache
+from itertools import chain
 from pathlib import Path
-from sys import platform
 
 import numpy as np
 import pandas as pd
-import yaml
 
-from src.config import SRC
+from src.config import ORIGINAL_DATA
+from src.data_management.catalog import load_catalog
+from src.data_management.dtypes import declared_ranges
+from src.data_management.metadata import load_dummies
+from src.data_management.metadata import load_renaming
+from src.instrumentation import instrument
 
 
-def get_names_dataset(path=SRC / "original_data"):
+@instrument
+def get_names_dataset(path=ORIGINAL_DATA):
     """This function extract the name of the data set in "origina_data" folder
     Args:
         path (str, path object): The path to the folder where original data is stored.
-        Default value is SRC/"original_data".
+        Default value is ORIGINAL_DATA in "src/config.py".
     Returns:
         name (list): the list containing the names of dataset.
     """
-    if platform == "win32":  # here differantia between operating system
-        a = r"\*"
-        b = "\\"
-    elif platform == "darwin":
-        a = r"/*"
-        b = "/"
+    files = sorted(Path(path).glob("*.dta"))
+    name = [file.name.split("_")[0] for file in files]
+    return list(dict.fromkeys(name))  # one name for several releases of a dataset
 
-    files = list(glob.glob(str(path) + f"{a}"))
-    name = []
-    for i in range(len(files)):
-        name.append(files[i].split(f"{b}")[-1].split("_")[0])
-    return name
 
+@instrument
+def get_release(i, path=ORIGINAL_DATA):
+    """This function finds the latest release of a dataset in "original_data".
+    The releases are named "{i}_cf_W{wave}.dta" after the last wave they contain.
+    Args:
+        i (str): The name of the dataset.
+        path (str, path object): The path to the folder where original data is stored.
+        Default value is ORIGINAL_DATA in "src/config.py".
+    Returns:
+        release (path object): The path of the release with the highest wave.
+    """
+    releases = {
+        int(file.stem.rsplit("_W", 1)[1]): file
+        for file in Path(path).glob(f"{i}_cf_W*.dta")
+        if file.stem.rsplit("_W", 1)[1].isdigit()
+    }
+    if not releases:
+        raise FileNotFoundError(f"There is no release of {i} in {path}.")
+    return releases[max(releases)]
+
+
+MISSING_CODES = list(range(-1, -11, -1))
+
+
+@instrument
+def read_renaming(i):
+    """This function reads the renaming file of a dataset.
+    Args:
+        i (str): The name of the dataset.
+    Returns:
+        renaming (pandas.DataFrame): The content of "{i}_renaming.csv" with the
+        columns "raw_name", "labels" and "new_name".
+    """
+    return load_renaming(i).table.copy()
+
+
+def _is_code_range(codes):
+    """Checks whether the missing codes form a contiguous range of integers."""
+    return len(codes) > 1 and list(codes) == list(range(codes[0], codes[-1] + 1))
 
+
+def _mask_block(block, codes):
+    """Masks the missing codes of a block of columns sharing the same dtype.
+    The whole block is compared against the missing codes in one vectorized
+    operation, for integer blocks with contiguous codes as one range check.
+    Integer columns are returned as nullable integer arrays of the same width and
+    float columns as float arrays with NaN.
+    Args:
+        block (pandas.DataFrame): Columns with the same dtype and missing codes.
+        codes (tuple): Sorted codes which are treated as missing.
+    Returns:
+        masked (dict): Dictionary with column names as keys and masked arrays as values.
+    """
+    dtype = block.dtypes.iloc[0]
+    if not pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+        return {column: block[column] for column in block}
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        # already nullable, fill missing values with a missing code to mask them again
+        numpy_dtype = dtype.numpy_dtype
+        values = block.to_numpy(dtype=numpy_dtype, na_value=codes[0]).T
+    else:
+        numpy_dtype = dtype
+        values = block.to_numpy().T
+    if np.issubdtype(numpy_dtype, np.integer) and _is_code_range(codes):
+        # integers between the codes are codes, floats such as -2.5 are not
+        mask = (values >= codes[0]) & (values <= codes[-1])
+    else:
+        mask = np.isin(values, codes)
+    if np.issubdtype(numpy_dtype, np.integer):
+        return {
+            column: pd.arrays.IntegerArray(
+                np.ascontiguousarray(values[j]), np.ascontiguousarray(mask[j])
+            )
+            for j, column in enumerate(block.columns)
+        }
+    values = values.copy()
+    values[mask] = np.nan
+    return {column: values[j] for j, column in enumerate(block.columns)}
+
+
+@instrument
+def mask_missing_codes(df, missing_codes=None, default_codes=None):
+    """This function replaces the missing codes of the dataset with missing values.
+    Columns with the same dtype and the same missing codes are masked together
+    as one block, so the whole frame is scanned once instead of once per code.
+    Integer columns are converted to nullable integer columns of the same width
+    (e.g. int8 to Int8) instead of being upcasted to float64.
+    Args:
+        df (pandas.DataFrame): The dataframe whose missing codes are replaced.
+        missing_codes (dict): Dictionary with column names as keys and lists of
+        codes which are treated as missing for this column as values.
+        default_codes (list): List of codes which are treated as missing for the
+        columns not given in missing_codes. Default values are all negative
+        integers from -1 to -10.
+    Returns:
+        df (pandas.DataFrame): The dataframe without missing codes.
+    """
+    if default_codes is None:
+        default_codes = MISSING_CODES
+    if missing_codes is None:
+        missing_codes = {}
+    blocks = {}
+    for column, dtype in df.dtypes.items():
+        codes = tuple(sorted(missing_codes.get(column, default_codes)))
+        blocks.setdefault((codes, dtype), []).append(column)
+    masked = {}
+    for (codes, _dtype), columns in blocks.items():
+        masked.update(_mask_block(df[columns], codes))
+    return pd.DataFrame(masked, index=df.index, columns=df.columns)
+
+
+@instrument
 def clean_data(df, i, negatives=None):
-    """This function does the bacis cleaning. It renames the columns of the dataset based
-        on the csv file provided and replaces the negative values in the dataset with NaN.
+    """This function does the bacis cleaning. It renames the columns of the dataset
+    based on the raw names in the csv file provided and replaces the missing codes
+    in the dataset with missing values (see mask_missing_codes).
     Args:
         df (pandas.DataFrame): The dataframe to be cleaned.
         i (str): The name of the dataset.
-        negatives(list) : List of negative integars which is replaced by NaN. Default values are
-        all negative integars from -1 to -11.
+        negatives(list) : List of negative integars which is replaced by NaN.
+        Default values are all negative integars from -1 to -10. Variables with
+        their own missing codes in the "missing_codes" column of the csv file use
+        those instead.
     Returns:
-        df (pandas.DataFrame): The dataframe with new column names and without negative values.
+        df (pandas.DataFrame): The dataframe with new column names and without
+        negative values.
     """
-    if negatives is None:
-        negatives = list(range(-1, -11, -1))
-
-    new_names = pd.read_csv(SRC / f"data_management/{i}/{i}_renaming.csv", sep=";")[
-        "new_name"
-    ]  # reading the new column names form csv file
-    renaming_dict = dict(zip(df.columns, new_names))
-    renaming_dict = {
-        k: v for k, v in renaming_dict.items() if pd.notna(v)
-    }  # Deleting NA values (column names whose new name is not given in the csv file)
-    df = df.rename(columns=renaming_dict)
-    for i in negatives:
-        df[df == i] = np.nan
-    return df
-
-
-def reverse_code(df):
+    renaming = load_renaming(i)
+    df = df.rename(columns=renaming.names)
+    return mask_missing_codes(df, renaming.missing_codes, negatives)
+
+
+@instrument
+def reverse_code(df, i="PENDDAT", ranges=None):
     """This function reversed the values of the pre-determined variables.
     Those values are determined in csv file
-    by adding "_neg" to their new name
+    by adding "_neg" to their new name.
+    All these variables are reversed at once using the lowest and highest value of
+    their scale from the ranges file of the dataset, so that a reversed value
+    is lowest + highest - value and does not depend on the values in the data.
     Args:
         df (pandas.DataFrame): The dataframe whose variables is going to be reversed
+        i (str): The name of the dataset. Default value is "PENDDAT".
+        ranges (dict): The declared ranges (see src.data_management.metadata.load_ranges).
+        Default value is None, which looks the variables to be reversed and their
+        ranges up in the variable catalog (see src.data_management.catalog).
     Returns:
         df (pandas.DataFrame): The dataframe with new reversed variables.
+    Raises:
+        ValueError: If a variable to be reversed has no declared range.
     """
-    for i in df:
-        if (f"{i}" in df.filter(regex="_neg")) is True:
-            new_column_name = i.replace("_neg", "")
-            value_to_be_used = df[i].max() + 1
-            df[new_column_name] = value_to_be_used - df[i]
-    return df
+    if ranges is None:
+        reverse = load_catalog().reverse.get(i, {})
+        negatives = [column for column in df.columns if column in reverse]
+        names = [reverse[column][0] for column in negatives]
+        bounds = {
+            column: reverse[column][1]
+            for column in negatives
+            if reverse[column][1] is not None
+        }
+    else:
+        negatives = [column for column in df.columns if "_neg" in str(column)]
+        names = [column.replace("_neg", "") for column in negatives]
+        bounds = declared_ranges(negatives, ranges)
+    undeclared = [column for column in negatives if column not in bounds]
+    if undeclared:
+        raise ValueError(
+            f"The variables {undeclared} have no range in {i}_ranges.yaml "
+            "to be reversed."
+        )
+    values = df[negatives].to_numpy(dtype="float64", na_value=np.nan)
+    total = np.array([sum(bounds[column]) for column in negatives], dtype="float64")
+    reversed_values = pd.DataFrame(total - values, index=df.index, columns=names)
+    return pd.concat([df.drop(columns=names, errors="ignore"), reversed_values], axis=1)
 
 
+@lru_cache(maxsize=None)
+def _resolve_facets(columns, facets):
+    """Returns the item columns of each facet given as (name, pattern, exclude)."""
+    return tuple(
+        [
+            column
+            for column in columns
+            if fnmatchcase(column, pattern)
+            and not (exclude and fnmatchcase(column, exclude))
+        ]
+        for _, pattern, exclude in facets
+    )
+
+
+@instrument
+def aggregate_scales(df, registry=None, scales=None):
+    """This function aggregates the items of the scales in the registry into
+    their facets (see read_scales). The item columns of each facet are resolved
+    once against the columns of the dataset and the items of all facets are
+    stacked into one array, so that all facets are computed in one pass.
+    A facet is the mean or the sum of its answered items and is missing if fewer
+    than min_valid of its items are answered.
+    Args:
+        df (pandas.DataFrame): The dataframe which has the scale items (PENDDAT)
+        registry (dict): The scale registry. Default value is None, which takes the
+        registry and the items of its facets from the variable catalog
+        (see src.data_management.catalog).
+        scales (list): The names of the scales to be aggregated. Default value is
+        None, which aggregates all scales of the registry.
+    Returns:
+        df (pandas.DataFrame): The dataframe with a new column for each facet.
+    """
+    catalog = None
+    if registry is None:
+        catalog = load_catalog()
+        registry = catalog.registry
+    if scales is None:
+        scales = list(registry)
+    facets, rules = [], []
+    for name in scales:
+        scale = registry[name]
+        for facet, pattern in scale["facets"].items():
+            facets.append((facet, pattern, scale.get("exclude")))
+            rules.append((scale.get("score", "mean"), scale.get("min_valid", 1)))
+    names = [facet for facet, _, _ in facets]
+    columns = tuple(str(column) for column in df.columns if column not in names)
+    if catalog is None:
+        items = _resolve_facets(columns, tuple(facets))
+    else:
+        items = [
+            [column for column in columns if column in catalog.facets[facet]]
+            for facet in names
+        ]
+    values = df[list(chain.from_iterable(items))].to_numpy(
+        dtype="float64", na_value=np.nan
+    )
+    valid = ~np.isnan(values)
+    sizes = np.array([len(facet_items) for facet_items in items])
+    starts = np.r_[0, np.cumsum(sizes)[:-1]]
+    sums = np.full((len(df), len(facets)), np.nan)
+    counts = np.zeros((len(df), len(facets)))
+    used = sizes > 0
+    if used.any():
+        sums[:, used] = np.add.reduceat(
+            np.where(valid, values, 0), starts[used], axis=1
+        )
+        counts[:, used] = np.add.reduceat(valid, starts[used], axis=1)
+    score = np.array([rule == "mean" for rule, _ in rules])
+    min_valid = np.array([max(minimum, 1) for _, minimum in rules])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scores = np.where(score, sums / counts, sums)
+    scores[counts < min_valid] = np.nan
+    aggregated = pd.DataFrame(scores, index=df.index, columns=names)
+    return pd.concat([df.drop(columns=names, errors="ignore"), aggregated], axis=1)
+
+
+@instrument
 def average_big5(df):
     """This function aggregates the variable for big5 classification
-     by taking their mean for each observation
+     by taking their mean for each observation (see aggregate_scales)
      Args:
         df (pandas.DataFrame): The dataframe which has big5 variables (PENDDAT)
     Returns:
         df (pandas.DataFrame): The dataframe with new aggreagted
          big5 variables."""
-    facets_b5 = ["ext", "agree", "consc", "neu", "open"]
-    for i in facets_b5:
-        df[f"b5_{i}"] = (
-            df[df.columns.drop(list(df.filter(regex="_neg")))]
-            .filter(regex=f"b5_{i}")
-            .mean(axis=1)
-        )
-    return df
+    return aggregate_scales(df, scales=["big5"])
 
 
+@instrument
 def average_eri(df):
     """This function aggregates the variables in the Effort-Reward Module
     according to the PASS Scales Manual. It averages the facets after
-    droping the negatively phrased variables.
+    droping the negatively phrased variables (see aggregate_scales).
      Args:
         df (pandas.DataFrame): The dataframe which has Effort-Reward Module
         variables (PENDDAT)
     Returns:
         df (pandas.DataFrame): The dataframe with new aggreagted
          Effort-Reward Module variables."""
-    facets_eri = ["effort", "reward"]
-    for i in facets_eri:
-        df[f"eri_{i}"] = (
-            df[df.columns.drop(list(df.filter(regex="_neg")))]
-            .filter(regex=f"eri_{i}")
-            .mean(axis=1)
-        )
-    return df
+    return aggregate_scales(df, scales=["eri"])
 
 
+@instrument
 def average_genrole(df):
     """This function aggregates the variable for traditional gender role
-     by taking their mean for each observation
+     by taking their mean for each observation (see aggregate_scales)
      Args:
         df (pandas.DataFrame): The dataframe which has traditional
          gender role variables (PENDDAT)
     Returns:
         df (pandas.DataFrame): The dataframe with new aggreagted
          traditional gender role variable."""
-    df["genrole_traditional"] = df.filter(regex="traditional").mean(axis=1)
-    return df
+    return aggregate_scales(df, scales=["genrole"])
+
+
+@instrument
+def encode_dummies(df, specs, dtype="float64"):
+    """This function creates the dummies of all variables at once.
+    The variables are stacked into one array, all dummies are computed with one
+    comparison and the new columns are added to the dataset in one step.
+    The dummies are missing where the original variable is missing.
+    Args:
+        df (pandas.DataFrame): The dataframe to create dummies for.
+        specs (dict): The dummy specifications (see read_dummy_specs).
+        dtype (str): The dtype of the dummies, either "float64", "boolean" or
+        "Sparse" (sparse float64 with 0 as fill value). Default value is "float64".
+    Returns:
+        df (pandas.DataFrame): The dataframe with a column {variable_name}_dummy
+        for each variable.
+    """
+    variables = list(specs)
+    values = df[variables].to_numpy(dtype="float64", na_value=np.nan)
+    missing = np.isnan(values)
+    one = np.array([spec.get("one", np.nan) for spec in specs.values()])
+    threshold = np.array([spec.get("greater_than", np.nan) for spec in specs.values()])
+    with np.errstate(invalid="ignore"):
+        ones = np.where(np.isnan(threshold), values == one, values > threshold)
+    names = [f"{variable}_dummy" for variable in variables]
+    if dtype == "boolean":
+        columns = {
+            name: pd.arrays.BooleanArray(ones[:, j].copy(), missing[:, j].copy())
+            for j, name in enumerate(names)
+        }
+        dummies = pd.DataFrame(columns, index=df.index)
+    else:
+        dummies = ones.astype("float64")
+        dummies[missing] = np.nan
+        dummies = pd.DataFrame(dummies, index=df.index, columns=names)
+        if dtype == "Sparse":
+            dummies = dummies.astype(pd.SparseDtype("float64", 0.0))
+        elif dtype != "float64":
+            raise ValueError(f"The dtype {dtype} is not supported for dummies.")
+    return pd.concat([df.drop(columns=names, errors="ignore"), dummies], axis=1)
 
 
-def create_dummies(df_p, df_h, dummies_p=None, dummies_h=None):
+@instrument
+def create_dummies(df_p, df_h, dummies_p=None, dummies_h=None, dtype="float64"):
     """This function creates dummies for the variables provided in a .yaml file.
     It preserves the original values and
     adds another column to dataset with name {variable_name}_dummy.
     This function creates dummies for variable which has
     two possible answer (e.g. Yes=1,No=2).This variables are coded as "others" in .yaml file.
+    Variables with another coding are given with their specification in the .yaml
+    file (see read_dummy_specs).
     Args:
         df_p (pandas.DataFrame): Personal dataset(PENDDAT) to create dummies
         df_h (pandas.DataFrame): Household dataset(HHENDDAT) to create dummies
@@ -139,81 +375,102 @@ def create_dummies(df_p, df_h, dummies_p=None, dummies_h=None):
         from Personal dataset (PENDDAT) whose dummies are going to be created
         dummies_h (str,path object) : Path to the .yaml file containing the list of variables
         from Households dataset (HHENDDAT) whose dummies are going to be created
+        dtype (str): The dtype of the dummies (see encode_dummies).
     Returns:
         df_p (pandas.DataFrame): Personal dataset(PENDDAT) with dummy variables
         df_h (pandas.DataFrame): Household dataset(HHENDDAT) with dummy variables
     """
-    if dummies_p is None:
-        dummies_p = Path(SRC / "data_management/dummies/PENDDAT_dummies.yaml")
-    if dummies_h is None:
-        dummies_h = Path(SRC / "data_management/dummies/HHENDDAT_dummies.yaml")
-    with open(dummies_p) as stream:
-        dummies_p = yaml.safe_load(stream)
-    with open(dummies_h) as stream:
-        dummies_h = yaml.safe_load(stream)
-    for dummies in dummies_p:
-        if dummies == "PG0100":
-            df_p[f"{dummies}_dummy"] = (df_p[f"{dummies}"] > 0).astype(int)
-            df_p.loc[df_p[f"{dummies}"].isna(), [f"{dummies}_dummy"]] = np.nan
-        elif dummies == "migration":  # becuase migration has reversed value in dummies
-            df_p = pd.concat(
-                [
-                    df_p,
-                    pd.get_dummies(
-                        df_p[f"{dummies}"], prefix=f"{dummies}", dummy_na=True
-                    ).rename(columns={f"{dummies}_2.0": f"{dummies}_dummy"}),
-                ],
-                axis=1,
-            ).drop(f"{dummies}_1.0", axis=1)
-            df_p.loc[df_p[f"{dummies}_nan"] == 1, [f"{dummies}_dummy"]] = np.nan
-            df_p.drop(f"{dummies}_nan", axis=1, inplace=True)
-        else:
-            df_p = pd.concat(
-                [
-                    df_p,
-                    pd.get_dummies(
-                        df_p[f"{dummies}"], prefix=f"{dummies}", dummy_na=True
-                    ).rename(columns={f"{dummies}_1.0": f"{dummies}_dummy"}),
-                ],
-                axis=1,
-            ).drop(f"{dummies}_2.0", axis=1)
-            df_p.loc[df_p[f"{dummies}_nan"] == 1, [f"{dummies}_dummy"]] = np.nan
-            df_p.drop(f"{dummies}_nan", axis=1, inplace=True)
-    for dummies in dummies_h["others"]:
-        df_h = pd.concat(
-            [
-                df_h,
-                pd.get_dummies(
-                    df_h[f"{dummies}"], prefix=f"{dummies}", dummy_na=True
-                ).rename(columns={f"{dummies}_1.0": f"{dummies}_dummy"}),
-            ],
-            axis=1,
-        ).drop(f"{dummies}_2.0", axis=1)
-        df_h.loc[df_h[f"{dummies}_nan"] == 1, [f"{dummies}_dummy"]] = np.nan
-        df_h.drop(f"{dummies}_nan", axis=1, inplace=True)
+    df_p = encode_dummies(df_p, load_dummies("PENDDAT", dummies_p).specs, dtype)
+    df_h = encode_dummies(df_h, load_dummies("HHENDDAT", dummies_h).specs, dtype)
     return (df_p, df_h)
 
 
-def create_dummies_depr(df_h, dummies_h=None):
+@instrument
+def deprivation_weights(dummies):
+    """This function computes the default item weights of the weighted deprivation
+    index. The weight of an item is the share of households which are not deprived
+    of the item for financial reasons, so that lacking a common item counts more.
+    Args:
+        dummies (numpy.ndarray): The deprivation dummies with one column per item.
+    Returns:
+        weights (numpy.ndarray): The weight of each item.
+    """
+    with np.errstate(invalid="ignore"):
+        return 1 - np.nanmean(dummies, axis=0)
+
+
+def _deprivation_index(dummies, items, weights=None):
+    """Returns the unweighted and the weighted deprivation index of the dummies.
+    The indices are missing if all items are missing."""
+    if weights is None:
+        weights = deprivation_weights(dummies)
+    else:
+        weights = np.array([weights[item] for item in items], dtype="float64")
+    answered = (~np.isnan(dummies)).any(axis=1)
+    return (
+        np.where(answered, np.nansum(dummies, axis=1), np.nan),
+        np.where(answered, np.nansum(dummies * weights, axis=1), np.nan),
+    )
+
+
+@instrument
+def create_dummies_depr(df_h, dummies_h=None, items=None, weights=None):
     """This function creates dummies for the deprivation variables provided in a .yaml file.
     It preserves the original values and
     adds another column to dataset with name {variable_name}_dummy.
     This variables are coded as "deprivation" in .yaml file.
     Only household dataset contains deprivation variables.
+    The dummy is 1 if the household does not have the item for financial reasons ("b" is 1),
+    0 if it has the item ("a" is 1) or lacks it for other reasons ("b" is 2).
+    The "a" and "b" variables of all items are stacked into two arrays and all dummies
+    are computed at once. From the dummies it also computes an unweighted deprivation
+    index "depr_index_items" (number of items lacked for financial reasons) and a
+    weighted index "depr_index_items_w".
     Args:
         df_h (pandas.DataFrame): Household dataset(HHENDDAT) to create dummies
         dummies_h (str,path object or file-like object) : Path to the .yaml file
         containing the list of deprivation variables
         from Households dataset (HHENDDAT) whose dummies are going to be created
+        items (list): List of deprivation items (e.g. "HLS0100") to be used instead of
+        the list in the .yaml file.
+        weights (dict): Dictionary with items as keys and their weight in the weighted
+        index as values. Default value is None, which uses deprivation_weights.
     Returns:
         df_h (pandas.DataFrame): Household dataset(HHENDDAT) with dummy variables
     """
-    if dummies_h is None:
-        dummies_h = Path(SRC / "data_management/dummies/HHENDDAT_dummies.yaml")
-    with open(dummies_h) as stream:
-        dummies_h = yaml.safe_load(stream)
-    for dummies in dummies_h["deprivation"]:
-        df_h.loc[df_h[f"{dummies}b"] == 1, f"{dummies}_dummy"] = 1
-        df_h.loc[df_h[f"{dummies}b"] == 2, f"{dummies}_dummy"] = 0
-        df_h.loc[df_h[f"{dummies}a"] == 1, f"{dummies}_dummy"] = 0
+    if items is None:
+        items = load_dummies("HHENDDAT", dummies_h).deprivation
+    a = df_h[[f"{item}a" for item in items]].to_numpy(dtype="float64", na_value=np.nan)
+    b = df_h[[f"{item}b" for item in items]].to_numpy(dtype="float64", na_value=np.nan)
+    dummies = np.select([a == 1, b == 1, b == 2], [0.0, 1.0, 0.0], np.nan)
+    depr = pd.DataFrame(
+        dummies, index=df_h.index, columns=[f"{item}_dummy" for item in items]
+    )
+    depr["depr_index_items"], depr["depr_index_items_w"] = _deprivation_index(
+        dummies, items, weights
+    )
+    return pd.concat([df_h.drop(columns=depr.columns, errors="ignore"), depr], axis=1)
+
+
+@instrument
+def update_deprivation_weights(df_h, dummies_h=None, items=None):
+    """This function recomputes the weighted deprivation index from the deprivation
+    dummies of all rows. The default weights depend on all waves in the dataset
+    (see deprivation_weights), so the index has to be recomputed whenever waves
+    are added to the dataset.
+    Args:
+        df_h (pandas.DataFrame): Household dataset(HHENDDAT) with deprivation dummies
+        dummies_h (str,path object or file-like object) : Path to the .yaml file
+        containing the list of deprivation variables.
+        items (list): List of deprivation items to be used instead of
+        the list in the .yaml file.
+    Returns:
+        df_h (pandas.DataFrame): Household dataset(HHENDDAT) with the recomputed index
+    """
+    if items is None:
+        items = load_dummies("HHENDDAT", dummies_h).deprivation
+    dummies = df_h[[f"{item}_dummy" for item in items]].to_numpy(
+        dtype="float64", na_value=np.nan
+    )
+    df_h["depr_index_items_w"] = _deprivation_index(dummies, items)[1]
     return df_h
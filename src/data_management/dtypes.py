@@ -0,0 +1,222 @@
+"""
+This file contains the functions which choose the smallest dtype
+for each variable of a dataset
+"""
+from fnmatch import fnmatchcase
+
+import numpy as np
+import pandas as pd
+
+from src.data_management.metadata import load_ranges
+
+INTEGER_DTYPES = ["Int8", "Int16", "Int32", "Int64"]
+
+
+def declared_ranges(columns, ranges):
+    """This function matches the columns of a dataset with the declared ranges.
+    If a column matches several patterns, the first one is used.
+    Args:
+        columns (list): The column names.
+        ranges (dict): Dictionary with patterns as keys and [lowest, highest] as values.
+    Returns:
+        declared (dict): Dictionary with column names as keys and (lowest, highest) as values.
+    """
+    declared = {}
+    for column in columns:
+        for pattern, (low, high) in ranges.items():
+            if fnmatchcase(str(column), pattern):
+                declared[column] = (low, high)
+                break
+    return declared
+
+
+def observed_ranges(df):
+    """This function computes the lowest and highest value of the integer columns.
+    Args:
+        df (pandas.DataFrame): The dataframe.
+    Returns:
+        observed (dict): Dictionary with column names as keys and (lowest, highest) as
+        values. Columns with only missing values are left out.
+    """
+    observed = {}
+    for column, dtype in df.dtypes.items():
+        if pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+            low, high = df[column].min(), df[column].max()
+            if pd.notna(low):
+                observed[column] = (int(low), int(high))
+    return observed
+
+
+def _smallest_integer_dtype(low, high):
+    """Returns the smallest nullable integer dtype which contains low and high."""
+    for dtype in INTEGER_DTYPES:
+        info = np.iinfo(dtype.lower())
+        if info.min <= low and high <= info.max:
+            return dtype
+    raise ValueError(f"There is no integer dtype for values from {low} to {high}.")
+
+
+def plan_dtypes(dtypes, declared, observed, has_missing=None):
+    """This function chooses the smallest dtype for each column.
+    Columns with a declared range and integer columns are stored as the smallest
+    nullable integer dtype which contains their range. Declared 0/1 columns without
+    missing values are stored as bool. String columns are stored as category.
+    Float columns without a declared range keep their dtype.
+    Args:
+        dtypes (pandas.Series): The current dtypes of the columns.
+        declared (dict): The declared ranges of the columns (see declared_ranges).
+        observed (dict): The observed ranges of the columns (see observed_ranges).
+        has_missing (dict): Dictionary with column names as keys and whether the column
+        contains missing values as values. Default value is None, which treats all
+        columns as containing missing values.
+    Returns:
+        plan (dict): Dictionary with column names as keys and the chosen dtypes as values.
+    Raises:
+        ValueError: If the observed values of a column are outside its declared range.
+    """
+    if has_missing is None:
+        has_missing = {}
+    plan = {}
+    for column, dtype in dtypes.items():
+        if column in declared:
+            low, high = declared[column]
+            if column in observed:
+                if observed[column][0] < low or observed[column][1] > high:
+                    raise ValueError(
+                        f"The values of {column} are outside the range from {low} to "
+                        f"{high} given in the ranges file."
+                    )
+            if (low, high) == (0, 1) and not has_missing.get(column, True):
+                plan[column] = "bool"
+            else:
+                plan[column] = _smallest_integer_dtype(low, high)
+        elif column in observed and not pd.api.types.is_bool_dtype(dtype):
+            plan[column] = _smallest_integer_dtype(*observed[column])
+        elif pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype):
+            plan[column] = "category"
+        else:
+            plan[column] = dtype
+    return plan
+
+
+def dtype_plan(i, dtypes, observed, has_missing, ranges=None):
+    """This function chooses the smallest dtype for each column of a dataset
+    using the declared ranges of the dataset (see plan_dtypes).
+    Args:
+        i (str): The name of the dataset.
+        dtypes (pandas.Series): The current dtypes of the columns.
+        observed (dict): The observed ranges of the columns.
+        has_missing (dict): Whether the columns contain missing values.
+        ranges (dict): The declared ranges. Default value is None, which loads
+        them from the ranges file of the dataset.
+    Returns:
+        plan (dict): Dictionary with column names as keys and the chosen dtypes as values.
+    """
+    if ranges is None:
+        ranges = load_ranges(i)
+    declared = declared_ranges(dtypes.index, ranges)
+    return plan_dtypes(dtypes, declared, observed, has_missing)
+
+
+def apply_dtypes(df, plan):
+    """This function converts the columns of a dataframe whose dtype differs from the plan."""
+    changed = {
+        column: dtype
+        for column, dtype in plan.items()
+        if column in df and str(df[column].dtype) != str(dtype)
+    }
+    return df.astype(changed) if changed else df
+
+
+def compact_dtypes(df, i, ranges=None):
+    """This function converts the columns of a dataset to the smallest dtype
+    (see plan_dtypes).
+    Args:
+        df (pandas.DataFrame): The dataframe to be converted.
+        i (str): The name of the dataset.
+        ranges (dict): The declared ranges. Default value is None, which loads
+        them from the ranges file of the dataset.
+    Returns:
+        df (pandas.DataFrame): The dataframe with the smallest dtypes.
+    """
+    plan = dtype_plan(
+        i, df.dtypes, observed_ranges(df), df.isna().any().to_dict(), ranges
+    )
+    return apply_dtypes(df, plan)
+
+
+def widen_dtypes(df):
+    """This function converts the integer and bool columns to Int64 and the category
+    columns to object. Parts of a dataset whose dtypes were chosen separately can
+    then be put together and converted to the smallest dtypes of the whole dataset.
+    """
+    wide = {}
+    for column, dtype in df.dtypes.items():
+        if pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+            wide[column] = "Int64"
+        elif isinstance(dtype, pd.CategoricalDtype):
+            wide[column] = "object"
+    return apply_dtypes(df, wide)
+
+
+def concat_dtypes(parts):
+    """This function concatenates parts of a dataset whose dtypes were chosen
+    separately, e.g. waves which were compacted at different times. The columns
+    whose dtype differs between the parts are widened (see widen_dtypes) before
+    they are concatenated, so that pandas does not fall back to object columns.
+    Afterwards integer columns get the smallest integer dtype of their values and
+    the other widened columns become category again. Columns with the same dtype
+    in all parts keep it.
+    Args:
+        parts (list): The parts of the dataset.
+    Returns:
+        df (pandas.DataFrame): The concatenated dataset.
+    """
+    parts = list(parts)
+    columns = list(dict.fromkeys(column for part in parts for column in part))
+    different = [
+        column
+        for column in columns
+        if len({part[column].dtype for part in parts if column in part}) > 1
+    ]
+    if not different:
+        return pd.concat(parts)
+    df = pd.concat(
+        [
+            part.assign(**widen_dtypes(part[part.columns.intersection(different)]))
+            for part in parts
+        ]
+    )
+    plan = plan_dtypes(df[different].dtypes, {}, observed_ranges(df[different]))
+    return apply_dtypes(df, plan)
+
+
+def memory_usage(df):
+    """This function returns the dtype and the bytes used by each column of a dataframe."""
+    return pd.DataFrame(
+        {
+            "dtype": df.dtypes.astype(str),
+            "bytes": df.memory_usage(index=False, deep=True),
+        }
+    )
+
+
+def memory_report(before, after):
+    """This function compares the memory used by the columns of a dataset
+    before and after converting their dtypes.
+    Args:
+        before (pandas.DataFrame): The memory usage before the conversion (see memory_usage).
+        after (pandas.DataFrame): The memory usage after the conversion.
+    Returns:
+        report (pandas.DataFrame): The dtypes and the bytes of each column before and
+        after the conversion with a row "total" for the whole dataset.
+    """
+    report = before.join(after, lsuffix="_before", rsuffix="_after")
+    report.loc["total"] = [
+        "",
+        report["bytes_before"].sum(),
+        "",
+        report["bytes_after"].sum(),
+    ]
+    report["ratio"] = (report["bytes_before"] / report["bytes_after"]).round(2)
+    return report
@@ -0,0 +1,392 @@
+"""
+This file contains the functions which update the datasets in "BLD" wave by wave,
+so that only new or changed waves are processed when a new release of the
+PASS-CF data is added to "original_data"
+"""
+import hashlib
+import json
+from functools import partial
+from itertools import chain
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from src.artifacts import load_artifact
+from src.artifacts import load_artifacts
+from src.artifacts import read_manifest
+from src.artifacts import ROW_COLUMN
+from src.artifacts import save_artifact
+from src.artifacts import save_artifact_chunks
+from src.artifacts import write_manifest
+from src.config import SRC
+from src.data_management import cleaning_functions
+from src.data_management import dtypes
+from src.data_management import ingestion
+from src.data_management import merging
+from src.data_management import metadata
+from src.data_management.cleaning_functions import aggregate_scales
+from src.data_management.cleaning_functions import create_dummies
+from src.data_management.cleaning_functions import create_dummies_depr
+from src.data_management.cleaning_functions import reverse_code
+from src.data_management.cleaning_functions import update_deprivation_weights
+from src.data_management.dtypes import apply_dtypes
+from src.data_management.dtypes import compact_dtypes
+from src.data_management.dtypes import concat_dtypes
+from src.data_management.dtypes import dtype_plan
+from src.data_management.dtypes import memory_report
+from src.data_management.dtypes import memory_usage
+from src.data_management.dtypes import widen_dtypes
+from src.data_management.ingestion import clean_stata
+from src.data_management.ingestion import get_index_names
+from src.data_management.ingestion import get_stata_columns
+from src.data_management.ingestion import read_stata_digests
+from src.data_management.ingestion import read_stata_dtypes
+from src.data_management.merging import merge_datasets
+from src.data_management.merging import merge_report
+from src.data_management.metadata import stage_digest
+
+# Variables whose values depend on all waves of a dataset. They are recomputed
+# for every wave when waves are added.
+CROSS_WAVE_VARIABLES = ["depr_index_items_w"]
+
+# Suffix of the file next to a cleaned dataset which records the release it was
+# cleaned from and the digests of the waves of the release (see release_digests).
+RELEASE_SUFFIX = ".release.json"
+
+
+def _modules(*modules):
+    """Returns the paths of the source files of modules."""
+    return [Path(module.__file__) for module in modules]
+
+
+def wave_digests(waves, config, *upstream):
+    """This function computes the digest of each wave of a stage output from the
+    digest of the stage and the digests of the wave in the inputs of the stage.
+    Args:
+        waves (list): The waves of the output.
+        config (str): The digest of the stage (see stage_digest).
+        upstream (dict): Dictionaries with waves as keys and their digests in an
+        input as values (see src.artifacts.read_manifest).
+    Returns:
+        digests (dict): Dictionary with waves as keys and their digests as values.
+    """
+    return {
+        wave: hashlib.sha256(
+            "".join(
+                [config] + [str(digests.get(wave)) for digests in upstream]
+            ).encode()
+        ).hexdigest()
+        for wave in waves
+    }
+
+
+def upstream_digests(path):
+    """This function returns the wave digests of an input of a stage. Inputs
+    without a manifest get a digest from the time they were changed, so that
+    their waves are processed again whenever they change."""
+    digests = read_manifest(path)
+    if digests:
+        return digests
+    changed = str(Path(path).stat().st_mtime_ns)
+    waves = load_artifact(path, columns=[]).index.get_level_values("wave")
+    return {int(wave): f"unversioned-{changed}" for wave in waves.unique()}
+
+
+def plan_waves(paths, digests):
+    """This function decides which waves of the outputs of a stage can be reused.
+    Args:
+        paths (list): The paths of the outputs of the stage.
+        digests (dict): The digests of the waves the outputs should contain.
+    Returns:
+        keep (list): The waves which are up to date in all outputs.
+        update (list): The waves which are new or changed.
+        current (bool): Whether the outputs are up to date and nothing is to be done.
+    """
+    manifests = [read_manifest(path) for path in paths]
+    keep = [
+        wave
+        for wave, digest in sorted(digests.items())
+        if all(manifest.get(wave) == digest for manifest in manifests)
+    ]
+    update = [wave for wave in sorted(digests) if wave not in keep]
+    current = not update and all(sorted(manifest) == keep for manifest in manifests)
+    return keep, update, current
+
+
+def combine_waves(path, new, keep, widen=False):
+    """This function puts the reused waves of an output and the new waves together.
+    Args:
+        path (str, path object): The path of the output.
+        new (pandas.DataFrame): The new waves. None if there are no new waves.
+        keep (list): The waves of the output which are reused.
+        widen (bool): Whether all dtypes are widened (see widen_dtypes), so that
+        they can be converted to the smallest dtypes of the whole dataset afterwards.
+        Otherwise only the columns whose dtypes differ between the reused and the
+        new waves are widened and converted back (see concat_dtypes).
+    Returns:
+        df (pandas.DataFrame): The dataset sorted by its index.
+    """
+    parts = [] if new is None else [new]
+    if keep:
+        parts.insert(0, load_artifact(path, filters=[("wave", "in", keep)]))
+    if widen:
+        return pd.concat([widen_dtypes(part) for part in parts]).sort_index()
+    return concat_dtypes(parts).sort_index()
+
+
+def _compact(df, i):
+    """Converts the columns and the index levels of a dataset to their smallest dtypes."""
+    index = list(df.index.names)
+    return compact_dtypes(df.reset_index(), i).set_index(index)
+
+
+def _partitions(path, waves):
+    """Yields the waves of a dataset one after another with widened dtypes and
+    the index as columns."""
+    for wave in waves:
+        part = load_artifact(path, filters=[("wave", "==", wave)])
+        yield widen_dtypes(part.reset_index())
+
+
+def release_digests(depends_on, produces, i, chunksize=None):
+    """This function returns the digests of the content of the waves of a release
+    (see read_stata_digests). They are saved next to the cleaned dataset together
+    with the name, the size and the modification time of the .dta file, and are
+    only computed again when one of them changed, so that an unchanged release is
+    not read to find out that nothing is to be done.
+    Args:
+        depends_on (str, path object): The path of the .dta file.
+        produces (str, path object): The path of the cleaned dataset.
+        i (str): The name of the dataset.
+        chunksize (int): The number of rows read at once. Default value is None.
+    Returns:
+        digests (dict): Dictionary with the waves of the release as keys and their
+        digests as values.
+    """
+    depends_on, produces = Path(depends_on), Path(produces)
+    stat = depends_on.stat()
+    release = [depends_on.name, stat.st_size, stat.st_mtime_ns]
+    path = produces.with_name(produces.name + RELEASE_SUFFIX)
+    if path.exists():
+        recorded = json.loads(path.read_text())
+        if recorded["release"] == release:
+            return {int(wave): digest for wave, digest in recorded["waves"].items()}
+    digests = read_stata_digests(depends_on, i, chunksize)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    waves = {str(wave): digest for wave, digest in digests.items()}
+    path.write_text(json.dumps({"release": release, "waves": waves}, indent=1))
+    return digests
+
+
+def update_cleaning(depends_on, produces, i, chunksize=None, n_workers=1):
+    """This function updates the cleaned dataset from the latest release of a .dta file.
+    Only the waves which are not yet in the cleaned dataset, whose rows changed
+    in the release (see release_digests) or whose cleaning changed (renaming
+    file, ranges file or code) are cleaned (see clean_stata).
+    The other waves are reused and all waves are converted to the smallest dtypes
+    of the whole dataset. With chunksize the waves are put together one after
+    another instead of all at once.
+    Args:
+        depends_on (str, path object): The path of the .dta file.
+        produces (str, path object): The path of the cleaned dataset.
+        i (str): The name of the dataset.
+        chunksize (int): The number of rows read at once (see clean_stata).
+        n_workers (int): The number of processes cleaning blocks of columns.
+    Returns:
+        report (pandas.DataFrame): The memory report of the cleaned waves (see
+        memory_report). None if no wave was cleaned.
+    """
+    produces = Path(produces)
+    config = stage_digest(
+        SRC / f"data_management/{i}/{i}_renaming.csv",
+        SRC / f"data_management/ranges/{i}_ranges.yaml",
+        *_modules(cleaning_functions, dtypes, ingestion, metadata),
+    )
+    content = release_digests(depends_on, produces, i, chunksize)
+    digests = wave_digests(list(content), config, content)
+    keep, update, current = plan_waves([produces], digests)
+    if current:
+        return None
+    report = None
+    if not keep:
+        report = clean_stata(depends_on, produces, i, chunksize, n_workers)
+    elif chunksize is None:
+        df = None
+        if update:
+            new = produces.with_suffix(".new.parquet")
+            report = clean_stata(depends_on, new, i, n_workers=n_workers, waves=update)
+            df = load_artifact(new)
+            new.unlink()
+        df = combine_waves(produces, df, keep, widen=True)
+        save_artifact(_compact(df, i), produces)
+    else:
+        # the waves are put together one after another to bound the memory needed
+        new = produces.with_suffix(".new.parquet")
+        try:
+            parts = _partitions(produces, keep)
+            if update:
+                report = clean_stata(depends_on, new, i, chunksize, waves=update)
+                parts = chain(parts, _partitions(new, update))
+            save_artifact_chunks(
+                parts,
+                produces,
+                get_index_names(get_stata_columns(depends_on, i)),
+                plan_dtypes=partial(dtype_plan, i),
+            )
+        finally:
+            new.unlink(missing_ok=True)
+    write_manifest(produces, digests)
+    return report
+
+
+def cleaning_report(depends_on, produces, i):
+    """This function computes the memory report of the whole cleaned dataset (see
+    memory_report), however many of its waves were cleaned by the last update.
+    The memory before the conversion is the memory of the variables in their
+    dtypes after the basic cleaning (see read_stata_dtypes). The dataset is read
+    one row group after another.
+    Args:
+        depends_on (str, path object): The path of the .dta file.
+        produces (str, path object): The path of the cleaned dataset.
+        i (str): The name of the dataset.
+    Returns:
+        report (pandas.DataFrame): The memory used by each variable before and after
+        converting the dtypes.
+    """
+    dtypes = read_stata_dtypes(depends_on, i)
+    parquet = pq.ParquetFile(produces)
+    before = after = None
+    for row_group in range(parquet.num_row_groups):
+        part = parquet.read_row_group(row_group, use_pandas_metadata=True).to_pandas()
+        part = part.drop(columns=ROW_COLUMN, errors="ignore")
+        usage = [memory_usage(apply_dtypes(part, dtypes)), memory_usage(part)]
+        if before is not None:
+            usage[0]["bytes"] += before["bytes"]
+            usage[1]["bytes"] += after["bytes"]
+        before, after = usage
+    return memory_report(before, after)
+
+
+def aggregate_waves(df_p, df_h):
+    """This function does the aggregation and creates the dummy variables of
+    waves of the personal (PENDDAT) and household (HHENDDAT) datasets. Apart from
+    the weighted deprivation index, the new variables of a wave only depend on
+    the wave itself.
+    Args:
+        df_p (pandas.DataFrame): The cleaned personal dataset.
+        df_h (pandas.DataFrame): The cleaned household dataset.
+    Returns:
+        df_p (pandas.DataFrame): The aggregated personal dataset.
+        df_h (pandas.DataFrame): The aggregated household dataset.
+    """
+    df_p = reverse_code(df_p)  # reverse all the negatively phrased variables
+    df_p = aggregate_scales(df_p)  # facets of big five, eri and gender roles
+
+    df_p, df_h = create_dummies(df_p, df_h)
+    df_h = create_dummies_depr(df_h)
+    return df_p, df_h
+
+
+def update_aggregation(depends_on, produces):
+    """This function updates the aggregated datasets. Only the waves which are new
+    or changed in the cleaned datasets are aggregated and the weighted deprivation
+    index is recomputed for all waves (see update_deprivation_weights).
+    Args:
+        depends_on (dict): The paths of the cleaned personal ("first") and
+        household ("second") datasets.
+        produces (dict): The paths of the aggregated personal ("first") and
+        household ("second") datasets.
+    """
+    config = stage_digest(
+        *[
+            SRC / f"data_management/{folder}/{i}_{folder}.yaml"
+            for folder in ["ranges", "dummies"]
+            for i in ["PENDDAT", "HHENDDAT"]
+        ],
+        SRC / "data_management/scales/PENDDAT_scales.yaml",
+        *_modules(cleaning_functions, dtypes, metadata),
+        Path(__file__),
+    )
+    upstream = [upstream_digests(depends_on[key]) for key in ["first", "second"]]
+    digests = wave_digests(sorted(set().union(*upstream)), config, *upstream)
+    keep, update, current = plan_waves(produces.values(), digests)
+    if current:
+        return
+    df_p = df_h = None
+    if update:
+        filters = [("wave", "in", update)]
+        df_p, df_h = aggregate_waves(
+            *load_artifacts(
+                [depends_on["first"], depends_on["second"]], filters=filters
+            )
+        )
+    df_p = combine_waves(produces["first"], df_p, keep, widen=True)
+    df_h = combine_waves(produces["second"], df_h, keep, widen=True)
+    df_h = update_deprivation_weights(df_h)  # the weights span all waves
+    save_artifact(_compact(df_p, "PENDDAT"), produces["first"])
+    save_artifact(_compact(df_h, "HHENDDAT"), produces["second"])
+    for path in produces.values():
+        write_manifest(path, digests)
+
+
+def refresh_cross_wave(df, source):
+    """This function replaces the variables which span waves (CROSS_WAVE_VARIABLES)
+    of a merged dataset with their current values in the aggregated dataset.
+    Args:
+        df (pandas.DataFrame): The merged dataset.
+        source (pandas.DataFrame): The aggregated dataset with the current values.
+    Returns:
+        df (pandas.DataFrame): The merged dataset with the current values.
+    """
+    keys = pd.MultiIndex.from_arrays(
+        [df.index.get_level_values(name) for name in source.index.names]
+    )
+    for column in source.columns.intersection(df.columns):
+        current = source[column].reindex(keys).to_numpy()
+        df[column] = df[column].where(df[column].isna(), current)
+    return df
+
+
+def update_merging(depends_on, produces, n_workers=1):
+    """This function updates the merged datasets. Only the waves which are new or
+    changed in the aggregated datasets or the weights are merged (see
+    merge_datasets) and the variables which span waves are updated for all waves
+    (see refresh_cross_wave).
+    Args:
+        depends_on (dict): The paths of the household weights ("first"), the
+        personal weights ("second"), the aggregated household dataset ("third")
+        and the aggregated personal dataset ("fourth").
+        produces (dict): The paths of the merged dataset ("first"), the household
+        dataset with weights ("second"), the personal dataset with
+        weights ("third") and the merge report ("fourth", see merge_report).
+        n_workers (int): The number of processes merging waves. Default value is 1.
+    """
+    config = stage_digest(Path(__file__), Path(merging.__file__))
+    keys = ["first", "second", "third", "fourth"]
+    outputs = [produces[key] for key in ["first", "second", "third"]]
+    upstream = [upstream_digests(depends_on[key]) for key in keys]
+    digests = wave_digests(sorted(set().union(*upstream)), config, *upstream)
+    keep, update, current = plan_waves(outputs, digests)
+    if current:
+        return
+    merged = [None, None, None]
+    if update:
+        filters = [("wave", "in", update)]
+        df_h_w, df_p_w, df_h_c, df_p_c = load_artifacts(
+            [depends_on[key] for key in keys], filters=filters
+        )
+        merged = merge_datasets(df_h_c, df_p_c, df_h_w, df_p_w, n_workers)
+    names = pq.read_schema(depends_on["third"]).names
+    source = load_artifact(
+        depends_on["third"],
+        columns=[column for column in CROSS_WAVE_VARIABLES if column in names],
+    )
+    for path, new in zip(outputs, merged):
+        df = combine_waves(path, new, keep)
+        if keep:
+            df = refresh_cross_wave(df, source)
+        save_artifact(df, path)
+        write_manifest(path, digests)
+        if path == produces["first"]:
+            merge_report(df).to_csv(produces["fourth"], sep=";")
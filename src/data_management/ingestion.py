@@ -0,0 +1,270 @@
+"""
+This file contains the functions which read the original .dta files
+and produce the cleaned datasets
+"""
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+from src.artifacts import save_artifact
+from src.artifacts import save_artifact_chunks
+from src.data_management.cleaning_functions import clean_data
+from src.data_management.cleaning_functions import read_renaming
+from src.data_management.dtypes import apply_dtypes
+from src.data_management.dtypes import compact_dtypes
+from src.data_management.dtypes import dtype_plan
+from src.data_management.dtypes import memory_report
+from src.data_management.dtypes import memory_usage
+
+
+def get_index_names(columns):
+    """This function determines the index of the cleaned dataset from its raw
+    variable names. Personal datasets contain "pnr" and household datasets "hnr".
+    Args:
+        columns (list): The raw variable names of the dataset.
+    Returns:
+        index (list): The new names of the index variables.
+    """
+    if "pnr" in columns:
+        if "hnr" in columns:
+            return ["hh_id", "wave", "p_id"]
+        return ["wave", "p_id"]
+    return ["hh_id", "wave"]
+
+
+def get_stata_columns(path, i):
+    """This function selects the variables of a .dta file which are listed in the
+    renaming file of the dataset. Only the header of the file is read.
+    Args:
+        path (str, path object): The path of the .dta file.
+        i (str): The name of the dataset.
+    Returns:
+        columns (list): The raw names of the listed variables in the order of the file.
+    Raises:
+        ValueError: If variables of the renaming file are not in the .dta file.
+    """
+    with pd.read_stata(path, iterator=True) as reader:
+        header = list(reader.variable_labels())
+    listed = set(read_renaming(i)["raw_name"])
+    missing = sorted(listed.difference(header))
+    if missing:
+        raise ValueError(
+            f"The variables {missing} of {i}_renaming.csv are not in {path}."
+        )
+    return [column for column in header if column in listed]
+
+
+def _projection(path, columns):
+    """Returns the columns argument of pandas.read_stata for reading the given
+    variables of a .dta file. pandas parses all variables of the file anyway and
+    copies the selected ones, so None is returned if no variable is dropped."""
+    with pd.read_stata(path, iterator=True) as reader:
+        n_variables = len(reader.variable_labels())
+    return None if len(columns) == n_variables else columns
+
+
+def read_stata_dtypes(path, i):
+    """This function returns the dtypes which the variables of a .dta file have
+    after the basic cleaning (see clean_data), before they are converted to their
+    smallest dtype. Integer variables become nullable integers of the same width
+    and string variables objects. Only the header of the file is read.
+    Args:
+        path (str, path object): The path of the .dta file.
+        i (str): The name of the dataset.
+    Returns:
+        dtypes (dict): Dictionary with the new names of the variables as keys and
+        their dtypes as values.
+    """
+    with pd.read_stata(path, iterator=True) as reader:
+        reader.variable_labels()
+        varlist = getattr(reader, "_varlist", None) or reader.varlist
+        dtyplist = getattr(reader, "_dtyplist", None) or reader.dtyplist
+    renaming = read_renaming(i)
+    listed = set(renaming["raw_name"])
+    renaming = renaming.dropna(subset=["new_name"])
+    names = dict(zip(renaming["raw_name"], renaming["new_name"]))
+    dtypes = {}
+    for column, dtype in zip(varlist, dtyplist):
+        if column not in listed:
+            continue
+        if not isinstance(dtype, np.dtype) or dtype.kind not in "iuf":
+            dtype = np.dtype(object)
+        elif dtype.kind in "iu":
+            dtype = pd.api.types.pandas_dtype(str(dtype).capitalize())
+        dtypes[names.get(column, column)] = dtype
+    return dtypes
+
+
+def get_wave_name(i):
+    """This function returns the raw name of the wave variable of a dataset."""
+    renaming = read_renaming(i)
+    return renaming.loc[renaming["new_name"] == "wave", "raw_name"].iloc[0]
+
+
+def read_stata_digests(path, i, chunksize=None):
+    """This function computes a digest of the content of each wave of a .dta file
+    from the values of the variables listed in the renaming file, so that a wave
+    is cleaned again when its rows change in a new release. The numeric values
+    are hashed as float64, so that the digests do not depend on the dtypes pandas
+    chooses for a chunk.
+    Args:
+        path (str, path object): The path of the .dta file.
+        i (str): The name of the dataset.
+        chunksize (int): The number of rows read at once. Default value is None,
+        which reads the whole file.
+    Returns:
+        digests (dict): Dictionary with the sorted waves of the file as keys and
+        their digests as values.
+    """
+    wave = get_wave_name(i)
+    columns = get_stata_columns(path, i)
+    hashes = {}
+    with pd.read_stata(
+        path,
+        convert_categoricals=False,
+        columns=_projection(path, columns),
+        chunksize=chunksize,
+        iterator=True,
+    ) as reader:
+        chunks = reader if chunksize else [reader.read()]
+        for chunk in chunks:
+            numeric = chunk.select_dtypes("number").columns
+            chunk = chunk.astype(dict.fromkeys(numeric, "float64"))
+            rows = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+            waves = chunk[wave].to_numpy()
+            for value in pd.unique(waves[~np.isnan(waves)]):
+                digest = hashes.setdefault(int(value), hashlib.sha256())
+                digest.update(rows[waves == value].tobytes())
+    return {value: hashes[value].hexdigest() for value in sorted(hashes)}
+
+
+def _select_waves(df, wave, waves, columns):
+    """Keeps the rows of the given waves and the given columns of a raw dataset."""
+    if waves is None:
+        return df
+    return df.loc[df[wave].isin(waves), columns].reset_index(drop=True)
+
+
+def _clean_block(df, i, dtypes):
+    """Cleans a block of columns of a raw dataset and converts them to their
+    smallest dtype. Renaming, masking and choosing the dtypes only depend on the
+    column itself, so the blocks can be cleaned independently."""
+    df = apply_dtypes(clean_data(df, i), dtypes)
+    before = memory_usage(df)
+    df = compact_dtypes(df, i)
+    return df, before
+
+
+def split_columns(columns, n_blocks):
+    """This function splits the columns into at most n_blocks contiguous blocks
+    of about the same size."""
+    n_blocks = max(1, min(n_blocks, len(columns)))
+    bounds = np.linspace(0, len(columns), n_blocks + 1).round().astype(int)
+    return [columns[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def clean_stata(depends_on, produces, i, chunksize=None, n_workers=1, waves=None):
+    """This function reads a .dta file, cleans it and saves the cleaned dataset.
+    Only the variables listed in the renaming file of the dataset are read. After
+    the basic cleaning the variables get the dtypes of their storage type in the
+    .dta file (see read_stata_dtypes), also where Stata missing values make pandas
+    read an integer variable as float, and are then converted to their smallest
+    dtype (see compact_dtypes).
+    Without chunksize the whole file is read and cleaned at once. With chunksize
+    the file is read in chunks of rows which are renamed and cleaned one after
+    another and appended to the output, so that the memory needed is bounded
+    by the size of a chunk instead of the size of the file. Both modes produce
+    the same dataset.
+    With more than one worker and without chunksize, the file is read once and
+    its columns are split into contiguous blocks which are cleaned in a pool of
+    processes and put together in the order of the file, so that the saved file
+    is the same as with one worker.
+    Args:
+        depends_on (str, path object): The path of the .dta file.
+        produces (str, path object): The path of the cleaned dataset.
+        i (str): The name of the dataset.
+        chunksize (int): The number of rows read at once. Default value is None,
+        which reads the whole file.
+        n_workers (int): The number of processes cleaning blocks of columns.
+        Default value is 1, which cleans the file in the current process.
+        waves (list): The waves to be cleaned. Default value is None, which cleans
+        all waves.
+    Returns:
+        report (pandas.DataFrame): The memory used by each variable before and after
+        converting the dtypes (see memory_report).
+    """
+    columns = get_stata_columns(depends_on, i)
+    index = get_index_names(columns)
+    dtypes = read_stata_dtypes(depends_on, i)
+    projection = _projection(depends_on, columns)
+    if chunksize is None:
+        df = pd.read_stata(depends_on, convert_categoricals=False, columns=projection)
+        df = _select_waves(df, get_wave_name(i), waves, columns)
+        if n_workers > 1:
+            blocks = split_columns(columns, n_workers)
+            with ProcessPoolExecutor(max_workers=len(blocks)) as pool:
+                results = list(
+                    pool.map(
+                        _clean_block,
+                        [df[block] for block in blocks],
+                        [i] * len(blocks),
+                        [dtypes] * len(blocks),
+                    )
+                )
+            del df
+        else:
+            results = [_clean_block(df, i, dtypes)]
+        df = pd.concat([block for block, _ in results], axis=1)
+        before = pd.concat([usage for _, usage in results]).drop(index)
+        after = memory_usage(df).drop(index)
+        save_artifact(df.set_index(index).sort_index(), produces)
+    else:
+        wave = get_wave_name(i)
+        before = pd.DataFrame(
+            {"dtype": pd.Series(dtypes, dtype=object).astype(str), "bytes": 0}
+        ).drop(index)
+        with pd.read_stata(
+            depends_on,
+            convert_categoricals=False,
+            columns=projection,
+            chunksize=chunksize,
+        ) as reader:
+            selected = (_select_waves(chunk, wave, waves, columns) for chunk in reader)
+            chunks = (
+                apply_dtypes(clean_data(chunk, i), dtypes)
+                for chunk in selected
+                if len(chunk)
+            )
+            first = next(chunks, None)
+            if first is None:
+                # there are no rows, so the empty dataset is saved at once
+                df = compact_dtypes(_empty_dataset(dtypes), i)
+                after = memory_usage(df).drop(index)
+                save_artifact(df.set_index(index), produces)
+            else:
+                after = save_artifact_chunks(
+                    _stream(chain([first], chunks), before),
+                    produces,
+                    index,
+                    plan_dtypes=partial(dtype_plan, i),
+                )
+    return memory_report(before, after)
+
+
+def _empty_dataset(dtypes):
+    """Returns a dataset without rows with the given dtypes."""
+    return pd.DataFrame(
+        {column: pd.Series(dtype=dtype) for column, dtype in dtypes.items()}
+    )
+
+
+def _stream(chunks, before):
+    """Yields the cleaned chunks and adds their memory usage to before."""
+    for chunk in chunks:
+        usage = chunk.memory_usage(index=False, deep=True)
+        before["bytes"] += usage.reindex(before.index)
+        yield chunk
@@ -0,0 +1,182 @@
+"""
+This file contains the value label store, which keeps the value labels of the
+.dta files next to the cleaned datasets and decodes their integer codes to
+categorical columns on demand
+"""
+import json
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.data_management.catalog import load_catalog
+from src.data_management.metadata import load_renaming
+from src.utils import normalize_labels
+
+
+def decode_labels(series, labels, normalize=True):
+    """This function decodes the integer codes of a column to a categorical column.
+    The categories are the labels in the order of their codes, followed by the
+    codes without a label (as strings) which are in the column. The values are not
+    converted: only the small array of the positions of the codes in the
+    categories is built.
+    Args:
+        series (pandas.Series): The column with the codes. Missing values stay
+        missing.
+        labels (dict): Dictionary with the codes as keys and their labels as values.
+        normalize (bool): Whether the bracketed codes in front of the labels (e.g.
+        "[1] ") are deleted (see normalize_labels). Default value is True.
+    Returns:
+        categorical (pandas.Series): The decoded column with the index of series.
+    """
+    values = series.to_numpy()
+    if not np.issubdtype(values.dtype, np.integer):
+        values = series.to_numpy(dtype="float64", na_value=np.nan)
+    valid = ~pd.isna(values)
+    present = pd.unique(values[valid])
+    unlabelled = sorted(int(code) for code in present if int(code) not in labels)
+    codes = np.array(sorted(set(labels).union(unlabelled)), dtype="int64")
+    categories = [labels.get(code, str(code)) for code in codes]
+    positions = np.full(len(values), -1, dtype="int32")
+    positions[valid] = np.searchsorted(codes, values[valid])
+    categorical = pd.Series(
+        pd.Categorical.from_codes(positions, categories),
+        index=series.index,
+        name=series.name,
+    )
+    return normalize_labels(categorical) if normalize else categorical
+
+
+@dataclass(frozen=True)
+class ValueLabels:
+    """The value labels of the variables of a dataset.
+    Attributes:
+        tables (dict): Dictionary with the ids of the label tables as keys and
+        dictionaries with codes as keys and labels as values as values. Variables
+        with the same labels share one table.
+        variables (dict): Dictionary with the new names of the variables as keys and
+        the ids of their label tables as values.
+    """
+
+    tables: dict
+    variables: dict
+
+    def labels(self, variable):
+        """Returns the labels of a variable as a dictionary with codes as keys.
+        Variables without labels have an empty dictionary."""
+        return self.tables.get(self.variables.get(variable), {})
+
+    def decode(self, data, normalize=True):
+        """This function decodes the labelled columns of a column or a dataframe
+        (see decode_labels). Columns without labels are kept.
+        Args:
+            data (pandas.Series or pandas.DataFrame): The data with the codes.
+            normalize (bool): Whether the bracketed codes in front of the labels
+            are deleted. Default value is True.
+        Returns:
+            data (pandas.Series or pandas.DataFrame): The decoded data.
+        """
+        if isinstance(data, pd.Series):
+            if data.name not in self.variables:
+                return data
+            return decode_labels(data, self.labels(data.name), normalize)
+        labelled = [column for column in data.columns if column in self.variables]
+        return data.assign(
+            **{column: self.decode(data[column], normalize) for column in labelled}
+        )
+
+    def categories(self, variable, codes, normalize=True, labels=None):
+        """Returns the labels of the given codes of a variable as a list of strings,
+        e.g. the tick labels of a figure. The labels given as a dictionary with the
+        codes as keys take precedence over the value labels of the variable. Codes
+        without a label are given as strings (e.g. "3")."""
+        labels = {**self.labels(variable), **(labels or {})}
+        codes = pd.Series(np.asarray(codes), name=variable)
+        return list(decode_labels(codes, labels, normalize).astype(str))
+
+
+def stata_label_names(reader):
+    """This function returns the names of the variables and of their label tables
+    of an open .dta file (pandas.io.stata.StataReader). pandas keeps them public
+    before version 2.0 and private afterwards."""
+    varlist = getattr(reader, "_varlist", None) or reader.varlist
+    lbllist = getattr(reader, "_lbllist", None) or reader.lbllist
+    return varlist, lbllist
+
+
+def _reversed_labels(labels, bounds):
+    """Returns the labels of a reversed variable (see reverse_code). The codes in
+    the declared range become lowest + highest - code, the missing codes are kept."""
+    low, high = bounds
+    return {
+        (low + high - code if low <= code <= high else code): label
+        for code, label in labels.items()
+    }
+
+
+def read_value_labels(path, i):
+    """This function extracts the value labels of the variables of a .dta file
+    which are listed in the renaming file of the dataset. Only the header and the
+    label tables are read, not the data. The variables are stored by their new
+    name and the reversed variables (see reverse_code) get the reversed labels, so
+    that the labels fit the cleaned, aggregated and merged datasets.
+    Args:
+        path (str, path object): The path of the .dta file.
+        i (str): The name of the dataset.
+    Returns:
+        value_labels (ValueLabels): The value labels of the dataset.
+    """
+    with pd.read_stata(path, iterator=True) as reader:
+        stata_tables = reader.value_labels()
+        varlist, lbllist = stata_label_names(reader)
+    names = load_renaming(i).names
+    tables, ids, variables = {}, {}, {}
+    for raw_name, table in zip(varlist, lbllist):
+        if raw_name not in names or table not in stata_tables:
+            continue
+        labels = {int(code): label for code, label in stata_tables[table].items()}
+        variables[names[raw_name]] = labels
+    for name, (reversed_name, bounds) in load_catalog().reverse.get(i, {}).items():
+        if name in variables and bounds is not None:
+            variables[reversed_name] = _reversed_labels(variables[name], bounds)
+    for name, labels in variables.items():
+        key = tuple(sorted(labels.items()))
+        if key not in ids:
+            ids[key] = str(len(ids))
+            tables[ids[key]] = dict(key)
+        variables[name] = ids[key]
+    return ValueLabels(tables, variables)
+
+
+def save_value_labels(value_labels, path):
+    """This function saves the value labels of a dataset as .json file."""
+    tables = {
+        table: {str(code): label for code, label in labels.items()}
+        for table, labels in value_labels.tables.items()
+    }
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as stream:
+        json.dump(
+            {"tables": tables, "variables": value_labels.variables},
+            stream,
+            ensure_ascii=False,
+            indent=1,
+        )
+
+
+def load_value_labels(path):
+    """This function loads the value labels of a dataset saved by
+    save_value_labels.
+    Args:
+        path (str, path object): The path of the .json file.
+    Returns:
+        value_labels (ValueLabels): The value labels of the dataset.
+    """
+    with open(path, encoding="utf-8") as stream:
+        content = json.load(stream)
+    tables = {
+        table: {int(code): label for code, label in labels.items()}
+        for table, labels in content["tables"].items()
+    }
+    return ValueLabels(tables, content["variables"])
@@ -0,0 +1,214 @@
+"""
+This file contains the functions which merge the personal and household
+datasets with their weights wave by wave
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+MERGE_CATEGORIES = ["left_only", "right_only", "both"]
+
+
+def _key_array(df, on):
+    """Returns the key columns of a dataframe as an integer array. Missing keys
+    get the lowest integer, so that they match each other like in pandas.merge."""
+    columns = []
+    for column in on:
+        if not pd.api.types.is_integer_dtype(df[column].dtype):
+            raise TypeError(f"The merge key {column} must be an integer column.")
+        columns.append(
+            df[column].to_numpy(dtype="int64", na_value=np.iinfo("int64").min)
+        )
+    return np.column_stack(columns) if columns else np.empty((len(df), 0), "int64")
+
+
+def key_codes(left, right, on):
+    """This function gives the rows of two dataframes codes for their keys.
+    The codes are the positions of the keys among the sorted unique keys of
+    both dataframes, so equal keys get equal codes.
+    Args:
+        left (pandas.DataFrame): The left dataframe.
+        right (pandas.DataFrame): The right dataframe.
+        on (list): The integer key columns.
+    Returns:
+        left_codes (numpy.ndarray): The codes of the rows of left.
+        right_codes (numpy.ndarray): The codes of the rows of right.
+    """
+    keys = np.concatenate([_key_array(left, on), _key_array(right, on)])
+    if len(keys) == 0:
+        return np.empty(0, "int64"), np.empty(0, "int64")
+    codes = np.unique(keys, axis=0, return_inverse=True)[1].ravel()
+    return codes[: len(left)], codes[len(left) :]
+
+
+def _match(left_codes, right_codes):
+    """Returns the position of the matching right row for each left row, or -1."""
+    n_codes = max(left_codes.max(initial=-1), right_codes.max(initial=-1)) + 1
+    if (np.bincount(right_codes, minlength=n_codes) > 1).any():
+        raise ValueError("The keys of the right dataframe are not unique.")
+    lookup = np.full(n_codes, -1, dtype="int64")
+    lookup[right_codes] = np.arange(len(right_codes))
+    return lookup[left_codes]
+
+
+def _take(df, positions):
+    """Returns the rows of a dataframe at the positions with missing rows for -1."""
+    df = df.set_axis(pd.RangeIndex(len(df)), axis=0, copy=False)
+    if len(positions) == len(df) and (positions == np.arange(len(df))).all():
+        return df
+    if (positions >= 0).all():
+        return df.take(positions).set_axis(
+            pd.RangeIndex(len(positions)), axis=0, copy=False
+        )
+    return df.reindex(positions).set_axis(
+        pd.RangeIndex(len(positions)), axis=0, copy=False
+    )
+
+
+def join(left, right, on, how="left", indicator=False, suffixes=("_x", "_y")):
+    """This function joins two dataframes whose keys are unique in the right dataframe.
+    The keys are compared as integer codes from sorting (see key_codes) instead of
+    hashing them. The columns are arranged like in pandas.merge.
+    Args:
+        left (pandas.DataFrame): The left dataframe with the keys as columns.
+        right (pandas.DataFrame): The right dataframe with the keys as columns.
+        on (list): The integer key columns.
+        how (str): "left" keeps the rows of left, "outer" also keeps the rows of
+        right without a match. Default value is "left".
+        indicator (bool): Whether a categorical column "_merge" tells if a row was
+        found in the left dataframe, the right dataframe or both. Default value is
+        False.
+        suffixes (tuple): The suffixes of the columns which are in both dataframes.
+    Returns:
+        df (pandas.DataFrame): The joined dataframe. The rows of right without a
+        match come after the rows of left.
+    Raises:
+        ValueError: If the keys of the right dataframe are not unique.
+    """
+    if how not in ("left", "outer"):
+        raise ValueError(f"The join {how} is not supported.")
+    left_codes, right_codes = key_codes(left, right, on)
+    matches = _match(left_codes, right_codes)
+    left_rows = np.arange(len(left))
+    right_rows = matches
+    if how == "outer":
+        unmatched = np.setdiff1d(np.arange(len(right)), matches, assume_unique=False)
+        left_rows = np.r_[left_rows, np.full(len(unmatched), -1)]
+        right_rows = np.r_[right_rows, unmatched]
+    others = [column for column in right.columns if column not in on]
+    common = set(others).intersection(left.columns)
+    joined_left = _take(left, left_rows)
+    joined_right = _take(right[others], right_rows)
+    if how == "outer" and len(unmatched):
+        # the keys of the rows found only in right are taken from right
+        for column in on:
+            joined_left[column] = pd.concat(
+                [left[column], right[column].iloc[unmatched]], ignore_index=True
+            )
+    joined_left.columns = [
+        f"{column}{suffixes[0]}" if column in common else column
+        for column in joined_left.columns
+    ]
+    joined_right.columns = [
+        f"{column}{suffixes[1]}" if column in common else column
+        for column in joined_right.columns
+    ]
+    df = pd.concat([joined_left, joined_right], axis=1)
+    if indicator:
+        codes = np.where(left_rows < 0, 1, np.where(right_rows < 0, 0, 2))
+        df["_merge"] = pd.Categorical.from_codes(codes, categories=MERGE_CATEGORIES)
+    return df
+
+
+def merge_wave(df_h_c, df_p_c, df_h_w, df_p_w):
+    """This function merges one wave of the datasets. It first merges personal
+    and household datasets with their weights and then merges the household
+    and personal datasets.
+    Args:
+        df_h_c (pandas.DataFrame): The aggregated household dataset.
+        df_p_c (pandas.DataFrame): The aggregated personal dataset.
+        df_h_w (pandas.DataFrame): The household weights.
+        df_p_w (pandas.DataFrame): The personal weights.
+    Returns:
+        merged_w (pandas.DataFrame): The merged personal and household dataset.
+        merged_h (pandas.DataFrame): The household dataset with weights.
+        merged_p (pandas.DataFrame): The personal dataset with weights.
+    """
+    merged_h = join(
+        df_h_c.reset_index(), df_h_w.reset_index(), on=["wave", "hh_id"]
+    ).set_index(["wave", "hh_id"])
+    merged_p = join(
+        df_p_c.reset_index(), df_p_w.reset_index(), on=["wave", "p_id"]
+    ).set_index(["hh_id", "wave", "p_id"])
+    merged_w = join(
+        merged_p.reset_index(),
+        merged_h.reset_index(),
+        on=["wave", "hh_id", "survey_year", "survey_mon"],
+        how="outer",
+        indicator=True,
+    ).set_index(["wave", "hh_id", "p_id"])
+    return merged_w, merged_h, merged_p
+
+
+def _select_waves(df, waves):
+    """Returns the rows of a dataset which belong to the waves."""
+    return df[df.index.get_level_values("wave").isin(waves)]
+
+
+def merge_datasets(df_h_c, df_p_c, df_h_w, df_p_w, n_workers=1):
+    """This function merges the datasets (see merge_wave). All merge keys contain
+    the wave, so groups of waves can be merged independently. With more than one
+    worker, the waves are split into one group per worker which are merged in a
+    pool of processes.
+    Args:
+        df_h_c (pandas.DataFrame): The aggregated household dataset.
+        df_p_c (pandas.DataFrame): The aggregated personal dataset.
+        df_h_w (pandas.DataFrame): The household weights.
+        df_p_w (pandas.DataFrame): The personal weights.
+        n_workers (int): The number of processes merging waves. Default value is 1.
+    Returns:
+        merged_w (pandas.DataFrame): The merged personal and household dataset.
+        merged_h (pandas.DataFrame): The household dataset with weights.
+        merged_p (pandas.DataFrame): The personal dataset with weights.
+        All datasets are sorted by their index.
+    """
+    datasets = (df_h_c, df_p_c, df_h_w, df_p_w)
+    if n_workers > 1:
+        waves = sorted(
+            set().union(
+                *[df.index.get_level_values("wave").unique() for df in datasets]
+            )
+        )
+        groups = [
+            list(group) for group in np.array_split(waves, n_workers) if len(group)
+        ]
+    if n_workers <= 1 or len(groups) <= 1:
+        results = [merge_wave(*datasets)]
+    else:
+        parts = [[_select_waves(df, group) for df in datasets] for group in groups]
+        with ProcessPoolExecutor(max_workers=len(groups)) as pool:
+            results = list(pool.map(merge_wave, *zip(*parts)))
+    return tuple(pd.concat(merged).sort_index() for merged in zip(*results))
+
+
+def merge_report(merged_w):
+    """This function counts the rows of the merged dataset which were found in the
+    personal dataset only, the household dataset only or both, for each wave.
+    Args:
+        merged_w (pandas.DataFrame): The merged dataset with the column "_merge".
+    Returns:
+        report (pandas.DataFrame): The counts for each wave with the share of rows
+        found in both datasets.
+    """
+    waves, uniques = pd.factorize(merged_w.index.get_level_values("wave"), sort=True)
+    codes = merged_w["_merge"].cat.codes.to_numpy()
+    counts = np.bincount(
+        waves * len(MERGE_CATEGORIES) + codes,
+        minlength=len(uniques) * len(MERGE_CATEGORIES),
+    ).reshape(len(uniques), len(MERGE_CATEGORIES))
+    report = pd.DataFrame(
+        counts, index=pd.Index(uniques, name="wave"), columns=MERGE_CATEGORIES
+    )
+    report["share_both"] = (report["both"] / report.sum(axis=1)).round(4)
+    return report
@@ -0,0 +1,351 @@
+"""
+This file contains the functions which read the renaming files and the .yaml files
+of the datasets. Each file is parsed and validated once and the result is memoized
+by the digest of the content of the file, in memory and on disk
+"""
+import hashlib
+import io
+import os
+import pickle
+from copy import deepcopy
+from dataclasses import dataclass
+from pathlib import Path
+
+import pandas as pd
+import yaml
+
+from src import config
+from src.config import SRC
+
+# Version of the parsed files saved in METADATA_CACHE in "src/config.py".
+# It has to be increased whenever a parser changes the objects it returns.
+CACHE_VERSION = 1
+
+_parsed = {}
+
+
+@dataclass(frozen=True)
+class Renaming:
+    """The parsed renaming file of a dataset.
+    Attributes:
+        table (pandas.DataFrame): The content of "{i}_renaming.csv" with the
+        columns "raw_name", "labels" and "new_name".
+        names (dict): Dictionary with raw names as keys and new names as values
+        (see get_renaming_dict).
+        missing_codes (dict): Dictionary with column names as keys and lists of
+        missing codes as values (see missing_codes_from_renaming).
+    """
+
+    table: pd.DataFrame
+    names: dict
+    missing_codes: dict
+
+
+@dataclass(frozen=True)
+class Dummies:
+    """The parsed dummy file of a dataset.
+    Attributes:
+        specs (dict): The dummy specifications of the variables (see read_dummy_specs).
+        deprivation (list): The deprivation items (e.g. "HLS0100"). Only the
+        household dataset (HHENDDAT) has deprivation items.
+    """
+
+    specs: dict
+    deprivation: list
+
+
+def _read_bytes(source):
+    """Returns the content of a file given by its path or as a file-like object."""
+    if hasattr(source, "read"):
+        content = source.read()
+        return content.encode() if isinstance(content, str) else content
+    return Path(source).read_bytes()
+
+
+def _cache_path(key):
+    """Returns the path of a parsed file in METADATA_CACHE or None."""
+    if config.METADATA_CACHE is None:
+        return None
+    return Path(config.METADATA_CACHE) / f"{key}.pickle"
+
+
+def _load_cached(path):
+    """Loads a parsed file from METADATA_CACHE. Returns None if it cannot be read."""
+    if path is None or not path.exists():
+        return None
+    try:
+        with open(path, "rb") as stream:
+            return pickle.load(stream)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+        return None
+
+
+def _store_cached(path, parsed):
+    """Saves a parsed file to METADATA_CACHE. The file is written under another
+    name first and then renamed, so that processes never read a partial file."""
+    if path is None:
+        return
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temporary, "wb") as stream:
+            pickle.dump(parsed, stream, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+    except OSError:
+        pass
+
+
+def read_memoized(kind, source, parse):
+    """This function parses a file once for each content. The parsed file is kept in
+    memory and saved to METADATA_CACHE in "src/config.py", so that other processes
+    and later runs load it instead of parsing the file again. A changed file has
+    another digest and is parsed again.
+    The parsed objects are shared by all callers and must not be changed.
+    Args:
+        kind (str): The kind of the file (e.g. "renaming"). Files of different
+        kinds are parsed by different functions.
+        source (str, path object or file-like object): The file.
+        parse (function): The function which parses and validates the content of
+        the file given as bytes.
+    Returns:
+        parsed: The object returned by parse.
+    """
+    content = _read_bytes(source)
+    digest = hashlib.sha256(content).hexdigest()
+    key = f"{kind}-v{CACHE_VERSION}-{digest}"
+    parsed = _parsed.get(key)
+    if parsed is None:
+        path = _cache_path(key)
+        parsed = _load_cached(path)
+        if parsed is None:
+            parsed = parse(content)
+            _store_cached(path, parsed)
+        _parsed[key] = parsed
+    return parsed
+
+
+def stage_digest(*paths):
+    """This function computes a digest of the files which define a stage
+    (e.g. renaming files, .yaml files and the modules with the functions used).
+    Args:
+        paths (str, path object): The paths of the files.
+    Returns:
+        digest (str): The digest of the names and the contents of the files.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        path = Path(path)
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes() if path.exists() else b"missing")
+    return digest.hexdigest()
+
+
+def clear_metadata_cache():
+    """This function removes the parsed files from memory. The files saved in
+    METADATA_CACHE are kept."""
+    _parsed.clear()
+
+
+def get_renaming_dict(renaming):
+    """This function matches the raw variable names with their new names.
+    Variables whose new name is not given in the renaming file keep their raw name.
+    Args:
+        renaming (pandas.DataFrame): The content of the renaming file.
+    Returns:
+        renaming_dict (dict): Dictionary with raw names as keys and new names as values.
+    """
+    return {
+        raw_name: new_name
+        for raw_name, new_name in zip(renaming["raw_name"], renaming["new_name"])
+        if pd.notna(new_name)
+    }
+
+
+def missing_codes_from_renaming(renaming):
+    """This function reads the per-variable missing codes from the renaming file.
+    The optional "missing_codes" column of the renaming file contains comma
+    separated codes (e.g. "-5,-6") for the variables which do not use the
+    default missing codes.
+    Args:
+        renaming (pandas.DataFrame): The content of the renaming file.
+    Returns:
+        missing_codes (dict): Dictionary with column names as keys and lists of
+        missing codes as values.
+    """
+    if "missing_codes" not in renaming:
+        return {}
+    missing_codes = {}
+    for raw_name, new_name, codes in renaming[
+        ["raw_name", "new_name", "missing_codes"]
+    ].itertuples(index=False):
+        if pd.notna(codes):
+            name = new_name if pd.notna(new_name) else raw_name
+            missing_codes[name] = [int(code) for code in str(codes).split(",")]
+    return missing_codes
+
+
+def _parse_renaming(content):
+    """Parses and validates the content of a renaming file."""
+    table = pd.read_csv(io.BytesIO(content), sep=";")
+    absent = sorted({"raw_name", "new_name"}.difference(table.columns))
+    if absent:
+        raise ValueError(f"The renaming file has no columns {absent}.")
+    for column in ["raw_name", "new_name"]:
+        duplicated = table[column].dropna()
+        duplicated = sorted(duplicated[duplicated.duplicated()].unique())
+        if duplicated:
+            raise ValueError(f"The {column}s {duplicated} are not unique.")
+    return Renaming(table, get_renaming_dict(table), missing_codes_from_renaming(table))
+
+
+def load_renaming(i, path=None):
+    """This function loads the parsed renaming file of a dataset (see read_memoized).
+    Args:
+        i (str): The name of the dataset.
+        path (str, path object or file-like object): The renaming file. Default value
+        is SRC/"data_management/{i}/{i}_renaming.csv".
+    Returns:
+        renaming (Renaming): The parsed renaming file.
+    Raises:
+        ValueError: If the file has no "raw_name" or "new_name" column or if a name
+        occurs twice.
+    """
+    if path is None:
+        path = SRC / f"data_management/{i}/{i}_renaming.csv"
+    return read_memoized("renaming", path, _parse_renaming)
+
+
+def read_dummy_specs(entries):
+    """This function reads the dummy specifications of a .yaml file.
+    An entry is either a variable name, whose dummy is 1 for the value 1
+    (e.g. Yes=1,No=2), or a variable name with a specification. The specification
+    {"one": value} gives the value coded as 1 (e.g. {"one": 2} for reversed variables)
+    and {"greater_than": value} codes all values above the threshold as 1.
+    Args:
+        entries (list): The list of variables from the .yaml file.
+    Returns:
+        specs (dict): Dictionary with variable names as keys and their
+        specification as values.
+    """
+    specs = {}
+    for entry in entries:
+        if isinstance(entry, str):
+            specs[entry] = {"one": 1}
+            continue
+        for variable, spec in entry.items():
+            if len(spec) != 1 or not set(spec) <= {"one", "greater_than"}:
+                raise ValueError(
+                    f"The dummy of {variable} needs either 'one' or 'greater_than'."
+                )
+            specs[variable] = spec
+    return specs
+
+
+def _parse_dummies(content):
+    """Parses and validates the content of a dummy file. The file is either a list
+    of variables or has the lists "others" and "deprivation"."""
+    entries = yaml.safe_load(content) or []
+    if isinstance(entries, list):
+        return Dummies(read_dummy_specs(entries), [])
+    unknown = sorted(set(entries).difference(["others", "deprivation"]))
+    if unknown:
+        raise ValueError(f"The dummy file has unknown lists {unknown}.")
+    deprivation = [str(item) for item in entries.get("deprivation") or []]
+    return Dummies(read_dummy_specs(entries.get("others") or []), deprivation)
+
+
+def load_dummies(i, path=None):
+    """This function loads the parsed dummy file of a dataset (see read_memoized).
+    Args:
+        i (str): The name of the dataset.
+        path (str, path object or file-like object): The .yaml file. Default value is
+        SRC/"data_management/dummies/{i}_dummies.yaml".
+    Returns:
+        dummies (Dummies): The parsed dummy file.
+    Raises:
+        ValueError: If a specification is not valid (see read_dummy_specs).
+    """
+    if path is None:
+        path = SRC / f"data_management/dummies/{i}_dummies.yaml"
+    return read_memoized("dummies", path, _parse_dummies)
+
+
+def _parse_stat_labels(content):
+    """Parses and validates the content of a summary statistics file."""
+    labels = yaml.safe_load(content) or {}
+    if not isinstance(labels, dict) or not all(
+        isinstance(label, str) for label in labels.values()
+    ):
+        raise ValueError("The summary statistics file must map variables to labels.")
+    return {str(variable): label for variable, label in labels.items()}
+
+
+def load_stat_labels(i, path=None):
+    """This function loads the variables of the summary statistics table of a dataset
+    and their labels (see read_memoized).
+    Args:
+        i (str): The name of the dataset.
+        path (str, path object or file-like object): The .yaml file. Default value is
+        SRC/"final/{i}_stat.yaml".
+    Returns:
+        labels (dict): Dictionary with variable names as keys and labels as values.
+    """
+    if path is None:
+        path = SRC / f"final/{i}_stat.yaml"
+    return read_memoized("stat", path, _parse_stat_labels)
+
+
+def load_ranges(i, path=None):
+    """This function loads the valid ranges of the variables of a dataset.
+    The ranges are given in "ranges/{i}_ranges.yaml" as patterns of new
+    variable names (e.g. "b5_*_*") with the lowest and highest valid value.
+    Args:
+        i (str): The name of the dataset.
+        path (str, path object): Path to the .yaml file. Default value is
+        SRC/"data_management/ranges/{i}_ranges.yaml".
+    Returns:
+        ranges (dict): Dictionary with patterns as keys and [lowest, highest] as
+        values. Empty if the dataset has no .yaml file.
+    """
+    if path is None:
+        path = SRC / f"data_management/ranges/{i}_ranges.yaml"
+    try:
+        return dict(read_memoized("ranges", path, _parse_ranges))
+    except FileNotFoundError:
+        return {}
+
+
+def _parse_ranges(content):
+    """Parses and validates the content of a ranges file."""
+    ranges = yaml.safe_load(content) or {}
+    for pattern, bounds in ranges.items():
+        if len(bounds) != 2 or bounds[0] > bounds[1]:
+            raise ValueError(f"The range of {pattern} must be [lowest, highest].")
+    return ranges
+
+
+def read_scales(scales=None):
+    """This function reads the scale registry of the individual dataset (PENDDAT).
+    Each scale maps its facets to the pattern of their item columns
+    (e.g. "b5_ext": "b5_ext_*") and can give a pattern of items to "exclude",
+    the "score" ("mean" or "sum") and the minimum number of answered items
+    "min_valid".
+    Args:
+        scales (str,path object or file-like object) : Path to the .yaml file.
+        Default value is SRC/"data_management/scales/PENDDAT_scales.yaml".
+    Returns:
+        registry (dict): Dictionary with scale names as keys and their
+        specification as values.
+    """
+    if scales is None:
+        scales = Path(SRC / "data_management/scales/PENDDAT_scales.yaml")
+    return deepcopy(read_memoized("scales", scales, _parse_scales))
+
+
+def _parse_scales(content):
+    """Parses and validates the content of the scale registry."""
+    registry = yaml.safe_load(content)
+    for name, scale in registry.items():
+        if scale.get("score", "mean") not in ("mean", "sum"):
+            raise ValueError(f"The score of the scale {name} must be 'mean' or 'sum'.")
+    return registry
@@ -0,0 +1,245 @@
+"""
+This file contains the functions which reshape the panel datasets from long
+format (one row per person and wave) to wide format (one row per person with one
+column per variable and wave) and back
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+# The wide column of a variable in a wave is "{variable}{WAVE_SEPARATOR}{wave}",
+# e.g. "age_w11".
+WAVE_SEPARATOR = "_w"
+
+
+def _values(df, name):
+    """Returns a column or an index level of a dataframe as array."""
+    if name in df.columns:
+        return df[name].to_numpy()
+    return df.index.get_level_values(name).to_numpy()
+
+
+def _id_codes(df, keys):
+    """Returns the positions of the ids of the rows of a dataframe among the sorted
+    unique ids and the sorted unique ids. The ids are given by one or more
+    columns or index levels and must not be missing."""
+    frame = pd.DataFrame({key: _values(df, key) for key in keys})
+    if frame.isna().to_numpy().any():
+        raise ValueError(f"The ids {keys} contain missing values.")
+    if len(keys) == 1:
+        codes, uniques = pd.factorize(frame[keys[0]], sort=True)
+        return codes, pd.Index(uniques, name=keys[0])
+    grouped = frame.groupby(keys, sort=True)
+    return grouped.ngroup().to_numpy(), grouped.size().index
+
+
+def _nullable(dtype):
+    """Returns the dtype which can hold missing values of a column: integer and
+    bool columns become their nullable dtype, the other dtypes are kept."""
+    if isinstance(dtype, np.dtype) and dtype.kind in "iu":
+        return pd.api.types.pandas_dtype(str(dtype).capitalize())
+    if isinstance(dtype, np.dtype) and dtype.kind == "b":
+        return pd.BooleanDtype()
+    return dtype
+
+
+def _sparse(column):
+    """Converts a wide column to a sparse column whose missing values are not
+    stored. Integers and bools are stored as the smallest float which holds them
+    exactly, other columns as objects."""
+    dtype = column.dtype
+    kind = getattr(dtype, "kind", "O")
+    if isinstance(dtype, pd.CategoricalDtype) or kind not in "iubf":
+        return column.astype(object).astype(pd.SparseDtype(object, np.nan))
+    if kind == "f":
+        subtype = getattr(dtype, "numpy_dtype", dtype)
+    else:
+        subtype = np.dtype("float32" if dtype.itemsize <= 2 else "float64")
+    values = column.to_numpy(dtype=subtype, na_value=np.nan)
+    return pd.Series(
+        pd.arrays.SparseArray(values, fill_value=np.nan), index=column.index
+    )
+
+
+def long_to_wide(df, variables, id_vars=("p_id",), wave="wave", sparse=False):
+    """This function reshapes variables of a panel dataset from long to wide format,
+    with one row per id and the columns "{variable}_w{wave}" for each wave. The
+    rows and waves get integer codes once (see _id_codes), which give the row of
+    each observation in the wide columns. The wide columns are then taken column
+    by column from the long columns, so that they keep their compact dtypes
+    (integer and bool columns become nullable) and no frame of all variables and
+    waves as float is built. Sparse columns cannot hold these dtypes, so the
+    dtypes of the variables are kept in wide.attrs["dtypes"], from which
+    wide_to_long restores them.
+    Args:
+        df (pandas.DataFrame): The dataset in long format, e.g. PENDDAT_weighted.
+        variables (list): The variables to be reshaped.
+        id_vars (tuple): The columns or index levels which identify the rows of
+        the wide dataset. Default value is ("p_id",).
+        wave (str): The column or index level of the wave. Default value is "wave".
+        sparse (bool): Whether the wide columns are sparse, so that only the
+        observed values are stored (see _sparse). Default value is False.
+    Returns:
+        wide (pandas.DataFrame): The dataset in wide format with the index id_vars.
+    Raises:
+        ValueError: If an id is missing or has several rows in a wave.
+    """
+    id_vars = list(id_vars)
+    rows, index = _id_codes(df, id_vars)
+    waves, wave_values = pd.factorize(_values(df, wave), sort=True)
+    observed = waves >= 0
+    slots = waves[observed].astype("int64") * len(index) + rows[observed]
+    if len(np.unique(slots)) < len(slots):
+        raise ValueError(f"The rows of {id_vars} and {wave} are not unique.")
+    lookup = np.full((len(wave_values), len(index)), -1, dtype="int64")
+    lookup[waves[observed], rows[observed]] = np.flatnonzero(observed)
+    columns, dtypes = {}, {}
+    for variable in variables:
+        dtypes[variable] = _nullable(df[variable].dtype)
+        values = df[variable].astype(dtypes[variable], copy=False).array
+        # one take for all waves, the wide column of each wave is a slice of it
+        taken = values.take(lookup.ravel(), allow_fill=True)
+        for k, value in enumerate(wave_values):
+            column = pd.Series(
+                taken[k * len(index) : (k + 1) * len(index)], index=index, copy=False
+            )
+            if sparse:
+                column = _sparse(column)
+            columns[f"{variable}{WAVE_SEPARATOR}{value}"] = column
+    wide = pd.DataFrame(columns, index=index, copy=False)
+    wide.attrs["dtypes"] = dtypes
+    return wide
+
+
+def wide_columns(wide, separator=WAVE_SEPARATOR):
+    """This function finds the variables and waves of the columns of a dataset in
+    wide format.
+    Args:
+        wide (pandas.DataFrame): The dataset in wide format.
+        separator (str): The separator between variable and wave. Default value is
+        WAVE_SEPARATOR.
+    Returns:
+        columns (dict): Dictionary with the variables as keys and dictionaries with
+        the waves as keys and the wide columns as values as values.
+    """
+    pattern = re.compile(rf"^(.+){re.escape(separator)}(\d+)$")
+    columns = {}
+    for column in wide.columns:
+        match = pattern.match(str(column))
+        if match:
+            columns.setdefault(match[1], {})[int(match[2])] = column
+    return columns
+
+
+def _allocate(dtype, n):
+    """Returns the preallocated arrays of n missing values of a dtype and a
+    function which builds the column from them. Categorical columns are built from
+    their codes and nullable columns from their values and mask."""
+    if isinstance(dtype, pd.CategoricalDtype):
+        codes = np.full(n, -1, dtype=np.min_scalar_type(-len(dtype.categories) - 1))
+        arrays = {"codes": codes, "dtype": dtype}
+        return arrays, lambda: pd.Categorical.from_codes(codes, dtype=dtype)
+    if hasattr(dtype, "numpy_dtype"):
+        arrays = {"data": np.zeros(n, dtype.numpy_dtype), "mask": np.ones(n, bool)}
+        return arrays, lambda: dtype.construct_array_type()(
+            arrays["data"], arrays["mask"]
+        )
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        arrays = {"values": np.full(n, None, dtype=object)}
+        return arrays, lambda: pd.array(arrays["values"], dtype=dtype)
+    missing = {
+        "f": np.nan,
+        "c": np.nan,
+        "M": np.datetime64("NaT"),
+        "m": np.timedelta64("NaT"),
+    }
+    arrays = {"values": np.full(n, missing.get(dtype.kind, None), dtype=dtype)}
+    return arrays, lambda: arrays["values"]
+
+
+def _fill(arrays, column, positions, destinations):
+    """Writes the values of a wide column at positions to their destinations in
+    preallocated arrays (see _allocate)."""
+    if isinstance(column.dtype, pd.SparseDtype):
+        column = column.sparse.to_dense()
+    if "codes" in arrays:
+        codes = pd.Categorical(column.to_numpy(), dtype=arrays["dtype"]).codes
+        arrays["codes"][destinations] = codes[positions]
+    elif "mask" in arrays:
+        missing = column.isna().to_numpy()
+        if not isinstance(column.dtype, pd.api.extensions.ExtensionDtype):
+            column = column.fillna(0)  # dense sparse columns are floats with NaN
+        data = column.to_numpy(dtype=arrays["data"].dtype, na_value=0)
+        arrays["data"][destinations] = data[positions]
+        arrays["mask"][destinations] = missing[positions]
+    else:
+        values = column.to_numpy(dtype=arrays["values"].dtype)
+        arrays["values"][destinations] = values[positions]
+
+
+def _dense_dtype(dtype):
+    """Returns the dtype of the long column of wide columns of a dtype whose
+    variable has no dtype in the attrs of the wide dataset."""
+    if isinstance(dtype, pd.SparseDtype):
+        dtype = dtype.subtype
+    return _nullable(dtype)
+
+
+def wide_to_long(wide, variables=None, wave="wave", separator=WAVE_SEPARATOR):
+    """This function reshapes a dataset from wide format (see long_to_wide) to long
+    format with one row for each id and wave in which one of the variables is
+    observed. The rows of the long dataset are found once. Each long column is
+    then preallocated and filled wave by wave from the wide columns, so that
+    only one column is built at a time. The long columns get the dtypes of the
+    variables kept by long_to_wide in wide.attrs["dtypes"], also when the wide
+    columns are sparse. Without them (e.g. after the wide dataset was saved)
+    sparse columns come back as floats and objects.
+    Args:
+        wide (pandas.DataFrame): The dataset in wide format, with the ids as index.
+        variables (list): The variables to be reshaped. Default value is None,
+        which reshapes all variables with wide columns (see wide_columns).
+        wave (str): The name of the wave in the long dataset. Default value is
+        "wave".
+        separator (str): The separator between variable and wave. Default value is
+        WAVE_SEPARATOR.
+    Returns:
+        df (pandas.DataFrame): The dataset in long format, sorted by the ids and
+        wave, with the ids and wave as index.
+    """
+    columns = wide_columns(wide, separator)
+    variables = list(columns) if variables is None else list(variables)
+    waves = sorted({value for variable in variables for value in columns[variable]})
+    observed = np.zeros((len(waves), len(wide)), dtype=bool)
+    for k, value in enumerate(waves):
+        for variable in variables:
+            if value in columns[variable]:
+                observed[k] |= wide[columns[variable][value]].notna().to_numpy()
+    # the long rows are sorted by id and wave, so the destination of an observed
+    # value is the number of observed values before it in the transposed order
+    order = (np.cumsum(observed.T.ravel()) - 1).reshape(len(wide), len(waves))
+    positions = [np.flatnonzero(observed[k]) for k in range(len(waves))]
+    destinations = [order[positions[k], k] for k in range(len(waves))]
+    rows, wave_codes = np.nonzero(observed.T)
+    ids = wide.index.take(rows)
+    index = pd.MultiIndex.from_arrays(
+        [ids.get_level_values(level) for level in range(ids.nlevels)]
+        + [np.asarray(waves, dtype="int64")[wave_codes]],
+        names=list(wide.index.names) + [wave],
+    )
+    long = {}
+    dtypes = wide.attrs.get("dtypes", {})
+    for variable in variables:
+        first = wide[next(iter(columns[variable].values()))]
+        dtype = dtypes.get(variable, _dense_dtype(first.dtype))
+        arrays, build = _allocate(dtype, len(rows))
+        for k, value in enumerate(waves):
+            if value in columns[variable]:
+                _fill(
+                    arrays,
+                    wide[columns[variable][value]],
+                    positions[k],
+                    destinations[k],
+                )
+        long[variable] = pd.Series(build(), index=index, copy=False)
+    return pd.DataFrame(long, index=index, copy=False)
@@ -0,0 +1,171 @@
+"""
+This file contains the sampler which writes a small "original_data" of a share of
+the households, with all their waves, persons and weights, for fast development
+runs of the whole pipeline
+"""
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.config import SAMPLE_SEED
+from src.config import SRC
+from src.data_management.cleaning_functions import get_names_dataset
+from src.data_management.cleaning_functions import get_release
+from src.data_management.labels import stata_label_names
+from src.data_management.metadata import load_renaming
+
+MANIFEST = "sample.json"
+
+
+def household_draws(hh_ids, seed=SAMPLE_SEED):
+    """This function draws a number in [0, 1) for each household from its id and
+    the seed only (with the splitmix64 mixer), so that a household is drawn the
+    same in every dataset, wave and release and no random state is needed.
+    Args:
+        hh_ids (array-like): The household ids.
+        seed (int): The seed. Default value is SAMPLE_SEED in "src/config.py".
+    Returns:
+        draws (numpy.ndarray): The numbers of the households.
+    """
+    x = np.asarray(hh_ids).astype("int64").astype("uint64")
+    with np.errstate(over="ignore"):
+        x = x + np.uint64(seed + 1) * np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        x = x ^ (x >> np.uint64(31))
+    return (x >> np.uint64(11)).astype("float64") / 2.0**53
+
+
+def sample_households(hh_ids, fraction, seed=SAMPLE_SEED):
+    """This function selects a share of the households (see household_draws).
+    Args:
+        hh_ids (array-like): The household ids.
+        fraction (float): The share of the households, between 0 and 1.
+        seed (int): The seed. Default value is SAMPLE_SEED in "src/config.py".
+    Returns:
+        sampled (numpy.ndarray): Whether each household is sampled.
+    """
+    if not 0 < fraction <= 1:
+        raise ValueError(f"The share of the households {fraction} is not in (0, 1].")
+    return household_draws(hh_ids, seed) < fraction
+
+
+def _raw_name(i, new_name):
+    """Returns the raw name of a variable of a dataset or None."""
+    raw_names = [raw for raw, new in load_renaming(i).names.items() if new == new_name]
+    return raw_names[0] if raw_names else None
+
+
+def _read_release(path):
+    """Reads a .dta file with its codes, variable labels and value labels."""
+    with pd.read_stata(path, iterator=True) as reader:
+        variable_labels = reader.variable_labels()
+        tables = reader.value_labels()
+        varlist, lbllist = stata_label_names(reader)
+        df = reader.read(convert_categoricals=False)
+    value_labels = {
+        column: tables[table]
+        for column, table in zip(varlist, lbllist)
+        if table in tables and pd.api.types.is_integer_dtype(df[column])
+    }
+    return df, variable_labels, value_labels
+
+
+def _sources(source):
+    """Returns the latest release of each dataset in source with its size and
+    modification time, which identify the release without reading it."""
+    releases = {i: get_release(i, source) for i in get_names_dataset(source)}
+    return {
+        i: [path.name, path.stat().st_size, path.stat().st_mtime_ns]
+        for i, path in releases.items()
+    }
+
+
+def write_sample(source, folder, fraction, seed=SAMPLE_SEED):
+    """This function writes the latest release of each dataset in source with the
+    rows of a share of the households (see sample_households) into folder. All
+    waves and all persons of the sampled households are kept. Datasets without
+    household id (e.g. pweights) keep the persons of the sampled households, so
+    that the datasets and weights of the sample can be merged like the original
+    data. The codes, variable labels and value labels are kept.
+    Args:
+        source (str, path object): The folder of the original .dta files.
+        folder (str, path object): The folder of the sample.
+        fraction (float): The share of the households, between 0 and 1.
+        seed (int): The seed. Default value is SAMPLE_SEED in "src/config.py".
+    Returns:
+        rows (dict): Dictionary with dataset names as keys and the number of rows
+        of their sample as values.
+    """
+    source, folder = Path(source), Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    datasets = {}
+    for i in get_names_dataset(source):
+        release = get_release(i, source)
+        datasets[i] = (release, *_read_release(release))
+    persons = []
+    for i, (_, df, _, _) in datasets.items():
+        hnr, pnr = _raw_name(i, "hh_id"), _raw_name(i, "p_id")
+        if hnr is not None and pnr is not None:
+            sampled = sample_households(df[hnr], fraction, seed)
+            persons.append(df.loc[sampled, pnr].unique())
+    persons = np.unique(np.concatenate(persons)) if persons else np.array([])
+    rows = {}
+    for i, (path, df, variable_labels, value_labels) in datasets.items():
+        hnr, pnr = _raw_name(i, "hh_id"), _raw_name(i, "p_id")
+        if hnr is not None:
+            df = df.loc[sample_households(df[hnr], fraction, seed)]
+        elif pnr is not None:
+            df = df.loc[df[pnr].isin(persons)]
+        df.to_stata(
+            folder / path.name,
+            write_index=False,
+            variable_labels=variable_labels,
+            value_labels=value_labels,
+            version=118,
+        )
+        rows[i] = len(df)
+    return rows
+
+
+def update_sample(source, folder, fraction, seed=SAMPLE_SEED):
+    """This function writes the sample (see write_sample) unless the sample in
+    folder was already drawn from the same releases with the same share and seed.
+    The releases, the share and the seed are recorded in "sample.json" in folder.
+    Args:
+        source (str, path object): The folder of the original .dta files.
+        folder (str, path object): The folder of the sample.
+        fraction (float): The share of the households, between 0 and 1.
+        seed (int): The seed. Default value is SAMPLE_SEED in "src/config.py".
+    Returns:
+        updated (bool): Whether the sample was written.
+    """
+    folder = Path(folder)
+    manifest = {"fraction": fraction, "seed": seed, "sources": _sources(source)}
+    path = folder / MANIFEST
+    if path.exists() and json.loads(path.read_text()) == manifest:
+        return False
+    for old in folder.glob("*.dta"):
+        old.unlink()
+    write_sample(source, folder, fraction, seed)
+    path.write_text(json.dumps(manifest, indent=1))
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write the original data of a share of the households."
+    )
+    parser.add_argument("folder", help="folder of the sampled .dta files")
+    parser.add_argument("--fraction", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=SAMPLE_SEED)
+    parser.add_argument("--source", default=SRC / "original_data")
+    arguments = parser.parse_args()
+    rows = write_sample(
+        arguments.source, arguments.folder, arguments.fraction, arguments.seed
+    )
+    for i, n in rows.items():
+        print(f"{i}: {n} rows")
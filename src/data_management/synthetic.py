@@ -0,0 +1,334 @@
+"""
+This file contains the functions which generate synthetic datasets with the
+variables, codes, missing codes and panel structure of the PASS campus file, so
+that the pipeline can be tested and benchmarked without the original data
+"""
+import argparse
+import zlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.data_management.catalog import load_catalog
+
+# Number of households interviewed in the first wave at scale 1. Scale 1 stands
+# for the campus file, so scale 10 and 100 give ten and a hundred times as many
+# households and persons.
+HOUSEHOLDS = 4000
+WAVES = 11
+FIRST_YEAR = 2006
+
+# Share of the households which leave the panel after each wave. The same number
+# of households enters with a refreshment sample in each wave.
+ATTRITION = 0.15
+
+# Share of the persons of a household who are not interviewed in a wave.
+PERSON_NONRESPONSE = 0.1
+
+# Shares of the default item nonresponse codes, "don't know" (-1) and "no
+# answer" (-2). Variables with their own missing codes use the first two of them.
+ITEM_NONRESPONSE = {-1: 0.02, -2: 0.01}
+
+# Codes of the items which are filtered out by an earlier answer (-3) and of the
+# items which are not asked in a wave (-10).
+FILTERED = -3
+NOT_ASKED = -10
+
+# Value labels of the .dta files. All variables with missing codes have the labels
+# of the missing codes and some variables also labels of their answers.
+MISSING_LABELS = {
+    -1: "[-1] No answer",
+    -2: "[-2] Don't know",
+    -3: "[-3] Not applicable (filter)",
+    -10: "[-10] Item not surveyed in wave",
+}
+VALUE_LABELS = {"zpsex": {1: "[1] Male", 2: "[2] Female"}}
+
+# Questionnaire modules (prefixes of raw names) which are not asked in every wave
+# and the share of the waves they are asked in. The last wave asks all modules.
+MODULES = {"PEO": 0.7, "PQB": 0.7, "HLS": 0.8}
+
+# Items of persons in employment, which are filtered out for the other persons.
+JOB_ITEMS = ["PQB", "azges1", "netges", "brges", "isei1", "isei2"]
+
+# Variables with metric values: (distribution, parameters, decimals).
+METRIC = {
+    "PG0100": ("poisson", (2.0,), 0),
+    "PSK0200": ("poisson", (4.0,), 0),
+    "azges1": ("uniform", (5, 48), 0),
+    "netges": ("lognormal", (7.2, 0.6), 0),
+    "brges": ("lognormal", (7.6, 0.6), 0),
+    "isei1": ("uniform", (16, 90), 0),
+    "isei2": ("uniform", (16, 90), 0),
+    "hhincome": ("lognormal", (7.5, 0.6), 0),
+    "oecdincn": ("lognormal", (7.1, 0.5), 0),
+    "depindug2": ("poisson", (3.0,), 0),
+    "depindg2": ("uniform", (0, 11), 2),
+    "wohnfl": ("lognormal", (4.4, 0.35), 0),
+}
+
+# Shares of the answers to the deprivation items: whether the household has the
+# item ("a": yes, no) and why it lacks it ("b": financial, other reasons).
+DEPRIVATION_SHARES = {"a": [0.85, 0.15], "b": [0.6, 0.4]}
+
+# Variables without a declared range or dummy whose codes are not 1 to 5.
+CODES = {"PA0100": (0, 10), "PA0300": (0, 10), "PA0800": (1, 10), "PA0900": (1, 10)}
+
+# The units of the rows of the datasets (see generate_panel).
+UNITS = {
+    "HHENDDAT": "households",
+    "hweights": "households",
+    "PENDDAT": "persons",
+    "pweights": "persons",
+}
+
+
+def _rng(seed, *keys):
+    """Returns a random number generator for a seed and keys (e.g. a variable).
+    Each variable has its own generator, so that its values do not depend on the
+    other variables."""
+    return np.random.default_rng(
+        [seed] + [zlib.crc32(str(key).encode()) for key in keys]
+    )
+
+
+def _positions(counts):
+    """Returns the position of each element in its group for groups of sizes counts."""
+    return np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+def generate_panel(households=HOUSEHOLDS, waves=WAVES, seed=0):
+    """This function generates the panel structure of the households and persons.
+    The households of the first wave leave the panel after a geometric number of
+    waves and the same share of households enters with a refreshment sample in
+    each later wave. Each household has respondents who keep their sex and year of
+    birth over the waves, and some of them are not interviewed in a wave.
+    Args:
+        households (int): The number of households in the first wave. Default
+        value is HOUSEHOLDS.
+        waves (int): The number of waves. Default value is WAVES.
+        seed (int): The seed. Default value is 0.
+    Returns:
+        panel (dict): Dictionary with "households" and "persons" as keys and
+        dictionaries with the raw variables of the panel structure of each
+        household or person in each wave as values.
+    """
+    rng = _rng(seed, "panel")
+    refreshment = int(round(households * ATTRITION))
+    entries = np.r_[
+        np.ones(households, dtype="int64"),
+        np.repeat(np.arange(2, waves + 1), refreshment),
+    ]
+    exits = np.minimum(entries + rng.geometric(ATTRITION, len(entries)) - 1, waves)
+    sizes = np.minimum(1 + rng.poisson(1.2, len(entries)), 8)
+    respondents = 1 + rng.binomial(sizes - 1, 0.5)
+    strata = rng.integers(1, 41, len(entries))
+    psu = strata * 10 + rng.integers(0, 10, len(entries))
+    design_weights = rng.lognormal(6.5, 0.5, len(entries))
+
+    # one row for each household in each wave
+    household = np.repeat(np.arange(len(entries)), exits - entries + 1)
+    welle = entries[household] + _positions(exits - entries + 1)
+    last = welle == waves
+    wqhh = design_weights[household] * rng.lognormal(0, 0.15, len(household))
+    hpbleib = np.where(
+        last, -1.0, rng.lognormal(0, 0.05, len(household)) / (1 - ATTRITION)
+    )
+    households_df = {
+        "hnr": (household + 1).astype("int32"),
+        "welle": welle.astype("int8"),
+        "HA0100": sizes[household].astype("int8"),
+        "sample": np.minimum(entries[household], 100).astype("int8"),
+        "dw": design_weights[household],
+        "wqhh": wqhh,
+        "hpbleib": hpbleib,
+        "psu": psu[household].astype("int16"),
+        "strpsu": strata[household].astype("int8"),
+    }
+
+    # the respondents of each household and their rows in each wave
+    numbers = _positions(respondents) + 1
+    first_person = np.cumsum(respondents) - respondents
+    sex = rng.integers(1, 3, len(numbers))
+    entry_age = np.where(
+        numbers == 1,
+        rng.integers(18, 80, len(numbers)),
+        rng.integers(15, 80, len(numbers)),
+    )
+    birth_year = FIRST_YEAR + np.repeat(entries, respondents) - entry_age
+    row = np.repeat(np.arange(len(household)), respondents[household])
+    person = first_person[household[row]] + _positions(respondents[household])
+    interviewed = (numbers[person] == 1) | (rng.random(len(row)) >= PERSON_NONRESPONSE)
+    row, person = row[interviewed], person[interviewed]
+    persons_df = {
+        "pnr": ((household[row] + 1) * 100 + numbers[person]).astype("int32"),
+        "hnr": households_df["hnr"][row],
+        "welle": households_df["welle"][row],
+        "zpsex": sex[person].astype("int8"),
+        "palter": (FIRST_YEAR + welle[row] - birth_year[person]).astype("int16"),
+        "sample": households_df["sample"][row],
+        "wqp": wqhh[row] * rng.lognormal(0, 0.1, len(row)),
+        "ppbleib": np.where(
+            last[row], -1.0, hpbleib[row] * rng.lognormal(0, 0.02, len(row))
+        ),
+        "psu": households_df["psu"][row],
+        "strpsu": households_df["strpsu"][row],
+    }
+    return {"households": households_df, "persons": persons_df}
+
+
+def _codes(entry, raw_name):
+    """Returns the lowest and highest code of a categorical variable."""
+    if raw_name in CODES:
+        return CODES[raw_name]
+    if pd.notna(entry["low"]):
+        return int(entry["low"]), int(entry["high"])
+    if isinstance(entry["dummy"], dict):
+        return 1, 2
+    return 1, 5
+
+
+def _answers(rng, entry, raw_name, n):
+    """Returns the valid answers of a variable. Categorical variables have their
+    own distribution of codes, so that not all codes are equally frequent."""
+    if raw_name in METRIC:
+        distribution, parameters, decimals = METRIC[raw_name]
+        values = getattr(rng, distribution)(*parameters, n)
+        if decimals:
+            return np.round(values, decimals)
+        return np.round(values).astype("int32")
+    low, high = _codes(entry, raw_name)
+    if isinstance(entry["dummy"], dict) and "deprivation" in entry["dummy"]:
+        shares = DEPRIVATION_SHARES[raw_name[-1]]
+    else:
+        shares = rng.dirichlet(np.full(high - low + 1, 2.0))
+    values = low + rng.choice(high - low + 1, n, p=shares)
+    return values.astype("int8" if high <= 100 else "int16")
+
+
+def _nonresponse(rng, entry, values):
+    """Replaces a share of the answers by the item nonresponse codes."""
+    codes = list(ITEM_NONRESPONSE)
+    if isinstance(entry["missing_codes"], list):
+        codes = entry["missing_codes"][:2]
+    draws = rng.random(len(values))
+    threshold = 0.0
+    for code, share in zip(codes, ITEM_NONRESPONSE.values()):
+        values[(draws >= threshold) & (draws < threshold + share)] = code
+        threshold += share
+    return values
+
+
+def synthetic_dataset(i, panel, seed=0, waves=WAVES):
+    """This function generates a synthetic dataset with the raw variables of the
+    renaming file of the dataset. The codes of each variable come from the
+    variable catalog (declared ranges and dummies, see load_catalog), CODES or
+    METRIC. Survey items have item nonresponse codes, the job items are filtered
+    out (-3) for persons who are not employed, the reasons of the deprivation items
+    for households which have the item, and the MODULES are not asked (-10) in
+    some waves.
+    Args:
+        i (str): The name of the dataset.
+        panel (dict): The panel structure (see generate_panel).
+        seed (int): The seed. Default value is 0.
+        waves (int): The number of waves of the panel. Default value is WAVES.
+    Returns:
+        df (pandas.DataFrame): The dataset with the raw variables as columns.
+    """
+    structure = panel[UNITS[i]]
+    n = len(structure["welle"])
+    entries = load_catalog().variables.loc[i].set_index("raw_name")
+    columns = {}
+    for raw_name in entries.index:
+        entry = entries.loc[raw_name]
+        if raw_name in structure:
+            columns[raw_name] = structure[raw_name]
+        elif raw_name in ("pintjahr", "hintjahr"):
+            columns[raw_name] = (FIRST_YEAR + structure["welle"]).astype("int16")
+        elif raw_name in ("pintmon", "hintmon"):
+            columns[raw_name] = (
+                _rng(seed, i, raw_name).integers(1, 13, n).astype("int8")
+            )
+        else:
+            rng = _rng(seed, i, raw_name)
+            columns[raw_name] = _nonresponse(
+                rng, entry, _answers(rng, entry, raw_name, n)
+            )
+    welle = structure["welle"]
+    asked = {}
+    for module, share in MODULES.items():
+        waves_asked = _rng(seed, module).random(waves + 1) < share
+        waves_asked[waves] = True
+        asked[module] = waves_asked[welle]
+    for raw_name, values in columns.items():
+        if raw_name in structure:
+            continue
+        if "etakt" in columns and raw_name.startswith(tuple(JOB_ITEMS)):
+            values[columns["etakt"] != 1] = FILTERED
+        reason_of = f"{raw_name[:-1]}a"
+        if (
+            raw_name.startswith("HLS")
+            and raw_name.endswith("b")
+            and reason_of in columns
+        ):
+            values[columns[reason_of] != 2] = FILTERED
+        for module in MODULES:
+            if raw_name.startswith(module):
+                values[~asked[module]] = NOT_ASKED
+    df = pd.DataFrame(columns)
+    return df
+
+
+def write_synthetic_data(folder, scale=1, waves=WAVES, seed=0):
+    """This function writes synthetic releases "{i}_cf_W{waves}.dta" of the
+    household (HHENDDAT) and personal (PENDDAT) datasets and their weights
+    (hweights, pweights) into a folder, which can be used instead of
+    "original_data".
+    Args:
+        folder (str, path object): The folder of the .dta files.
+        scale (float): The size relative to the campus file, e.g. 10 for ten
+        times as many households (see HOUSEHOLDS). Default value is 1.
+        waves (int): The number of waves. Default value is WAVES.
+        seed (int): The seed. Default value is 0.
+    Returns:
+        paths (dict): Dictionary with dataset names as keys and the paths of the
+        .dta files as values.
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    panel = generate_panel(max(1, int(round(HOUSEHOLDS * scale))), waves, seed)
+    paths = {}
+    for i in UNITS:
+        df = synthetic_dataset(i, panel, seed, waves)
+        labels = load_catalog().variables.loc[i].set_index("raw_name")["label"]
+        paths[i] = folder / f"{i}_cf_W{waves}.dta"
+        value_labels = {
+            raw_name: {**MISSING_LABELS, **VALUE_LABELS.get(raw_name, {})}
+            for raw_name, values in df.items()
+            if pd.api.types.is_integer_dtype(values)
+            and (raw_name in VALUE_LABELS or (values < 0).any())
+        }
+        df.to_stata(
+            paths[i],
+            write_index=False,
+            value_labels=value_labels,
+            variable_labels={
+                raw_name: label[:80] for raw_name, label in labels.dropna().items()
+            },
+        )
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write synthetic PASS campus files for tests and benchmarks."
+    )
+    parser.add_argument("folder", help="folder of the .dta files")
+    parser.add_argument("--scale", type=float, default=1, help="size (1 = campus file)")
+    parser.add_argument("--waves", type=int, default=WAVES)
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+    write_synthetic_data(
+        arguments.folder, arguments.scale, arguments.waves, arguments.seed
+    )
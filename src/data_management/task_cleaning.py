@@ -1,119 +1,157 @@
-import pandas as pd
 import pytask
 
 from src.config import BLD
+from src.config import N_WORKERS
+from src.config import ORIGINAL_DATA
+from src.config import SAMPLE_FRACTION
+from src.config import SAMPLE_SEED
 from src.config import SRC
+from src.config import STATA_CHUNKSIZE
+from src.data_management.catalog import CATALOG_PATH
+from src.data_management.catalog import catalog_sources
+from src.data_management.catalog import compile_catalog
+from src.data_management.catalog import save_catalog
 from src.data_management.cleaning_functions import *
+from src.data_management.incremental import cleaning_report
+from src.data_management.incremental import update_aggregation
+from src.data_management.incremental import update_cleaning
+from src.data_management.incremental import update_merging
+from src.data_management.labels import read_value_labels
+from src.data_management.labels import save_value_labels
+from src.data_management.sampling import MANIFEST
+from src.data_management.sampling import update_sample
+from src.instrumentation import instrument
 
-names = get_names_dataset()
+# The datasets are collected from "src/original_data". A development run
+# (SAMPLE_FRACTION in "src/config.py") cleans the sampled releases of the same
+# names in ORIGINAL_DATA, which are written by task_sample.
+names = get_names_dataset(SRC / "original_data")
+releases = {
+    i: ORIGINAL_DATA / get_release(i, SRC / "original_data").name for i in names
+}
+
+
+if SAMPLE_FRACTION is not None:
+
+    @pytask.mark.depends_on({i: get_release(i, SRC / "original_data") for i in names})
+    @pytask.mark.produces({**releases, "manifest": ORIGINAL_DATA / MANIFEST})
+    @instrument(kind="task")
+    def task_sample(depends_on, produces):
+        """This task writes the releases in "src/original_data" with the rows of a
+        share of the households into ORIGINAL_DATA (see update_sample), which the
+        other tasks of a development run use as their original data.
+        """
+        update_sample(
+            SRC / "original_data", ORIGINAL_DATA, SAMPLE_FRACTION, SAMPLE_SEED
+        )
+
+
+@pytask.mark.depends_on(catalog_sources())
+@pytask.mark.produces(CATALOG_PATH)
+@instrument(kind="task")
+def task_variable_catalog(depends_on, produces):
+    """This task compiles the renaming files and the .yaml files of all datasets
+    into the variable catalog and saves it into "BLD/catalog". The cleaning
+    functions look the variables up in the catalog (see load_catalog).
+    """
+    save_catalog(compile_catalog(), produces)
 
 
 @pytask.mark.parametrize(
     "depends_on, produces,i",
     [
         (
-            SRC / f"original_data/{i}_cf_W11.dta",
-            BLD / "cleaned_data" / f"{i}_clean.pickle",
+            releases[i],
+            {
+                "data": BLD / "cleaned_data" / f"{i}_clean.parquet",
+                "memory": BLD / "cleaned_data" / f"{i}_memory.csv",
+                "labels": BLD / "cleaned_data" / f"{i}_labels.json",
+            },
             i,
         )
         for i in names
     ],
 )
+@instrument(kind="task")
 def task_basic_cleaning(depends_on, produces, i):
     """This task does the basic cleaning for the dataset provided.
-    It loads dataset from the folder called "original_data,
+    It loads the latest release of the dataset from the folder called "original_data,
     then renames the columns based on csv file as well as replaces
     negative values with NaN. Then it saves the datasets
-    into "BLD/cleaned_data"
+    into "BLD/cleaned_data" together with a report of the memory saved by
+    converting each variable to its smallest dtype and the value labels of the
+    variables (see read_value_labels). If STATA_CHUNKSIZE in
+    "src/config.py" is set, the dataset is read and cleaned in chunks of rows.
+    Otherwise its columns are cleaned by N_WORKERS processes.
+    Only waves which are not yet in "BLD/cleaned_data" or which changed are
+    cleaned, the memory report always covers the whole dataset.
     """
-    df = pd.read_stata(depends_on, convert_categoricals=False)
-    if "pnr" in df.columns:
-        if "hnr" in df.columns:
-            df = clean_data(df, i).set_index(["hh_id", "wave", "p_id"]).sort_index()
-        else:
-            df = clean_data(df, i).set_index(["wave", "p_id"]).sort_index()
-    else:
-        df = clean_data(df, i).set_index(["hh_id", "wave"]).sort_index()
-    df.to_pickle(produces)
+    update_cleaning(
+        depends_on,
+        produces["data"],
+        i,
+        chunksize=STATA_CHUNKSIZE,
+        n_workers=N_WORKERS,
+    )
+    cleaning_report(depends_on, produces["data"], i).to_csv(produces["memory"], sep=";")
+    save_value_labels(read_value_labels(depends_on, i), produces["labels"])
 
 
 @pytask.mark.depends_on(
     {
-        "first": BLD / "cleaned_data" / "PENDDAT_clean.pickle",
-        "second": BLD / "cleaned_data" / "HHENDDAT_clean.pickle",
+        "first": BLD / "cleaned_data" / "PENDDAT_clean.parquet",
+        "second": BLD / "cleaned_data" / "HHENDDAT_clean.parquet",
     }
 )
 @pytask.mark.produces(
     {
-        "first": BLD / "aggregated_data" / "PENDDAT_aggregated.pickle",
-        "second": BLD / "aggregated_data" / "HHENDDAT_aggregated.pickle",
+        "first": BLD / "aggregated_data" / "PENDDAT_aggregated.parquet",
+        "second": BLD / "aggregated_data" / "HHENDDAT_aggregated.parquet",
     }
 )
+@instrument(kind="task")
 def task_aggregation_and_dummy(depends_on, produces):
     """This task does the aggregation (creating variables for traditional gender roles,
      big5 and reversing the variables)
     and creating dummy variables for the dataset provided (PENDDAT and HHENDDAT).
     It loads the cleaned dataset from the
     folder called "BLD/cleaned_data".
-    Then it saves the datasets into "BLD/aggregated_data"
+    Then it saves the datasets into "BLD/aggregated_data".
+    Only new or changed waves are aggregated (see update_aggregation).
     """
-    df_p = pd.read_pickle(depends_on["first"])
-    df_h = pd.read_pickle(depends_on["second"])
-
-    df_p = reverse_code(df_p)  # reverse all the negatively phrased variables
-    df_p = average_big5(df_p)  # get facet averages for big five
-    df_p = average_eri(df_p)  # get facet averages for eri
-    df_p = average_genrole(df_p)  # get traditional gender role average
-
-    df_p, df_h = create_dummies(df_p, df_h)
-    df_h = create_dummies_depr(df_h)
-    df_p.to_pickle(produces["first"])
-    df_h.to_pickle(produces["second"])
+    update_aggregation(depends_on, produces)
 
 
 @pytask.mark.depends_on(
     {
-        "first": BLD / "cleaned_data" / "hweights_clean.pickle",
-        "second": BLD / "cleaned_data" / "pweights_clean.pickle",
-        "third": BLD / "aggregated_data" / "HHENDDAT_aggregated.pickle",
-        "fourth": BLD / "aggregated_data" / "PENDDAT_aggregated.pickle",
+        "first": BLD / "cleaned_data" / "hweights_clean.parquet",
+        "second": BLD / "cleaned_data" / "pweights_clean.parquet",
+        "third": BLD / "aggregated_data" / "HHENDDAT_aggregated.parquet",
+        "fourth": BLD / "aggregated_data" / "PENDDAT_aggregated.parquet",
     }
 )
 @pytask.mark.produces(
     {
-        "first": BLD / "final_data" / "merged_clean.pickle",
-        "second": BLD / "weighted_data" / "HHENDDAT_weighted.pickle",
-        "third": BLD / "weighted_data" / "PENDDAT_weighted.pickle",
+        "first": BLD / "final_data" / "merged_clean.parquet",
+        "second": BLD / "weighted_data" / "HHENDDAT_weighted.parquet",
+        "third": BLD / "weighted_data" / "PENDDAT_weighted.parquet",
+        "fourth": BLD / "final_data" / "merge_report.csv",
     }
 )
+@instrument(kind="task")
 def task_merging(depends_on, produces):
     """This task merges the dataset. It first merges personal
     and household datasets with their weights. In addition,
-    It also merges household and personal datasets
+    It also merges household and personal datasets.
+    Only new or changed waves are merged (see update_merging) and
+    the waves are merged by N_WORKERS processes. The number of persons and
+    households matched in each wave is saved in "merge_report.csv".
     """
-    df_h_c = pd.read_pickle(depends_on["third"])
-    df_p_c = pd.read_pickle(depends_on["fourth"])
-    df_h_w = pd.read_pickle(depends_on["first"])
-    df_p_w = pd.read_pickle(depends_on["second"])
-
-    merged_h = pd.merge(df_h_c, df_h_w, on=["wave", "hh_id"], how="left")
-    merged_p = pd.merge(
-        df_p_c.reset_index(), df_p_w, on=["wave", "p_id"], how="left"
-    ).set_index(["hh_id", "wave", "p_id"])
-    merged_w = pd.merge(
-        merged_p.reset_index(),
-        merged_h,
-        on=["wave", "hh_id", "survey_year", "survey_mon"],
-        how="outer",
-        indicator=True,
-    ).set_index(["wave", "hh_id", "p_id"])
-    merged_w.to_pickle(produces["first"])
-    merged_h.to_pickle(produces["second"])
-    merged_p.to_pickle(produces["third"])
+    update_merging(depends_on, produces, n_workers=N_WORKERS)
 
-    # os.remove(BLD / "cleaned_data" / "HHENDDAT_clean.pickle")
-    # os.remove(BLD / "cleaned_data" / "PENDDAT_clean.pickle")
-    # os.remove(BLD / "cleaned_data" / "hweights_clean.pickle")
-    # os.remove(BLD / "cleaned_data" / "pweights_clean.pickle")
-    # os.remove(BLD / "aggregated_data" / "PENDDAT_aggregated.pickle")
-    # os.remove(BLD / "aggregated_data" / "HHENDDAT_aggregated.pickle")
+    # os.remove(BLD / "cleaned_data" / "HHENDDAT_clean.parquet")
+    # os.remove(BLD / "cleaned_data" / "PENDDAT_clean.parquet")
+    # os.remove(BLD / "cleaned_data" / "hweights_clean.parquet")
+    # os.remove(BLD / "cleaned_data" / "pweights_clean.parquet")
+    # os.remove(BLD / "aggregated_data" / "PENDDAT_aggregated.parquet")
+    # os.remove(BLD / "aggregated_data" / "HHENDDAT_aggregated.parquet")
@@ -1,41 +1,122 @@
+import inspect
+
+import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import pytest
 from numpy.testing import assert_array_almost_equal
 from numpy.testing import assert_equal
+from pandas.testing import assert_frame_equal
 
-from src.config import BLD
-from src.config import SRC
+from src import artifacts
+from src import config
+from src.artifacts import clear_artifact_cache
+from src.artifacts import load_artifact
+from src.artifacts import load_artifacts
+from src.artifacts import save_artifact
+from src.benchmark import cleaning_function_names
+from src.benchmark import FUNCTION_CASES
+from src.benchmark import measure
+from src.benchmark import pipeline_tasks
+from src.benchmark import run_tasks
+from src.data_management.catalog import catalog_sources
+from src.data_management.catalog import clear_catalog_cache
+from src.data_management.catalog import compile_catalog
+from src.data_management.catalog import load_catalog
+from src.data_management.catalog import save_catalog
+from src.data_management.cleaning_functions import aggregate_scales
+from src.data_management.cleaning_functions import create_dummies_depr
+from src.data_management.cleaning_functions import encode_dummies
+from src.data_management.cleaning_functions import mask_missing_codes
+from src.data_management.cleaning_functions import reverse_code
+from src.data_management.dtypes import compact_dtypes
+from src.data_management.dtypes import concat_dtypes
+from src.data_management.incremental import cleaning_report
+from src.data_management.incremental import update_cleaning
+from src.data_management.ingestion import clean_stata
+from src.data_management.ingestion import get_stata_columns
+from src.data_management.labels import load_value_labels
+from src.data_management.labels import read_value_labels
+from src.data_management.labels import save_value_labels
+from src.data_management.labels import ValueLabels
+from src.data_management.merging import join
+from src.data_management.metadata import clear_metadata_cache
+from src.data_management.metadata import load_dummies
+from src.data_management.metadata import load_renaming
+from src.data_management.metadata import read_dummy_specs
+from src.data_management.metadata import read_scales
+from src.data_management.reshape import long_to_wide
+from src.data_management.reshape import wide_to_long
+from src.data_management.sampling import sample_households
+from src.data_management.sampling import update_sample
+from src.data_management.synthetic import generate_panel
+from src.data_management.synthetic import synthetic_dataset
+from src.data_management.synthetic import write_synthetic_data
+from src.final import cube
+from src.final.cube import build_cube
+from src.final.cube import cube_counts
+from src.final.cube import CUBE_DIMENSIONS
+from src.final.cube import cube_means
+from src.final.figures import figure_jobs
+from src.final.figures import FIGURES
+from src.final.figures import render_figures
+from src.final.summary import summary_statistics
+from src.final.variance import bootstrap_means
+from src.final.variance import replicate_weights
+from src.instrumentation import compare_reports
+from src.instrumentation import instrument
+from src.instrumentation import load_report
+from src.instrumentation import report_path
+from src.instrumentation import write_report
+from src.utils import normalize_labels
+from src.utils import remove_brackets_in_categorical_values
 
 # from cleaning_functions import *
-# from pandas.testing import assert_frame_equal
+
+
+@pytest.fixture(scope="module")
+def synthetic_data(tmp_path_factory):
+    """Synthetic .dta files of all datasets and the weighted datasets which the
+    cleaning tasks build from them"""
+    folder = tmp_path_factory.mktemp("synthetic")
+    original_data = folder / "original_data"
+    write_synthetic_data(original_data, scale=0.05)
+    tasks = pipeline_tasks(original_data, folder / "bld")
+    run_tasks(tasks[: [name for name, _, _ in tasks].index("task_merging") + 1])
+    return folder
 
 
 @pytest.fixture
-def original_data_p():
+def original_data_p(synthetic_data):
     df_p = pd.read_stata(
-        SRC / "original_data" / "PENDDAT_cf_W11.dta", convert_categoricals=False
+        synthetic_data / "original_data" / "PENDDAT_cf_W11.dta",
+        convert_categoricals=False,
     )
     return df_p
 
 
 @pytest.fixture
-def original_data_h():
+def original_data_h(synthetic_data):
     df_h = pd.read_stata(
-        SRC / "original_data" / "HHENDDAT_cf_W11.dta", convert_categoricals=False
+        synthetic_data / "original_data" / "HHENDDAT_cf_W11.dta",
+        convert_categoricals=False,
     )
     return df_h
 
 
 @pytest.fixture
-def clean_data_p():
-    df_p_c = pd.read_pickle(BLD / "weighted_data/PENDDAT_weighted.pickle")
+def clean_data_p(synthetic_data):
+    df_p_c = load_artifact(
+        synthetic_data / "bld" / "weighted_data" / "PENDDAT_weighted.parquet"
+    )
     return df_p_c
 
 
 @pytest.fixture
-def clean_data_h():
-    df_h_c = pd.read_pickle(BLD / "weighted_data/HHENDDAT_weighted.pickle")
+def clean_data_h(synthetic_data):
+    df_h_c = load_artifact(
+        synthetic_data / "bld" / "weighted_data" / "HHENDDAT_weighted.parquet"
+    )
     return df_h_c
 
 
@@ -77,3 +158,759 @@ def test_na(original_data_p, clean_data_p):
     expected = (df_p < 0).any().any()
     actual = (df_p_c.fillna(0) >= 0).all().all()
     assert_equal(actual, expected)
+
+
+def test_mask_missing_codes():
+    """This function tests whether all missing codes are masked in one pass,
+    integer columns become nullable integers and per-variable codes are used"""
+    df = pd.DataFrame(
+        {
+            "a": np.array([1, -1, 3, -10], dtype="int8"),
+            "b": np.array([-5, -6, 2, -11], dtype="int16"),
+            "c": [1.5, -2.0, np.nan, -2.5],
+        }
+    )
+    actual = mask_missing_codes(df, missing_codes={"b": [-5, -6]})
+    assert_equal(str(actual["a"].dtype), "Int8")
+    assert_equal(str(actual["b"].dtype), "Int16")
+    assert_equal(actual["a"].isna().tolist(), [False, True, False, True])
+    assert_equal(actual["b"].isna().tolist(), [True, True, False, False])
+    assert_array_almost_equal(actual["c"], [1.5, np.nan, np.nan, -2.5])
+
+
+def test_artifact_projection(tmp_path):
+    """This function tests whether a saved dataset is restored with its index and
+    row order and whether columns and waves can be selected when loading"""
+    df = pd.DataFrame(
+        {
+            "hh_id": [2, 1, 1, 2],
+            "wave": [1, 2, 1, 2],
+            "x": pd.array([1, None, 3, 4], dtype="Int8"),
+            "y": [0.5, 1.5, 2.5, 3.5],
+        }
+    ).set_index(["hh_id", "wave"])
+    save_artifact(df, tmp_path / "df.parquet")
+    assert_frame_equal(load_artifact(tmp_path / "df.parquet"), df)
+    actual = load_artifact(
+        tmp_path / "df.parquet", columns=["x"], filters=[("wave", "==", 2)]
+    )
+    assert_frame_equal(actual, df.loc[df.index.get_level_values("wave") == 2, ["x"]])
+
+
+def test_artifact_cache(tmp_path):
+    """This function tests whether cached datasets are the same as the files, whether
+    changing a loaded dataset leaves the cache unchanged and whether changed files
+    are read again"""
+    clear_artifact_cache()
+    df = pd.DataFrame(
+        {
+            "wave": pd.array([1, 2, 1], dtype="Int8"),
+            "hh_id": [1, 1, 2],
+            "x": pd.array([1, None, 3], dtype="Int16"),
+        }
+    ).set_index(["hh_id", "wave"])
+    save_artifact(df, tmp_path / "a.parquet")
+    expected = load_artifact(tmp_path / "a.parquet")
+    clear_artifact_cache()
+    assert_frame_equal(load_artifact(tmp_path / "a.parquet"), expected)
+    cached = load_artifact(tmp_path / "a.parquet")
+    cached["x"] = 0
+    assert_frame_equal(load_artifact(tmp_path / "a.parquet"), expected)
+    assert_frame_equal(
+        load_artifact(tmp_path / "a.parquet", filters=[("wave", "in", [2])]),
+        expected[expected.index.get_level_values("wave") == 2],
+    )
+    save_artifact(df.assign(x=df["x"] + 1), tmp_path / "a.parquet")
+    assert_frame_equal(
+        load_artifact(tmp_path / "a.parquet"), expected.assign(x=expected["x"] + 1)
+    )
+    save_artifact(df, tmp_path / "b.parquet")
+    clear_artifact_cache()
+    first, second = load_artifacts([tmp_path / "b.parquet", tmp_path / "a.parquet"])
+    assert_frame_equal(first, expected)
+    assert_frame_equal(second, expected.assign(x=expected["x"] + 1))
+
+
+def test_artifact_cache_budget(monkeypatch, tmp_path):
+    """This function tests whether saving keeps the saved dataframe in the cache
+    without reading the file again and whether a budget of 0 turns the cache off"""
+    clear_artifact_cache()
+    df = pd.DataFrame(
+        {"wave": [2, 1, 2], "x": pd.Categorical(["a", "b", None])}
+    ).set_index("wave")
+    read = artifacts._read_artifact
+    reads = []
+    monkeypatch.setattr(
+        artifacts, "_read_artifact", lambda *args: reads.append(args) or read(*args)
+    )
+    save_artifact(df, tmp_path / "a.parquet")
+    df["x"] = "c"
+    cached = load_artifact(tmp_path / "a.parquet")
+    assert_equal(len(reads), 0)
+    clear_artifact_cache()
+    assert_frame_equal(cached, load_artifact(tmp_path / "a.parquet"))
+    monkeypatch.setattr(config, "ARTIFACT_CACHE_BYTES", 0)
+    save_artifact(df, tmp_path / "b.parquet")
+    load_artifact(tmp_path / "b.parquet")
+    load_artifact(tmp_path / "b.parquet")
+    assert_equal(len(reads), 3)
+
+
+@pytest.fixture
+def weights_dta(tmp_path):
+    """A small .dta file with the variables of the pweights dataset"""
+    n = 50
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "pnr": rng.permutation(n).astype("int32"),
+            "welle": rng.integers(1, 4, n).astype("int8"),
+            "sample": rng.integers(1, 3, n).astype("int8"),
+            "wqp": rng.random(n),
+            "ppbleib": rng.choice([1.5, -1.0], n),
+            "psu": rng.integers(-2, 20, n).astype("int16"),
+            "strpsu": rng.integers(1, 5, n).astype("int8"),
+        }
+    )
+    df.to_stata(tmp_path / "pweights_cf_W11.dta", write_index=False)
+    return tmp_path / "pweights_cf_W11.dta"
+
+
+def test_chunked_cleaning(weights_dta, tmp_path):
+    """This function tests whether cleaning the .dta file in chunks gives the
+    same dataset as cleaning the whole file at once"""
+    clean_stata(weights_dta, tmp_path / "whole.parquet", "pweights")
+    clean_stata(weights_dta, tmp_path / "chunks.parquet", "pweights", chunksize=7)
+    expected = load_artifact(tmp_path / "whole.parquet")
+    assert_frame_equal(load_artifact(tmp_path / "chunks.parquet"), expected)
+    assert_equal(list(expected.index.names), ["wave", "p_id"])
+
+
+def test_chunked_cleaning_missing(weights_dta, tmp_path):
+    """This function tests whether cleaning in chunks gives the same dtypes as
+    cleaning the whole file when an integer variable has missing values only in the
+    last chunk, and whether a .dta file without rows can be cleaned"""
+    df = pd.read_stata(weights_dta, convert_categoricals=False)
+    df["strpsu"] = df["strpsu"].astype("Int8").mask(df.index >= 45)
+    df.to_stata(tmp_path / "late.dta", write_index=False)
+    clean_stata(tmp_path / "late.dta", tmp_path / "whole.parquet", "pweights")
+    clean_stata(
+        tmp_path / "late.dta", tmp_path / "chunks.parquet", "pweights", chunksize=7
+    )
+    expected = load_artifact(tmp_path / "whole.parquet")
+    assert_frame_equal(load_artifact(tmp_path / "chunks.parquet"), expected)
+    assert_equal(expected["strpsu"].isna().sum(), 5)
+    df.iloc[:0].to_stata(tmp_path / "empty.dta", write_index=False)
+    for chunksize in [None, 7]:
+        path = tmp_path / f"empty_{chunksize}.parquet"
+        clean_stata(tmp_path / "empty.dta", path, "pweights", chunksize=chunksize)
+        assert_equal(len(load_artifact(path)), 0)
+
+
+def test_parallel_cleaning(weights_dta, tmp_path):
+    """This function tests whether cleaning the columns in several processes
+    saves the same file as cleaning them in one process"""
+    serial = clean_stata(weights_dta, tmp_path / "serial.parquet", "pweights")
+    parallel = clean_stata(
+        weights_dta, tmp_path / "parallel.parquet", "pweights", n_workers=3
+    )
+    assert_frame_equal(parallel, serial)
+    assert (tmp_path / "parallel.parquet").read_bytes() == (
+        tmp_path / "serial.parquet"
+    ).read_bytes()
+
+
+def test_incremental_cleaning(monkeypatch, weights_dta, tmp_path):
+    """This function tests whether adding a new release only cleans the new wave
+    and gives the same dataset as cleaning the new release at once, whether an
+    unchanged release is not read again, whether a corrected release with the
+    same waves is cleaned again and whether the memory report covers the whole
+    dataset"""
+    df = pd.read_stata(weights_dta)
+    df[df["welle"] < 3].to_stata(tmp_path / "pweights_cf_W2.dta", write_index=False)
+    whole = clean_stata(weights_dta, tmp_path / "whole.parquet", "pweights")
+    update_cleaning(
+        tmp_path / "pweights_cf_W2.dta", tmp_path / "inc.parquet", "pweights"
+    )
+    report = update_cleaning(weights_dta, tmp_path / "inc.parquet", "pweights")
+    assert report.loc["total", "bytes_before"] < whole.loc["total", "bytes_before"]
+    assert (tmp_path / "inc.parquet").read_bytes() == (
+        tmp_path / "whole.parquet"
+    ).read_bytes()
+    with monkeypatch.context() as patch:
+        patch.setattr("src.data_management.incremental.read_stata_digests", None)
+        assert (
+            update_cleaning(weights_dta, tmp_path / "inc.parquet", "pweights") is None
+        )
+    assert_frame_equal(
+        cleaning_report(weights_dta, tmp_path / "inc.parquet", "pweights"), whole
+    )
+    df.loc[df["welle"] == 1, "wqp"] += 1
+    df.to_stata(tmp_path / "corrected.dta", write_index=False)
+    corrected = update_cleaning(
+        tmp_path / "corrected.dta", tmp_path / "inc.parquet", "pweights"
+    )
+    assert corrected.loc["total", "bytes_before"] < whole.loc["total", "bytes_before"]
+    weights = load_artifact(tmp_path / "inc.parquet")["p_weight"]
+    expected = load_artifact(tmp_path / "whole.parquet")["p_weight"]
+    waves = weights.index.get_level_values("wave")
+    assert_array_almost_equal(weights[waves == 1], expected[waves == 1] + 1)
+    assert_array_almost_equal(weights[waves > 1], expected[waves > 1])
+
+
+def test_projected_columns(weights_dta, tmp_path):
+    """This function tests whether only the variables of the renaming file are
+    read and whether missing variables are reported"""
+    df = pd.read_stata(weights_dta)
+    df.insert(0, "extra", 1)
+    df.to_stata(tmp_path / "extra.dta", write_index=False)
+    actual = get_stata_columns(tmp_path / "extra.dta", "pweights")
+    assert_equal(actual, list(pd.read_stata(weights_dta).columns))
+    expected = clean_stata(weights_dta, tmp_path / "listed.parquet", "pweights")
+    report = clean_stata(tmp_path / "extra.dta", tmp_path / "extra.parquet", "pweights")
+    assert_frame_equal(report, expected)
+    assert_frame_equal(
+        load_artifact(tmp_path / "extra.parquet"),
+        load_artifact(tmp_path / "listed.parquet"),
+    )
+    df.drop(columns="psu").to_stata(tmp_path / "missing.dta", write_index=False)
+    with pytest.raises(ValueError, match="psu"):
+        get_stata_columns(tmp_path / "missing.dta", "pweights")
+
+
+def test_compact_dtypes():
+    """This function tests whether the smallest dtypes are chosen and whether
+    values outside the declared ranges are reported"""
+    df = pd.DataFrame(
+        {
+            "b5_ext_a": pd.array([1, 5, None], dtype="Int32"),
+            "sex_dummy": [1.0, 0.0, 1.0],
+            "p_id": pd.array([1, 300, 70000], dtype="Int64"),
+            "p_weight": [0.5, 1.5, 2.5],
+        }
+    )
+    ranges = {"*_dummy": [0, 1], "b5_*_*": [1, 5]}
+    actual = compact_dtypes(df, "PENDDAT", ranges=ranges)
+    assert_equal(
+        actual.dtypes.astype(str).tolist(), ["Int8", "bool", "Int32", "float64"]
+    )
+    with pytest.raises(ValueError, match="b5_ext_a"):
+        compact_dtypes(df, "PENDDAT", ranges={"b5_*_*": [1, 4]})
+
+
+def test_concat_dtypes():
+    """This function tests whether waves whose dtypes were chosen separately are
+    put together without object columns"""
+    kept = pd.DataFrame(
+        {
+            "dummy": [True, False],
+            "code": pd.array([1, 2], dtype="Int8"),
+            "label": pd.Categorical(["a", "b"]),
+            "weight": [0.5, 1.5],
+        }
+    )
+    new = pd.DataFrame(
+        {
+            "dummy": pd.array([1, None], dtype="Int8"),
+            "code": pd.array([300, None], dtype="Int16"),
+            "label": pd.Categorical(["c", None]),
+            "weight": [2.5, 3.5],
+        }
+    )
+    actual = concat_dtypes([kept, new])
+    assert_equal(
+        actual.dtypes.astype(str).tolist(), ["Int8", "Int16", "category", "float64"]
+    )
+    assert_equal(actual["dummy"].fillna(-1).tolist(), [1, 0, 1, -1])
+    assert_equal(actual["label"].cat.codes.tolist(), [0, 1, 2, -1])
+
+
+def test_encode_dummies():
+    """This function tests whether the dummies follow the coding given in the
+    .yaml file and stay missing where the variable is missing"""
+    df = pd.DataFrame(
+        {
+            "emp": pd.array([1, 2, None, 1], dtype="Int8"),
+            "migration": pd.array([1, 2, 2, None], dtype="Int8"),
+            "PG0100": pd.array([0, 3, None, 1], dtype="Int16"),
+        }
+    )
+    specs = read_dummy_specs(
+        ["emp", {"migration": {"one": 2}}, {"PG0100": {"greater_than": 0}}]
+    )
+    actual = encode_dummies(df, specs)
+    assert_array_almost_equal(actual["emp_dummy"], [1, 0, np.nan, 1])
+    assert_array_almost_equal(actual["migration_dummy"], [0, 1, 1, np.nan])
+    assert_array_almost_equal(actual["PG0100_dummy"], [0, 1, np.nan, 1])
+    actual = encode_dummies(df, specs, dtype="boolean")
+    assert_equal(actual["emp_dummy"].isna().tolist(), [False, False, True, False])
+    actual = encode_dummies(df, specs, dtype="Sparse")
+    assert_array_almost_equal(
+        actual["PG0100_dummy"].sparse.to_dense(), [0, 1, np.nan, 1]
+    )
+
+
+def test_create_dummies_depr():
+    """This function tests whether the deprivation dummies and indices follow the
+    coding of the "a" and "b" variables"""
+    df = pd.DataFrame(
+        {
+            "HLS0100a": [1, 2, 2, np.nan],
+            "HLS0100b": [np.nan, 1, 2, np.nan],
+            "HLS0200a": [2, 2, 1, np.nan],
+            "HLS0200b": [1, 1, np.nan, np.nan],
+        }
+    )
+    actual = create_dummies_depr(df, items=["HLS0100", "HLS0200"])
+    assert_array_almost_equal(actual["HLS0100_dummy"], [0, 1, 0, np.nan])
+    assert_array_almost_equal(actual["HLS0200_dummy"], [1, 1, 0, np.nan])
+    assert_array_almost_equal(actual["depr_index_items"], [1, 2, 0, np.nan])
+    assert_array_almost_equal(
+        actual["depr_index_items_w"], [1 / 3, 2 / 3 + 1 / 3, 0, np.nan]
+    )
+    weights = {"HLS0100": 2, "HLS0200": 1}
+    actual = create_dummies_depr(df, items=["HLS0100", "HLS0200"], weights=weights)
+    assert_array_almost_equal(actual["depr_index_items_w"], [1, 3, 0, np.nan])
+
+
+def test_aggregate_scales():
+    """This function tests whether the facets leave out the excluded items and
+    follow the score and min_valid rules of the registry"""
+    df = pd.DataFrame(
+        {
+            "x_a": [1, 2, np.nan],
+            "x_b": [3, np.nan, np.nan],
+            "x_b_neg": [5, 5, 5],
+            "y_a": [1, 1, np.nan],
+            "y_b": [2, np.nan, 4],
+        }
+    )
+    registry = {
+        "x": {"facets": {"x": "x_*"}, "exclude": "*_neg"},
+        "y": {"facets": {"y": "y_*"}, "score": "sum", "min_valid": 2},
+    }
+    actual = aggregate_scales(df, registry)
+    assert_array_almost_equal(actual["x"], [2, 2, np.nan])
+    assert_array_almost_equal(actual["y"], [3, np.nan, np.nan])
+
+
+def test_reverse_code():
+    """This function tests whether the variables are reversed with the declared
+    scale bounds, independent of the values in the data"""
+    df = pd.DataFrame(
+        {"b5_ext_a_neg": pd.array([1, 2, None], dtype="Int8"), "b5_ext_b": [1, 2, 3]}
+    )
+    actual = reverse_code(df, ranges={"b5_*_*": [1, 5]})
+    assert_array_almost_equal(actual["b5_ext_a"], [5, 4, np.nan])
+    with pytest.raises(ValueError, match="b5_ext_a_neg"):
+        reverse_code(df, ranges={})
+
+
+def test_join():
+    """This function tests whether the sorted join gives the same rows as pandas.merge
+    and rejects keys which are not unique or not integers"""
+    left = pd.DataFrame(
+        {
+            "wave": pd.array([1, 1, 2, 2], dtype="Int8"),
+            "hh_id": pd.array([3, 1, 1, None], dtype="Int16"),
+            "x": [0.1, 0.2, 0.3, 0.4],
+        }
+    )
+    right = pd.DataFrame(
+        {
+            "wave": pd.array([2, 1, 2, 1], dtype="Int8"),
+            "hh_id": pd.array([1, 3, None, 7], dtype="Int16"),
+            "x": [1, 2, 3, 4],
+        }
+    )
+    on = ["wave", "hh_id"]
+    assert_frame_equal(join(left, right, on), pd.merge(left, right, on=on, how="left"))
+    actual = join(left, right, on, how="outer", indicator=True)
+    expected = pd.merge(left, right, on=on, how="outer", indicator=True)
+    assert_frame_equal(
+        actual.sort_values(["x_y", "x_x"]).reset_index(drop=True),
+        expected.sort_values(["x_y", "x_x"]).reset_index(drop=True),
+    )
+    with pytest.raises(ValueError, match="not unique"):
+        join(right, left.iloc[[0, 0]], on)
+    with pytest.raises(TypeError, match="x"):
+        join(left, right, ["x"])
+
+
+def test_metadata_memoization(tmp_path, monkeypatch):
+    """This function tests whether the renaming and dummy files are parsed once for
+    each content, are loaded from the cache on disk by a new process and are
+    parsed again when they change"""
+    monkeypatch.setattr(config, "METADATA_CACHE", tmp_path / "cache")
+    clear_metadata_cache()
+    path = tmp_path / "X_renaming.csv"
+    path.write_text("raw_name;labels;new_name\npnr;Person;p_id\nwelle;Welle;wave\n")
+    renaming = load_renaming("X", path)
+    assert renaming.names == {"pnr": "p_id", "welle": "wave"}
+    assert load_renaming("X", path) is renaming
+    assert len(list((tmp_path / "cache").glob("renaming-*.pickle"))) == 1
+    clear_metadata_cache()
+    assert_frame_equal(load_renaming("X", path).table, renaming.table)
+    path.write_text("raw_name;labels;new_name\npnr;Person;person\n")
+    assert load_renaming("X", path).names == {"pnr": "person"}
+    path.write_text("raw_name;labels;new_name\npnr;Person;a\nhnr;Haushalt;a\n")
+    with pytest.raises(ValueError, match="new_names"):
+        load_renaming("X", path)
+    path = tmp_path / "X_dummies.yaml"
+    path.write_text('"others":\n  - "emp"\n"deprivation":\n  - "HLS0100"\n')
+    dummies = load_dummies("X", path)
+    assert dummies.specs == {"emp": {"one": 1}}
+    assert dummies.deprivation == ["HLS0100"]
+    clear_metadata_cache()
+
+
+def test_variable_catalog(monkeypatch, tmp_path):
+    """This function tests whether the catalog holds the metadata of the variables,
+    is loaded from its file without hashing its sources again and gives the same
+    results as the patterns"""
+    catalog = compile_catalog()
+    entry = catalog.variable("PENDDAT", "b5_ext_a_neg")
+    assert entry["raw_name"] == "PEO1400a"
+    assert (entry["low"], entry["high"], entry["dtype"]) == (1, 5, "Int8")
+    assert entry["reverse"] and entry["reversed_name"] == "b5_ext_a"
+    assert (entry["scale"], entry["facet"]) == ("big5", "b5_ext")
+    assert catalog.variable("PENDDAT", "migration")["dummy"] == {"one": 2}
+    assert catalog.variable("HHENDDAT", "HLS0100b")["dummy"] == {
+        "deprivation": "HLS0100"
+    }
+    assert catalog.variable("PENDDAT", "unknown") is None
+    assert "dtypes.py" in [path.name for path in catalog_sources()]
+    save_catalog(catalog, tmp_path / "catalog.pickle")
+    clear_catalog_cache()
+    loaded = load_catalog(tmp_path / "catalog.pickle")
+    assert_frame_equal(loaded.variables, catalog.variables)
+    with monkeypatch.context() as patch:
+        patch.setattr("src.data_management.catalog.stage_digest", None)
+        assert load_catalog() is loaded
+    rng = np.random.default_rng(0)
+    columns = catalog.variables.loc["PENDDAT"].index
+    columns = [column for column in columns if column.startswith(("b5_", "eri_"))]
+    df = pd.DataFrame(
+        rng.integers(1, 5, (20, len(columns))).astype("float64"), columns=columns
+    )
+    ranges = {"b5_*_*": [1, 5], "eri_*_*": [1, 4]}
+    expected = reverse_code(df, ranges=ranges)
+    assert_frame_equal(reverse_code(df), expected)
+    assert_frame_equal(
+        aggregate_scales(expected), aggregate_scales(expected, read_scales())
+    )
+
+
+def test_summary_statistics():
+    """This function tests whether the statistics are the ones of pandas without
+    weights and the ones of repeated rows with integer weights, in each wave"""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "wave": rng.integers(1, 4, 101),
+            "x": rng.integers(0, 5, 101).astype("float64"),
+            "y": rng.random(101),
+            "w": rng.integers(1, 4, 101),
+        }
+    )
+    df.loc[rng.random(101) < 0.2, "x"] = np.nan
+    columns = ["count", "mean", "std", "min", "50%", "max"]
+    actual = summary_statistics(df, ["x", "y"])
+    expected = df[["x", "y"]].describe().T[columns]
+    assert_array_almost_equal(actual.to_numpy(), expected.to_numpy())
+    actual = summary_statistics(df, ["x", "y"], weight="w", by="wave")
+    repeated = df.loc[df.index.repeat(df["w"])]
+    expected = repeated.groupby("wave")[["x", "y"]].describe().stack(level=0)
+    assert_array_almost_equal(actual["mean"], expected["mean"])
+    assert_array_almost_equal(actual["median"], expected["50%"])
+    assert_array_almost_equal(actual["max"], expected["max"])
+
+
+def test_bootstrap_means():
+    """This function tests whether the replicates draw whole clusters, do not depend
+    on the number of processes and give the weighted means of the replicate weights"""
+    clusters = np.repeat(np.arange(5), 2)
+    replicates = replicate_weights(np.ones(10), clusters, n_replicates=60, seed=1)
+    assert replicates.shape == (10, 60)
+    assert_array_almost_equal(replicates[::2], replicates[1::2])
+    assert_array_almost_equal(replicates.sum(axis=0), np.full(60, 10.0))
+    assert_array_almost_equal(
+        replicates,
+        replicate_weights(np.ones(10), clusters, n_replicates=60, seed=1, n_workers=2),
+    )
+    with pytest.raises(ValueError, match="several strata"):
+        replicate_weights(np.ones(10), clusters, strata=np.arange(10) % 2)
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "hh_id": np.repeat(np.arange(20), 3),
+            "wave": np.tile([1, 2, 3], 20),
+            "x": rng.random(60),
+            "w": rng.random(60) + 0.5,
+        }
+    )
+    actual = bootstrap_means(df, ["x"], "w", by="wave", n_replicates=20)
+    expected = summary_statistics(df, ["x"], "w", by="wave")
+    assert_array_almost_equal(actual["mean"], expected["mean"])
+    assert (actual["se"] > 0).all()
+
+
+def test_cube():
+    """This function tests whether the counts and means of the cube are the ones of
+    the dataset, also for missing dimensions and weights"""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "wave": rng.integers(1, 3, 50),
+            "sex": pd.array(rng.integers(1, 3, 50), dtype="Int8"),
+            "x": rng.random(50),
+            "w": rng.random(50),
+        }
+    )
+    df.loc[:4, "sex"] = pd.NA
+    df.loc[5:9, "x"] = np.nan
+    cube = build_cube(df, ["wave", "sex"], ["x"], weight="w")
+    assert_array_almost_equal(cube_counts(cube, "wave"), df.groupby("wave").size())
+    selected = df[df["wave"] == 2]
+    assert_array_almost_equal(
+        cube_counts(cube, "sex", {"wave": 2}), selected.groupby("sex").size()
+    )
+    assert_array_almost_equal(
+        cube_means(cube, "sex", ["x"])["x"], df.groupby("sex")["x"].mean()
+    )
+    answered = df.dropna(subset=["x", "sex"])
+    expected = (answered["x"] * answered["w"]).groupby(answered["sex"]).sum()
+    expected /= answered.groupby("sex")["w"].sum()
+    assert_array_almost_equal(
+        cube_means(cube, "sex", ["x"], weighted=True)["x"], expected
+    )
+
+
+def test_render_figures(monkeypatch, tmp_path):
+    """This function tests whether each figure is rendered in its own process for
+    each wave, is closed afterwards and is only rendered again when its cube or
+    the cube functions changed"""
+    rng = np.random.default_rng(0)
+    cubes = {}
+    for i, n in [("PENDDAT", 200), ("HHENDDAT", 100)]:
+        df = pd.DataFrame(
+            {
+                "wave": rng.integers(1, 3, n),
+                "age": rng.integers(18, 80, n),
+                "sex": rng.integers(1, 3, n),
+            }
+        )
+        cubes[i] = tmp_path / f"{i}_cube.parquet"
+        save_artifact(build_cube(df, CUBE_DIMENSIONS["PENDDAT"], [], None), cubes[i])
+    figures = {name: FIGURES[name] for name in ["number_obs", "age_dist"]}
+    jobs = figure_jobs(figures, waves=[1, 2], folder=tmp_path)
+    assert sorted(jobs) == ["age_dist_W1", "age_dist_W2", "number_obs"]
+    assert render_figures(jobs, cubes, figures, n_workers=2) == list(jobs)
+    assert all(path.exists() for _, _, path in jobs.values())
+    assert plt.get_fignums() == []
+    assert render_figures(jobs, cubes, figures) == []
+    save_artifact(load_artifact(cubes["HHENDDAT"]).iloc[1:], cubes["HHENDDAT"])
+    assert render_figures(jobs, cubes, figures) == ["number_obs"]
+    with monkeypatch.context() as patch:
+        patch.setattr(cube, "__file__", str(tmp_path / "changed_cube.py"))
+        assert render_figures(jobs, cubes, figures) == list(jobs)
+
+
+def test_synthetic_data(synthetic_data, original_data_p, original_data_h):
+    """This function tests whether the synthetic datasets have the panel structure
+    of the campus file, valid codes and the same values for the same seed"""
+    persons = original_data_p.set_index(["pnr", "welle"])
+    households = original_data_h.set_index(["hnr", "welle"])
+    assert persons.index.is_unique and households.index.is_unique
+    person_households = pd.MultiIndex.from_frame(original_data_p[["hnr", "welle"]])
+    assert person_households.isin(households.index).all()
+    assert (persons.groupby(level="pnr")["zpsex"].nunique() == 1).all()
+    birth_year = persons["pintjahr"] - persons["palter"]
+    assert (birth_year.groupby(level="pnr").nunique() == 1).all()
+    assert_equal(sorted(original_data_h["welle"].unique()), list(range(1, 12)))
+    answered = original_data_p["PEO1400a"]
+    assert answered[answered > 0].between(1, 5).all()
+    assert answered.isin([-1, -2, -10]).any()
+    filtered = original_data_h.loc[original_data_h["HLS0100a"] == 1, "HLS0100b"]
+    assert (filtered == -3).all()
+    panel = generate_panel(200, 5, seed=1)
+    assert_frame_equal(
+        synthetic_dataset("PENDDAT", panel, seed=1, waves=5),
+        synthetic_dataset("PENDDAT", generate_panel(200, 5, seed=1), seed=1, waves=5),
+    )
+
+
+def test_benchmark_cases():
+    """This function tests whether every function of cleaning_functions.py is in the
+    benchmark suite and whether the measurements have a time and a memory peak"""
+    assert sorted(cleaning_function_names()) == sorted(FUNCTION_CASES)
+    measurement = measure(np.ones, 10**6, repeat=2)
+    assert measurement["seconds"] > 0
+    assert measurement["peak_mb"] >= 7
+
+
+def test_instrumentation(monkeypatch, tmp_path):
+    """This function tests whether the calls of instrumented functions are recorded
+    with their depth and data and whether a slower run is flagged as regression"""
+    monkeypatch.setattr(config, "INSTRUMENTATION", True)
+    monkeypatch.setattr(config, "INSTRUMENTATION_FOLDER", tmp_path)
+    monkeypatch.setenv("PASS_INSTRUMENTATION_RUN", "test")
+    inner = instrument(lambda data: data.iloc[:5])
+    outer = instrument(lambda data: inner(data) * 2, kind="task")
+    data = pd.DataFrame({"a": np.arange(100.0)})
+    assert_frame_equal(outer(data), data.iloc[:5] * 2)
+    report = load_report(report_path())
+    assert_equal(list(report["depth"]), [1, 0])
+    assert_equal(list(report["kind"]), ["function", "task"])
+    assert_equal(list(report["rows_out"]), [5, 0])
+    assert (report["wall_s"] >= 0).all()
+    assert write_report()["calls"].sum() == 2
+    assert (tmp_path / "run-test.csv").exists()
+    slower = report.assign(wall_s=report["wall_s"] + 1)
+    comparison = compare_reports(report, slower)
+    assert comparison["regression"].all()
+    assert not compare_reports(report, report)["regression"].any()
+
+
+def test_instrumented_task(monkeypatch, tmp_path):
+    """This function tests whether an instrumented task is called through the
+    wrapper when pytask unwraps it, and whether the peak memory is measured for
+    each call instead of for the whole process"""
+    monkeypatch.setattr(config, "INSTRUMENTATION", True)
+    monkeypatch.setattr(config, "INSTRUMENTATION_FOLDER", tmp_path)
+    monkeypatch.setenv("PASS_INSTRUMENTATION_RUN", "test")
+    allocate = instrument(lambda n: float(np.ones(n).sum()))
+
+    @instrument(kind="task")
+    def task_example(produces, n):
+        produces.write_text(str(allocate(n)))
+
+    # pytask collects the function which inspect.unwrap returns
+    task = inspect.unwrap(task_example)
+    assert task is task_example
+    assert_equal(list(inspect.signature(task).parameters), ["produces", "n"])
+    task(produces=tmp_path / "large.txt", n=12_500_000)
+    task(produces=tmp_path / "small.txt", n=10)
+    report = load_report(report_path())
+    assert_equal(list(report["kind"]), ["function", "task"] * 2)
+    assert_equal(list(report["name"])[1::2], ["task_example"] * 2)
+    peaks = report["peak_rss_mb"].to_numpy()
+    if not np.isnan(peaks).any():  # the peak can only be reset on Linux
+        assert peaks[1] >= peaks[0] > peaks[2] + 50
+
+
+def test_normalize_labels():
+    """This function tests whether the bracketed numbers are deleted from the labels
+    of categorical and object columns, equal labels are merged and other columns
+    are not changed"""
+    data = pd.DataFrame(
+        {
+            "categorical": pd.Categorical(["[1] ja", "[2] nein", "[-1] ja", None]),
+            "object": pd.Series(["[1] ja", np.nan, 3, "[-2] keine"], dtype=object),
+            "numeric": [1.0, 2.0, np.nan, 4.0],
+        }
+    )
+    categorical = normalize_labels(data["categorical"])
+    assert_equal(list(categorical.cat.categories), ["ja", "nein"])
+    assert_equal(list(categorical.cat.codes), [0, 1, 0, -1])
+    assert_equal(list(normalize_labels(data["object"])), ["ja", np.nan, 3, "keine"])
+    assert normalize_labels(data["numeric"]) is data["numeric"]
+    codes = normalize_labels(pd.Series(pd.Categorical([1, 2, 1])))
+    assert codes.cat.categories.dtype == "int64"
+    cleaned = remove_brackets_in_categorical_values(data.copy())
+    assert_frame_equal(cleaned[["numeric"]], data[["numeric"]])
+    assert cleaned["categorical"].dtype == "category"
+
+
+def test_value_labels(synthetic_data, tmp_path):
+    """This function tests whether the value labels are extracted from the .dta file
+    by new name, saved and loaded and whether the codes of the cleaned data are
+    decoded to the labels without their bracketed codes"""
+    path = synthetic_data / "original_data" / "PENDDAT_cf_W11.dta"
+    value_labels = read_value_labels(path, "PENDDAT")
+    assert value_labels.labels("sex")[2] == "[2] Female"
+    assert len(value_labels.tables) < len(value_labels.variables)
+    save_value_labels(value_labels, tmp_path / "labels.json")
+    assert load_value_labels(tmp_path / "labels.json") == value_labels
+    stored = load_value_labels(
+        synthetic_data / "bld" / "cleaned_data" / "PENDDAT_labels.json"
+    )
+    assert stored == value_labels
+    sex = load_artifact(
+        synthetic_data / "bld" / "cleaned_data" / "PENDDAT_clean.parquet",
+        columns=["sex"],
+    )["sex"]
+    decoded = value_labels.decode(sex)
+    assert_equal(
+        list(decoded.cat.remove_unused_categories().cat.categories), ["Male", "Female"]
+    )
+    expected = pd.read_stata(path, columns=["zpsex"])["zpsex"].str[4:]
+    assert_equal(sorted(decoded.astype(str)), sorted(expected))
+    assert value_labels.categories("sex", [1.0, 2.0, 3.0]) == ["Male", "Female", "3"]
+    assert value_labels.categories("sex", [2.0], labels={2: "F"}) == ["F"]
+    assert ValueLabels({}, {}).categories("sex", [1.0, 2.0]) == ["1", "2"]
+
+
+def test_sampling(synthetic_data, tmp_path):
+    """This function tests whether the sample keeps all waves and persons of a
+    deterministic share of the households, the weights of their persons and the
+    value labels and is only written again when it changed"""
+    source = synthetic_data / "original_data"
+    assert update_sample(source, tmp_path, 0.2)
+    assert not update_sample(source, tmp_path, 0.2)
+    households = pd.read_stata(source / "HHENDDAT_cf_W11.dta", columns=["hnr"])
+    persons = pd.read_stata(source / "PENDDAT_cf_W11.dta", columns=["hnr"])
+    sample_h = pd.read_stata(tmp_path / "HHENDDAT_cf_W11.dta", columns=["hnr"])
+    sample_p = pd.read_stata(tmp_path / "PENDDAT_cf_W11.dta", columns=["pnr", "zpsex"])
+    sample_w = pd.read_stata(tmp_path / "pweights_cf_W11.dta", columns=["pnr"])
+    sampled = households["hnr"].unique()[
+        sample_households(households["hnr"].unique(), 0.2)
+    ]
+    assert 0.15 < len(sampled) / households["hnr"].nunique() < 0.25
+    assert_equal(sorted(sample_h["hnr"].unique()), sorted(sampled))
+    assert len(sample_h) == households["hnr"].isin(sampled).sum()
+    assert len(sample_p) == persons["hnr"].isin(sampled).sum()
+    assert_equal(sorted(sample_w["pnr"].unique()), sorted(sample_p["pnr"].unique()))
+    assert set(sample_p["zpsex"].unique()) == {"[1] Male", "[2] Female"}
+    assert update_sample(source, tmp_path, 0.3)
+
+
+def test_reshape():
+    """This function tests whether variables are reshaped from long to wide format
+    with their compact dtypes, also as sparse columns, back to long format with
+    the same dtypes and whether missing ids are rejected"""
+    df = pd.DataFrame(
+        {
+            "p_id": [1, 1, 2, 3, 3, 3],
+            "wave": [1, 2, 2, 1, 2, 3],
+            "age": pd.array([30, 31, 50, 20, 21, pd.NA], dtype="Int8"),
+            "income": [1.5, np.nan, 2.0, 3.0, 3.5, 4.0],
+            "employed": [True, False, True, True, True, False],
+            "sex": pd.Categorical(["male", "male", "female", "female", None, None]),
+        }
+    ).set_index(["p_id", "wave"])
+    variables = ["age", "income", "employed", "sex"]
+    wide = long_to_wide(df, variables)
+    assert_equal(list(wide.columns[:3]), ["age_w1", "age_w2", "age_w3"])
+    assert_equal(list(wide.index), [1, 2, 3])
+    assert wide["age_w1"].dtype == "Int8"
+    assert wide["employed_w2"].dtype == "boolean"
+    assert isinstance(wide["sex_w1"].dtype, pd.CategoricalDtype)
+    expected = df["income"].unstack("wave")
+    assert_array_almost_equal(wide[["income_w1", "income_w2", "income_w3"]], expected)
+    sparse = long_to_wide(df, variables, sparse=True)
+    assert isinstance(sparse["age_w3"].dtype, pd.SparseDtype)
+    assert_array_almost_equal(sparse["income_w3"].sparse.to_dense(), expected[3])
+    observed = df[df.notna().any(axis=1)]
+    dtypes = {"employed": "boolean", "wave": "int64"}
+    expected = observed.reset_index().astype(dtypes).set_index(["p_id", "wave"])
+    assert_frame_equal(wide_to_long(wide), expected)
+    assert_frame_equal(wide_to_long(sparse), expected)
+    with pytest.raises(ValueError):
+        long_to_wide(pd.concat([df, df.iloc[:1]]), variables)
+    missing = pd.DataFrame(
+        {"p_id": [1, np.nan], "hh": [1, 1], "wave": [1, 1], "a": [1, 2]}
+    )
+    for id_vars in [("p_id",), ("p_id", "hh")]:
+        with pytest.raises(ValueError, match="missing"):
+            long_to_wide(missing, ["a"], id_vars=id_vars)
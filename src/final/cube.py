@@ -0,0 +1,105 @@
+"""
+This file contains the functions which build the aggregate cube of the datasets
+from which the figures are drawn
+"""
+import numpy as np
+import pandas as pd
+
+# The dimensions and variables of the cube of the personal dataset (PENDDAT).
+CUBE_DIMENSIONS = {"PENDDAT": ["wave", "age", "sex"], "HHENDDAT": ["wave"]}
+CUBE_VARIABLES = {
+    "PENDDAT": ["genrole_modern", "genrole_traditional"],
+    "HHENDDAT": [],
+}
+
+
+def build_cube(df, dimensions, variables, weight=None):
+    """This function aggregates a dataset by all combinations of the dimensions in
+    one grouped pass. For each cell the cube holds the number of rows "n", the sum
+    of the weights "weight" and for each variable the number of answered rows
+    "{variable}_n", the sum of their weights "{variable}_weight", the sum of the
+    values "{variable}_sum" and the weighted sum "{variable}_wsum". Counts and
+    (weighted) means of any combination of the dimensions can then be computed
+    from the cube (see cube_counts and cube_means).
+    Args:
+        df (pandas.DataFrame): The dataset.
+        dimensions (list): The columns or index levels of the cells. Missing values
+        are a cell of their own.
+        variables (list): The variables to be aggregated.
+        weight (str): The column with the weights. Default value is None, which
+        gives every row the weight 1.
+    Returns:
+        cube (pandas.DataFrame): The cube with the dimensions as index.
+    """
+    keys = {
+        dimension: df.index.get_level_values(dimension)
+        if dimension in df.index.names
+        else df[dimension]
+        for dimension in dimensions
+    }
+    values = df[list(variables)].to_numpy(dtype="float64", na_value=np.nan)
+    if weight is None:
+        weights = np.ones(len(df))
+    else:
+        weights = np.nan_to_num(df[weight].to_numpy(dtype="float64", na_value=np.nan))
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    columns = {"n": np.ones(len(df), dtype="int64"), "weight": weights}
+    for j, variable in enumerate(variables):
+        columns[f"{variable}_n"] = valid[:, j].astype("int64")
+        columns[f"{variable}_weight"] = np.where(valid[:, j], weights, 0.0)
+        columns[f"{variable}_sum"] = filled[:, j]
+        columns[f"{variable}_wsum"] = filled[:, j] * weights
+    frame = pd.DataFrame(columns)
+    for dimension, key in keys.items():
+        frame[dimension] = np.asarray(key)
+        frame[dimension] = frame[dimension].astype(key.dtype)
+    return frame.groupby(list(dimensions), dropna=False).sum()
+
+
+def cube_counts(cube, by, select=None):
+    """This function counts the rows of the cells of some dimensions of a cube.
+    Args:
+        cube (pandas.DataFrame): The cube (see build_cube).
+        by (str or list): The dimensions which are kept. Cells with a missing value
+        in these dimensions are left out.
+        select (dict): Dictionary with dimensions as keys and the selected value as
+        values, e.g. {"wave": 11}. Default value is None, which uses all cells.
+    Returns:
+        counts (pandas.Series): The number of rows in each cell.
+    """
+    return _select(cube, select).groupby(level=by)["n"].sum()
+
+
+def cube_means(cube, by, variables, weighted=False, select=None):
+    """This function computes the means of the variables in the cells of some
+    dimensions of a cube.
+    Args:
+        cube (pandas.DataFrame): The cube (see build_cube).
+        by (str or list): The dimensions which are kept. Cells with a missing value
+        in these dimensions are left out.
+        variables (list): The variables.
+        weighted (bool): Whether the means are weighted. Default value is False.
+        select (dict): Dictionary with dimensions as keys and the selected value as
+        values, e.g. {"wave": 11}. Default value is None, which uses all cells.
+    Returns:
+        means (pandas.DataFrame): The means with the variables as columns.
+    """
+    total, count = ("wsum", "weight") if weighted else ("sum", "n")
+    sums = _select(cube, select).groupby(level=by).sum()
+    return pd.DataFrame(
+        {
+            variable: sums[f"{variable}_{total}"] / sums[f"{variable}_{count}"]
+            for variable in variables
+        }
+    )
+
+
+def _select(cube, select):
+    """Returns the cells of the cube with the selected values of the dimensions."""
+    if not select:
+        return cube
+    selected = np.ones(len(cube), dtype=bool)
+    for dimension, value in select.items():
+        selected &= np.asarray(cube.index.get_level_values(dimension) == value)
+    return cube[selected]
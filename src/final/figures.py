@@ -0,0 +1,301 @@
+"""
+This file contains the figures of the research paper and the functions which
+render them from the cubes of the datasets (see src/final/cube.py)
+"""
+import hashlib
+import inspect
+import json
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+
+from src.artifacts import load_artifact
+from src.config import BLD
+from src.config import FIGURE_WAVES
+from src.data_management.labels import load_value_labels
+from src.data_management.metadata import stage_digest
+from src.final import cube
+from src.final.cube import cube_counts
+from src.final.cube import cube_means
+
+# The figures are only saved to files, so they are drawn on the Agg backend in the
+# process of the task and in the worker processes, independent of the platform.
+plt.switch_backend("Agg")
+
+CUBES = {
+    "PENDDAT": BLD / "figures" / "PENDDAT_cube.parquet",
+    "HHENDDAT": BLD / "figures" / "HHENDDAT_cube.parquet",
+}
+
+LABELS = {"PENDDAT": BLD / "cleaned_data" / "PENDDAT_labels.json"}
+
+# The paper is in English, so the tick labels of the figures are given here. They
+# take precedence over the value labels of the release, which are German in the
+# PASS data and may be missing.
+SEX_LABELS = {1: "Male", 2: "Female"}
+
+DIGEST_SUFFIX = ".digest"
+
+
+def draw_number_obs(cubes):
+    """Draws the number of observations per wave of both datasets."""
+    y_p = cube_counts(cubes["PENDDAT"], "wave")
+    y_h = cube_counts(cubes["HHENDDAT"], "wave")
+    x_p, x_h = y_p.index, y_h.index
+
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 7))
+    ax1.stem(x_p, y_p)
+    ax2.stem(x_h, y_h)
+    ax1.set_ylabel("Number of Observations", fontsize="x-large")
+    fig.suptitle("Number of Observations per Wave", fontsize="xx-large")
+    ax1.set_title("Personal Dataset")
+    ax2.set_title("Household Dataset")
+    fig.text(0.465, 0.04, "Wave Number", fontsize="x-large")
+    return fig
+
+
+def draw_age_dist(cubes, wave):
+    """Draws the number of observations per age in a wave."""
+    y_p = cube_counts(cubes["PENDDAT"], "age", {"wave": wave})
+    x_p = y_p.index
+
+    fig, ax = plt.subplots(figsize=(14, 7))
+    ax.bar(x_p, y_p)
+    ax.set_ylabel("Number of Observation", fontsize="x-large")
+    ax.set_xlabel("Age", fontsize="x-large")
+    ax.set_title(f"Age Distribution in Wave {wave}", fontsize="xx-large")
+    return fig
+
+
+def draw_gender_dist(cubes, wave, labels):
+    """Draws the number of observations per gender in a wave."""
+    y_p = cube_counts(cubes["PENDDAT"], "sex", {"wave": wave})
+    x_p = y_p.index
+
+    fig, ax = plt.subplots(figsize=(8, 7))
+    ax.bar(x_p, y_p, width=0.6)
+    ax.set_xticks(x_p, labels["PENDDAT"].categories("sex", x_p, labels=SEX_LABELS))
+    ax.set_xlabel("Gender", fontsize="x-large")
+    ax.set_ylabel("Number of Observation", fontsize="x-large")
+    ax.set_title(f"Gender Distribution in Wave {wave}", fontsize="xx-large")
+    return fig
+
+
+def draw_gender_role(cubes, wave, labels):
+    """Draws the gender role attitudes by gender and by age in a wave."""
+    variables = ["genrole_modern", "genrole_traditional"]
+    x_p = cube_means(cubes["PENDDAT"], "sex", variables, select={"wave": wave})
+    x_1 = x_p.index.astype("float64")
+    y_1 = x_p["genrole_traditional"]
+    y_2 = x_p["genrole_modern"]
+    x_p = cube_means(cubes["PENDDAT"], "age", variables, select={"wave": wave})
+    x_2 = x_p.index.astype("float64")
+    y_1_sex = x_p["genrole_traditional"]
+    y_2_sex = x_p["genrole_modern"]
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 8))
+    ax1.plot(x_1, y_1, "o", ls="-", label="Traditional")
+    ax1.plot(x_1, y_2, "o", ls="-", label="Modern")
+    ax1.set_xbound(0.60, 2.40)
+    ax1.legend(loc="center right")
+    ax1.set_xlabel("Gender", fontsize="x-large")
+    ax1.set_ylabel("Gender Attitude Scales", fontsize="x-large")
+    ax1.set_title("By Gender", fontsize="x-large")
+    ax1.set_xticks(x_1, labels["PENDDAT"].categories("sex", x_1, labels=SEX_LABELS))
+
+    ax2.plot(x_2, y_1_sex, label="Traditional")
+    ax2.plot(x_2, y_2_sex, label="Modern")
+    ax2.legend()
+    z_1 = np.polyfit(x_2, y_1_sex, 1)
+    p_1 = np.poly1d(z_1)
+    ax2.plot(x_2, p_1(x_2), "r--")
+    z_2 = np.polyfit(x_2, y_2_sex, 1)
+    p_2 = np.poly1d(z_2)
+    ax2.plot(x_2, p_2(x_2), "r--")
+    ax2.set_xlabel("Age", fontsize="x-large")
+    ax2.set_title("By Age", fontsize="x-large")
+    fig.suptitle("Gender Role Attitudes", fontsize="xx-large")
+    return fig
+
+
+@dataclass(frozen=True)
+class Figure:
+    """A figure of the research paper.
+    Attributes:
+        draw (function): The function which draws the figure from the cubes given
+        as a dictionary with dataset names as keys and returns it.
+        inputs (tuple): The names of the datasets whose cubes are used.
+        by (str): The dimension the figure is drawn for value by value (e.g.
+        "wave"), which is passed to draw as keyword. Default value is None, which
+        draws one figure.
+        labels (tuple): The names of the datasets whose value labels (see
+        src/data_management/labels.py) are passed to draw as keyword "labels".
+        Default value is (), which passes no labels.
+    """
+
+    draw: object
+    inputs: tuple
+    by: str = None
+    labels: tuple = ()
+
+
+FIGURES = {
+    "number_obs": Figure(draw_number_obs, ("PENDDAT", "HHENDDAT")),
+    "age_dist": Figure(draw_age_dist, ("PENDDAT",), by="wave"),
+    "gender_dist": Figure(
+        draw_gender_dist, ("PENDDAT",), by="wave", labels=("PENDDAT",)
+    ),
+    "gender_role": Figure(
+        draw_gender_role, ("PENDDAT",), by="wave", labels=("PENDDAT",)
+    ),
+}
+
+
+def figure_jobs(figures=None, waves=None, folder=BLD / "figures"):
+    """This function lists the figures to be rendered. Figures drawn by wave fan
+    out to one figure "{name}_W{wave}.png" for each wave.
+    Args:
+        figures (dict): Dictionary with names as keys and Figure as values. Default
+        value is None, which uses FIGURES.
+        waves (list): The waves of the figures drawn by wave. Default value is
+        None, which uses FIGURE_WAVES in "src/config.py".
+        folder (str, path object): The folder of the figures. Default value is
+        BLD/"figures".
+    Returns:
+        jobs (dict): Dictionary with the names of the figures (e.g. "age_dist_W11")
+        as keys and (figure name, keywords of draw, path) as values.
+    """
+    figures = FIGURES if figures is None else figures
+    waves = FIGURE_WAVES if waves is None else waves
+    values = {"wave": waves}
+    jobs = {}
+    for name, figure in figures.items():
+        if figure.by is None:
+            jobs[name] = (name, {}, Path(folder) / f"{name}.png")
+            continue
+        for value in values[figure.by]:
+            suffix = f"{name}_W{value}" if figure.by == "wave" else f"{name}_{value}"
+            jobs[suffix] = (name, {figure.by: value}, Path(folder) / f"{suffix}.png")
+    return jobs
+
+
+def _constants(draw):
+    """Returns the module constants (e.g. SEX_LABELS) which a draw function uses."""
+    return {
+        name: draw.__globals__[name]
+        for name in draw.__code__.co_names
+        if isinstance(draw.__globals__.get(name), (dict, list, tuple, str, int, float))
+    }
+
+
+def figure_digest(figure, keywords, cubes, labels=None):
+    """This function computes the digest of a figure from the code of its draw
+    function and the module constants it uses, the code of the cube functions
+    (src/final/cube.py), its keywords and the files of the cubes and value labels
+    it uses. A figure whose digest did not change does not need to be rendered
+    again.
+    Args:
+        figure (Figure): The figure.
+        keywords (dict): The keywords of draw (e.g. {"wave": 11}).
+        cubes (dict): Dictionary with dataset names as keys and the paths of
+        their cubes as values.
+        labels (dict): Dictionary with dataset names as keys and the paths of
+        their value labels as values. Default value is None, which uses LABELS.
+    Returns:
+        digest (str): The digest.
+    """
+    labels = LABELS if labels is None else labels
+    digest = hashlib.sha256()
+    digest.update(inspect.getsource(figure.draw).encode())
+    digest.update(json.dumps(_constants(figure.draw), default=str).encode())
+    digest.update(stage_digest(cube.__file__).encode())
+    digest.update(json.dumps(keywords, sort_keys=True, default=str).encode())
+    digest.update(matplotlib.__version__.encode())
+    digest.update(stage_digest(*[cubes[i] for i in figure.inputs]).encode())
+    if figure.labels:
+        digest.update(stage_digest(*[labels[i] for i in figure.labels]).encode())
+    return digest.hexdigest()
+
+
+def digest_path(path):
+    """Returns the path of the file with the digest of a rendered figure."""
+    path = Path(path)
+    return path.with_name(path.name + DIGEST_SUFFIX)
+
+
+def render_figure(figure, keywords, cubes, labels, path):
+    """This function draws a figure on the Agg backend and saves it. The figures
+    opened by draw are closed afterwards, also if drawing or saving fails, so that
+    no figures are kept in memory.
+    Args:
+        figure (Figure): The figure.
+        keywords (dict): The keywords of draw.
+        cubes (dict): Dictionary with dataset names as keys and the paths of
+        their cubes as values.
+        labels (dict): Dictionary with dataset names as keys and the paths of
+        their value labels as values.
+        path (str, path object): The path of the figure.
+    """
+    opened = set(plt.get_fignums())
+    try:
+        data = {i: load_artifact(cubes[i]) for i in figure.inputs}
+        if figure.labels:
+            keywords = {
+                **keywords,
+                "labels": {i: load_value_labels(labels[i]) for i in figure.labels},
+            }
+        figure.draw(data, **keywords).savefig(path)
+    finally:
+        for number in set(plt.get_fignums()) - opened:
+            plt.close(number)
+
+
+def render_figures(jobs, cubes=None, figures=None, labels=None, n_workers=1):
+    """This function renders the figures whose code, cube functions or cubes
+    changed since they were rendered. The digest of each figure (see
+    figure_digest) is saved next to it, so that changing one figure renders only
+    this figure again. With more than one worker the figures are rendered in a
+    pool of processes.
+    Args:
+        jobs (dict): The figures to be rendered (see figure_jobs).
+        cubes (dict): Dictionary with dataset names as keys and the paths of
+        their cubes as values. Default value is None, which uses CUBES.
+        figures (dict): Dictionary with names as keys and Figure as values. Default
+        value is None, which uses FIGURES. The draw functions of the figures have
+        to be defined at the top level of a module to be rendered in a pool.
+        labels (dict): Dictionary with dataset names as keys and the paths of
+        their value labels as values. Default value is None, which uses LABELS.
+        n_workers (int): The number of processes. Default value is 1.
+    Returns:
+        rendered (list): The names of the rendered figures.
+    """
+    cubes = CUBES if cubes is None else cubes
+    figures = FIGURES if figures is None else figures
+    labels = LABELS if labels is None else labels
+    pending = {}
+    for job, (name, keywords, path) in jobs.items():
+        digest = figure_digest(figures[name], keywords, cubes, labels)
+        saved = digest_path(path)
+        if Path(path).exists() and saved.exists() and saved.read_text() == digest:
+            continue
+        pending[job] = (name, keywords, Path(path), digest)
+    for _, _, path, _ in pending.values():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        digest_path(path).unlink(missing_ok=True)
+    if n_workers > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(pending))) as pool:
+            futures = [
+                pool.submit(render_figure, figures[name], keywords, cubes, labels, path)
+                for name, keywords, path, _ in pending.values()
+            ]
+            for future in futures:
+                future.result()
+    else:
+        for name, keywords, path, _ in pending.values():
+            render_figure(figures[name], keywords, cubes, labels, path)
+    for _, _, path, digest in pending.values():
+        digest_path(path).write_text(digest)
+    return list(pending)
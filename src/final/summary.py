@@ -0,0 +1,145 @@
+"""
+This file contains the functions which compute the summary statistics of the
+datasets and write them as LaTeX tables
+"""
+import numpy as np
+import pandas as pd
+
+STATISTICS = ["count", "mean", "std", "min", "median", "max"]
+
+# The design weights of the weighted datasets in "BLD/weighted_data".
+WEIGHTS = {"PENDDAT": "p_weight", "HHENDDAT": "hh_weight"}
+
+
+def group_codes(df, by):
+    """This function returns the group of each row as a code and the sorted groups.
+    by is a column or an index level of df. Without by all rows are one group."""
+    if by is None:
+        return np.zeros(len(df), dtype="int64"), pd.Index([None])
+    values = df.index.get_level_values(by) if by in df.index.names else df[by]
+    codes, groups = pd.factorize(values, sort=True)
+    if (codes < 0).any():
+        raise ValueError(f"The groups {by} contain missing values.")
+    return codes, pd.Index(groups, name=by)
+
+
+def _weighted_medians(values, weights, codes, starts, counts, totals):
+    """Returns the weighted median of each column in each group. The rows are
+    sorted by group and value, so that the median is the first value whose
+    cumulative weight reaches half of the weight of the group. If the cumulative
+    weight is exactly half, the median is the mean of this and the next value,
+    which is the median of pandas for equal weights."""
+    n, k = values.shape
+    ranks = np.argsort(np.argsort(values, axis=0, kind="stable"), axis=0)
+    order = np.argsort(codes[:, None] * n + ranks, axis=0, kind="stable")
+    values = np.take_along_axis(values, order, axis=0)
+    weights = np.take_along_axis(weights, order, axis=0)
+    cumulative = np.cumsum(weights, axis=0)
+    before = np.vstack([np.zeros((1, k)), cumulative])[starts]
+    cumulative -= before[codes]
+    half = totals / 2
+    tolerance = 1e-9 * np.abs(totals)
+    below = np.add.reduceat(cumulative < (half - tolerance)[codes], starts, axis=0)
+    position = np.minimum(starts[:, None] + below, n - 1)
+    columns = np.arange(k)
+    lower = values[position, columns]
+    following = values[np.minimum(position + 1, n - 1), columns]
+    exact = np.abs(cumulative[position, columns] - half) <= tolerance
+    exact &= below + 1 < counts
+    return np.where(exact, (lower + following) / 2, lower)
+
+
+def summary_statistics(df, variables, weight=None, by=None):
+    """This function computes the count, mean, standard deviation, minimum, median
+    and maximum of all variables at once. The variables are stacked into one array
+    whose rows are sorted by group, so that every statistic of all variables and
+    groups is computed with one reduction.
+    The weighted mean is sum(w * x) / sum(w) and the weighted variance is
+    sum(w * (x - mean)**2) / sum(w) * count / (count - 1), so that the weighted
+    statistics with equal weights are the unweighted statistics of pandas.
+    Missing values and rows with a missing weight are left out. The count is the
+    number of answered rows.
+    Args:
+        df (pandas.DataFrame): The dataset.
+        variables (list): The variables to be summarized.
+        weight (str): The column with the weights. Default value is None, which
+        computes the unweighted statistics.
+        by (str): The column or index level whose groups are summarized separately
+        (e.g. "wave"). Default value is None, which summarizes all rows together.
+    Returns:
+        stats (pandas.DataFrame): The statistics (STATISTICS) as columns with the
+        variables as index, or the groups and the variables as index with by.
+    """
+    values = df[list(variables)].to_numpy(dtype="float64", na_value=np.nan)
+    if weight is None:
+        weights = np.ones(len(df))
+    else:
+        weights = df[weight].to_numpy(dtype="float64", na_value=np.nan)
+    codes, groups = group_codes(df, by)
+    rows = np.argsort(codes, kind="stable")
+    codes, values, weights = codes[rows], values[rows], weights[rows]
+    valid = ~np.isnan(values) & ~np.isnan(weights)[:, None]
+    values = np.where(valid, values, np.nan)
+    weights = np.where(valid, weights[:, None], 0.0)
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    filled = np.where(valid, values, 0.0)
+    counts = np.add.reduceat(valid, starts, axis=0)
+    totals = np.add.reduceat(weights, starts, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.add.reduceat(weights * filled, starts, axis=0) / totals
+        squares = np.add.reduceat(
+            weights * np.where(valid, filled - means[codes], 0.0) ** 2, starts, axis=0
+        )
+        stds = np.sqrt(squares / totals * counts / (counts - 1))
+    stats = {
+        "count": counts,
+        "mean": means,
+        "std": stds,
+        "min": np.minimum.reduceat(np.where(valid, values, np.inf), starts, axis=0),
+        "median": _weighted_medians(values, weights, codes, starts, counts, totals),
+        "max": np.maximum.reduceat(np.where(valid, values, -np.inf), starts, axis=0),
+    }
+    answered = counts > 0
+    stats = {
+        name: np.where(answered, stat, np.nan) if name != "count" else stat
+        for name, stat in stats.items()
+    }
+    index = pd.Index(list(variables), name="variable")
+    if by is not None:
+        index = pd.MultiIndex.from_product([groups, index])
+    return pd.DataFrame(
+        {name: stat.ravel() for name, stat in stats.items()},
+        index=index,
+        columns=STATISTICS,
+    )
+
+
+def summary_table(stats, labels, statistics=None):
+    """This function prepares summary statistics for a LaTeX table. The variables
+    are replaced by their labels and the statistics are rounded to two digits.
+    Args:
+        stats (pandas.DataFrame): The statistics (see summary_statistics).
+        labels (dict): Dictionary with variable names as keys and labels as values.
+        statistics (list): The statistics in the table. Default value is None,
+        which uses all statistics except the count.
+    Returns:
+        table (pandas.DataFrame): The table.
+    """
+    if statistics is None:
+        statistics = [stat for stat in STATISTICS if stat != "count"]
+    return stats[statistics].rename(index=labels).rename_axis(None).round(2)
+
+
+def wave_table(stats, labels, statistic="mean"):
+    """This function puts one statistic of the variables in each wave side by side.
+    Args:
+        stats (pandas.DataFrame): The statistics by wave (see summary_statistics).
+        labels (dict): Dictionary with variable names as keys and labels as values.
+        statistic (str): The statistic in the table. Default value is "mean".
+    Returns:
+        table (pandas.DataFrame): The table with the variables as rows and the
+        waves as columns.
+    """
+    table = stats[statistic].unstack(level=0)
+    table = table.reindex(stats.index.get_level_values("variable").unique())
+    return table.rename(index=labels).rename_axis(index=None).round(2)
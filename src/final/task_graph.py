@@ -1,118 +1,76 @@
-import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
 import pytask
 
+from src.artifacts import load_artifact
+from src.artifacts import save_artifact
 from src.config import BLD
+from src.config import N_WORKERS
+from src.config import SRC
+from src.final.cube import build_cube
+from src.final.cube import CUBE_DIMENSIONS
+from src.final.cube import CUBE_VARIABLES
+from src.final.figures import figure_jobs
+from src.final.figures import render_figures
+from src.final.summary import WEIGHTS
+from src.instrumentation import instrument
 
 
 @pytask.mark.depends_on(
     {
-        "first": BLD / "weighted_data" / "PENDDAT_weighted.pickle",
-        "second": BLD / "weighted_data" / "PENDDAT_weighted.pickle",
+        "first": BLD / "weighted_data" / "PENDDAT_weighted.parquet",
+        "second": BLD / "weighted_data" / "HHENDDAT_weighted.parquet",
+        "code": SRC / "final" / "cube.py",
     }
 )
 @pytask.mark.produces(
     {
-        "first": BLD / "figures" / "number_obs.png",
-        "second": BLD / "figures" / "age_dist.png",
-        "third": BLD / "figures" / "gender_dist.png",
-        "fourth": BLD / "figures" / "gender_role.png",
+        "first": BLD / "figures" / "PENDDAT_cube.parquet",
+        "second": BLD / "figures" / "HHENDDAT_cube.parquet",
     }
 )
-def task_plotting_graphs(depends_on, produces):
-    """This task produces the plots which are used in the research paper.
-    The plots are number of observation per wave,
-    age distribution, gender distribution and
-    gender role attitude by gender and age. It uses the final weighted
-     datasets(PENDDAT_weighted,HHENDDAT_weighted).
+@instrument(kind="task")
+def task_aggregate_cube(depends_on, produces):
+    """This task aggregates the weighted datasets into the small cubes from which
+    all figures are drawn (see build_cube): the personal dataset by wave, age and
+    sex with the variables of the figures and the household dataset by wave.
+    Changing a figure only reads the cubes and not the datasets.
     """
-    df_p_w = pd.read_pickle(depends_on["first"])
-    df_h_w = pd.read_pickle(depends_on["second"])
-    # number of observation per wave
-    x_p = df_p_w.reset_index().groupby("wave").count().reset_index()["wave"]
-    y_p = df_p_w.reset_index().groupby("wave").count().reset_index()["p_id"]
-    x_h = df_h_w.reset_index().groupby("wave").count().reset_index()["wave"]
-    y_h = df_h_w.reset_index().groupby("wave").count().reset_index()["hh_id"]
-
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 7))
-    ax1.stem(x_p, y_p)
-    ax2.stem(x_h, y_h)
-    ax1.set_ylabel("Number of Observations", fontsize="x-large")
-    fig.suptitle("Number of Observations per Wave", fontsize="xx-large")
-    ax1.set_title("Personal Dataset")
-    ax2.set_title("Household Dataset")
-    fig.text(0.465, 0.04, "Wave Number", fontsize="x-large")
-    plt.savefig(produces["first"])
-
-    # number of observation per age
-    x_p = df_p_w.reset_index()
-    x_p = x_p[x_p["wave"] == 11].groupby("age").count()["p_id"].reset_index()["age"]
-    y_p = df_p_w.reset_index()
-    y_p = y_p[y_p["wave"] == 11].groupby("age").count()["p_id"].reset_index()["p_id"]
+    for key, i in [("first", "PENDDAT"), ("second", "HHENDDAT")]:
+        columns = [
+            column
+            for column in CUBE_DIMENSIONS[i] + CUBE_VARIABLES[i] + [WEIGHTS[i]]
+            if column != "wave"
+        ]
+        df = load_artifact(depends_on[key], columns=columns)
+        cube = build_cube(df, CUBE_DIMENSIONS[i], CUBE_VARIABLES[i], WEIGHTS[i])
+        save_artifact(cube, produces[key])
 
-    fig, ax = plt.subplots(figsize=(14, 7))
-    ax.bar(x_p, y_p)
-    ax.set_ylabel("Number of Observation", fontsize="x-large")
-    ax.set_xlabel("Age", fontsize="x-large")
-    ax.set_title("Age Distribution in Wave 11", fontsize="xx-large")
-    plt.savefig(produces["second"])
 
-    # Gender Distribution
-    x_p = df_p_w.reset_index()
-    x_p = x_p[x_p["wave"] == 11].groupby("sex").count()["p_id"].reset_index()["sex"]
-    y_p = df_p_w.reset_index()
-    y_p = y_p[y_p["wave"] == 11].groupby("sex").count()["p_id"].reset_index()["p_id"]
-
-    fig, ax = plt.subplots(figsize=(8, 7))
-    ax.bar(x_p, y_p, width=0.6)
-    plt.xticks([1, 2], ["Male", "Female"])
-    ax.set_xlabel("Gender", fontsize="x-large")
-    ax.set_ylabel("Number of Observation", fontsize="x-large")
-    plt.title("Gender Distribution in Wave 11", fontsize="xx-large")
-    plt.savefig(produces["third"])
-
-    # genrole_modern, genrole_traditional
-    x_p = df_p_w.reset_index()
-    x_p = (
-        x_p[x_p["wave"] == 11]
-        .groupby("sex")
-        .mean()[["genrole_modern", "genrole_traditional"]]
-        .reset_index()
-    )
-    x_1 = x_p["sex"]
-    y_1 = x_p["genrole_traditional"]
-    y_2 = x_p["genrole_modern"]
-    x_p = df_p_w.reset_index()
-    x_p = (
-        x_p[x_p["wave"] == 11]
-        .groupby("age")
-        .mean()[["genrole_modern", "genrole_traditional"]]
-        .reset_index()
-    )
-    x_2 = x_p["age"]
-    y_1_sex = x_p["genrole_traditional"]
-    y_2_sex = x_p["genrole_modern"]
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 8))
-    ax1.plot(x_1, y_1, "o", ls="-", label="Traditional")
-    ax1.plot(x_1, y_2, "o", ls="-", label="Modern")
-    ax1.set_xbound(0.60, 2.40)
-    ax1.legend(loc="center right")
-    ax1.set_xlabel("Gender", fontsize="x-large")
-    ax1.set_ylabel("Gender Attitude Scales", fontsize="x-large")
-    ax1.set_title("By Gender", fontsize="x-large")
-    ax1.set_xticks([1, 2], ["Male", "Female"])
-
-    ax2.plot(x_2, y_1_sex, label="Traditional")
-    ax2.plot(x_2, y_2_sex, label="Modern")
-    ax2.legend()
-    z_1 = np.polyfit(x_2, y_1_sex, 1)
-    p_1 = np.poly1d(z_1)
-    ax2.plot(x_2, p_1(x_2), "r--")
-    z_2 = np.polyfit(x_2, y_2_sex, 1)
-    p_2 = np.poly1d(z_2)
-    ax2.plot(x_2, p_2(x_2), "r--")
-    ax2.set_xlabel("Age", fontsize="x-large")
-    ax2.set_title("By Age", fontsize="x-large")
-    fig.suptitle("Gender Role Attitudes", fontsize="xx-large")
-    plt.savefig(produces["fourth"])
+@pytask.mark.depends_on(
+    {
+        "first": BLD / "figures" / "PENDDAT_cube.parquet",
+        "second": BLD / "figures" / "HHENDDAT_cube.parquet",
+        "labels": BLD / "cleaned_data" / "PENDDAT_labels.json",
+        "code": SRC / "final" / "figures.py",
+        "cube": SRC / "final" / "cube.py",
+    }
+)
+@pytask.mark.produces({job: path for job, (_, _, path) in figure_jobs().items()})
+@instrument(kind="task")
+def task_plotting_graphs(depends_on, produces):
+    """This task produces the plots which are used in the research paper.
+    The plots are number of observation per wave and, for each wave of
+    FIGURE_WAVES, the age distribution, gender distribution and
+    gender role attitude by gender and age. They are drawn from the cubes of
+    the final weighted datasets(PENDDAT_weighted,HHENDDAT_weighted) and labelled
+    with the value labels of the personal dataset.
+    Each figure is rendered on its own (see render_figures), in N_WORKERS
+    processes, and only if its code, the cube functions or its cubes changed
+    since it was rendered.
+    """
+    cubes = {"PENDDAT": depends_on["first"], "HHENDDAT": depends_on["second"]}
+    jobs = {
+        job: (name, keywords, produces[job])
+        for job, (name, keywords, _) in figure_jobs().items()
+    }
+    labels = {"PENDDAT": depends_on["labels"]}
+    render_figures(jobs, cubes, labels=labels, n_workers=N_WORKERS)
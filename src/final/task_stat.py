@@ -1,56 +1,90 @@
 import pandas as pd
 import pytask
-import yaml
 
+from src.artifacts import load_artifact
 from src.config import BLD
-from src.config import SRC
+from src.config import BOOTSTRAP_REPLICATES
+from src.config import BOOTSTRAP_SEED
+from src.config import N_WORKERS
+from src.data_management.metadata import load_stat_labels
+from src.final.summary import STATISTICS
+from src.final.summary import summary_statistics
+from src.final.summary import summary_table
+from src.final.summary import wave_table
+from src.final.summary import WEIGHTS
+from src.final.variance import bootstrap_means
+from src.instrumentation import instrument
 
 
-@pytask.mark.depends_on(
-    {
-        "first": BLD / "weighted_data" / "HHENDDAT_weighted.pickle",
-        "second": BLD / "weighted_data" / "PENDDAT_weighted.pickle",
-    }
-)
-@pytask.mark.produces(
-    {
-        "first": BLD / "paper" / "HHENDDAT_stat.tex",
-        "second": BLD / "paper" / "PENDDAT_stat.tex",
-    }
+@pytask.mark.parametrize(
+    "depends_on, produces, i",
+    [
+        (
+            BLD / "weighted_data" / f"{i}_weighted.parquet",
+            {
+                "table": BLD / "paper" / f"{i}_stat.tex",
+                "weighted": BLD / "paper" / f"{i}_stat_weighted.tex",
+                "waves": BLD / "paper" / f"{i}_stat_waves.tex",
+                "stats": BLD / "paper" / f"{i}_stat.csv",
+            },
+            i,
+        )
+        for i in ["HHENDDAT", "PENDDAT"]
+    ],
 )
-def task_creating_summary_stat_tex(depends_on, produces):
-    """This task creates summary statistics table in latex form
+@instrument(kind="task")
+def task_creating_summary_stat_tex(depends_on, produces, i):
+    """This task creates summary statistics tables in latex form
     for households and personal dataset. It loads the tables
-    into "BLD / paper" folder
+    into "BLD / paper" folder.
+    The statistics of all variables in "{i}_stat.yaml" are computed at once
+    (see summary_statistics), unweighted and weighted with the design weights
+    of the dataset, for all waves together and for each wave. "{i}_stat.tex"
+    has the unweighted and "{i}_stat_weighted.tex" the weighted statistics,
+    "{i}_stat_waves.tex" has the weighted mean in each wave and "{i}_stat.csv"
+    all statistics. The standard errors "se" of the weighted means are estimated
+    with BOOTSTRAP_REPLICATES replicates of a bootstrap of households
+    (see bootstrap_means).
     """
-    df_h = pd.read_pickle(depends_on["first"])
-    df_p = pd.read_pickle(depends_on["second"])
-    with open(SRC / "final" / "PENDDAT_stat.yaml") as stream:
-        dict_stat_p = yaml.safe_load(stream)
-    with open(SRC / "final" / "HHENDDAT_stat.yaml") as stream:
-        dict_stat_h = yaml.safe_load(stream)
-    data = []
-    for x, _y in dict_stat_p.items():
-        data.append(df_p.reset_index()[f"{x}"])
-        df_p_stat = pd.DataFrame(data)
-        df_p_stat = df_p_stat.rename(index=dict_stat_p).T.describe()
-        df_p_stat = (
-            df_p_stat.T.drop(["25%", "75%", "count"], axis=1)
-            .rename(columns={"50%": "median"})
-            .round(2)
-        )
-    df_p_stat.to_latex(produces["second"])
-    data = []
-    for x, _y in dict_stat_h.items():
-        data.append(df_h.reset_index()[f"{x}"])
-        df_h_stat = pd.DataFrame(data)
-        df_h_stat = df_h_stat.rename(index=dict_stat_h).T.describe()
-        df_h_stat = (
-            df_h_stat.T.drop(["25%", "75%", "count"], axis=1)
-            .rename(columns={"50%": "median"})
-            .round(2)
-        )
-    df_h_stat.to_latex(produces["first"])
+    labels = load_stat_labels(i)
+    variables = list(labels)
+    weight = WEIGHTS[i]
+    # only the variables of the tables and the weights are loaded
+    df = load_artifact(depends_on, columns=variables + [weight])
+    stats = {
+        ("unweighted", "all"): summary_statistics(df, variables),
+        ("weighted", "all"): summary_statistics(df, variables, weight),
+        ("unweighted", "wave"): summary_statistics(df, variables, by="wave"),
+        ("weighted", "wave"): summary_statistics(df, variables, weight, by="wave"),
+    }
+    # standard errors of the weighted means from a bootstrap of households
+    for waves, by in [("all", None), ("wave", "wave")]:
+        stats[("weighted", waves)]["se"] = bootstrap_means(
+            df,
+            variables,
+            weight,
+            by=by,
+            n_replicates=BOOTSTRAP_REPLICATES,
+            seed=BOOTSTRAP_SEED,
+            n_workers=N_WORKERS,
+        )["se"]
+    summary_table(stats[("unweighted", "all")], labels).to_latex(produces["table"])
+    summary_table(
+        stats[("weighted", "all")],
+        labels,
+        statistics=["mean", "se", "std", "min", "median", "max"],
+    ).to_latex(produces["weighted"])
+    wave_table(stats[("weighted", "wave")], labels).to_latex(produces["waves"])
+    # the statistics of all waves together have no wave
+    table = pd.concat(
+        [
+            stat.reset_index().assign(weights=weights)
+            for (weights, _), stat in stats.items()
+        ],
+        ignore_index=True,
+    ).astype({"wave": "Int64"})
+    columns = ["weights", "wave", "variable"] + STATISTICS + ["se"]
+    table[columns].to_csv(produces["stats"], sep=";", index=False)
 
 
 r"""     names = ["PENDDAT", "HHENDDAT"]
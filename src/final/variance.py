@@ -0,0 +1,227 @@
+"""
+This file contains the functions which estimate the standard errors of weighted
+means with a clustered bootstrap of replicate weights
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.final.summary import group_codes
+
+# Number of replicates drawn from one seed. The replicates do not depend on the
+# number of processes because each batch has its own seed.
+REPLICATES_PER_BATCH = 50
+
+_shared = {}
+
+
+def _share(arrays):
+    """Keeps the arrays of the bootstrap in a worker process, so that they are sent
+    to each process once instead of once per batch."""
+    _shared.update(arrays)
+
+
+def rescaling_factors(rng, cluster_strata, n_replicates):
+    """This function draws the factors of the rescaling bootstrap of Rao and Wu.
+    In each stratum with n clusters, n - 1 clusters are drawn with replacement and
+    the weights of a cluster are multiplied by the number of times it is drawn
+    times n / (n - 1). Strata with one cluster keep their weights.
+    Args:
+        rng (numpy.random.Generator): The random number generator.
+        cluster_strata (numpy.ndarray): The stratum of each cluster.
+        n_replicates (int): The number of replicates.
+    Returns:
+        factors (numpy.ndarray): The factors with one row for each cluster and one
+        column for each replicate.
+    """
+    factors = np.ones((len(cluster_strata), n_replicates))
+    for stratum in np.unique(cluster_strata):
+        members = np.flatnonzero(cluster_strata == stratum)
+        n = len(members)
+        if n < 2:
+            continue
+        draws = rng.multinomial(n - 1, np.full(n, 1 / n), size=n_replicates)
+        factors[members] = draws.T * (n / (n - 1))
+    return factors
+
+
+def _batches(n_replicates, seed):
+    """Returns the seed and the number of replicates of each batch."""
+    sizes = [
+        min(REPLICATES_PER_BATCH, n_replicates - start)
+        for start in range(0, n_replicates, REPLICATES_PER_BATCH)
+    ]
+    return list(zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes))
+
+
+def _batch_weights(seed, n_replicates, weights, clusters, cluster_strata):
+    """Returns the replicate weights of a batch as a dense matrix."""
+    rng = np.random.default_rng(seed)
+    factors = rescaling_factors(rng, cluster_strata, n_replicates)
+    return weights[:, None] * factors[clusters]
+
+
+def replicate_weights(
+    weights, clusters, strata=None, n_replicates=200, seed=0, n_workers=1
+):
+    """This function computes the bootstrap replicate weights of a clustered sample.
+    Args:
+        weights (numpy.ndarray): The design weight of each row.
+        clusters (numpy.ndarray): The cluster of each row as codes from 0 to the
+        number of clusters - 1.
+        strata (numpy.ndarray): The stratum of each row. Default value is None,
+        which treats the sample as one stratum.
+        n_replicates (int): The number of replicates. Default value is 200.
+        seed (int): The seed of the replicates. Default value is 0.
+        n_workers (int): The number of processes. Default value is 1.
+    Returns:
+        replicates (numpy.ndarray): The replicate weights with one row for each row
+        of the sample and one column for each replicate.
+    Raises:
+        ValueError: If a cluster is in several strata.
+    """
+    arrays = _arrays(weights, clusters, strata)
+    batches = _batches(n_replicates, seed)
+    if n_workers > 1:
+        with ProcessPoolExecutor(
+            max_workers=n_workers, initializer=_share, initargs=(arrays,)
+        ) as pool:
+            parts = list(pool.map(_shared_batch_weights, *zip(*batches)))
+    else:
+        parts = [_batch_weights(seed, n, **arrays) for seed, n in batches]
+    return np.hstack(parts)
+
+
+def _shared_batch_weights(seed, n_replicates):
+    """Returns the replicate weights of a batch from the shared arrays."""
+    return _batch_weights(
+        seed,
+        n_replicates,
+        _shared["weights"],
+        _shared["clusters"],
+        _shared["cluster_strata"],
+    )
+
+
+def _arrays(weights, clusters, strata):
+    """Returns the arrays which define the replicate weights. Each cluster has to
+    be in one stratum, since whole clusters are drawn within their stratum."""
+    weights = np.nan_to_num(np.asarray(weights, dtype="float64"))
+    clusters = np.asarray(clusters)
+    cluster_strata = np.zeros(clusters.max(initial=-1) + 1, dtype="int64")
+    if strata is not None:
+        strata = np.asarray(strata)
+        cluster_strata[clusters] = strata
+        if (cluster_strata[clusters] != strata).any():
+            several = np.unique(clusters[cluster_strata[clusters] != strata])
+            raise ValueError(f"The clusters {list(several)} are in several strata.")
+    return {"weights": weights, "clusters": clusters, "cluster_strata": cluster_strata}
+
+
+def weighted_means(values, valid, replicates, starts):
+    """This function computes the weighted means of all variables and groups for
+    all replicates with matrix products.
+    Args:
+        values (numpy.ndarray): The values with missing values set to 0, with one
+        column for each variable and rows sorted by group.
+        valid (numpy.ndarray): Whether the values are not missing.
+        replicates (numpy.ndarray): The replicate weights of the rows.
+        starts (numpy.ndarray): The first row of each group.
+    Returns:
+        means (numpy.ndarray): The means with the shape (groups, variables, replicates).
+    """
+    ends = np.r_[starts[1:], len(values)]
+    means = []
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for start, end in zip(starts, ends):
+            block = replicates[start:end]
+            means.append((values[start:end].T @ block) / (valid[start:end].T @ block))
+    return np.stack(means)
+
+
+def _batch_means(seed, n_replicates):
+    """Returns the weighted means of a batch of replicates from the shared arrays."""
+    replicates = _shared_batch_weights(seed, n_replicates)
+    return weighted_means(
+        _shared["values"], _shared["valid"], replicates, _shared["starts"]
+    )
+
+
+def bootstrap_means(
+    df,
+    variables,
+    weight,
+    cluster="hh_id",
+    strata=None,
+    by=None,
+    n_replicates=200,
+    seed=0,
+    n_workers=1,
+):
+    """This function estimates the weighted means of the variables and their
+    standard errors with a clustered bootstrap (see rescaling_factors). The
+    replicates are drawn in batches with their own seeds from seed, so that the
+    results only depend on seed and not on the number of processes. Each batch
+    of replicate weights is a dense matrix and the means of all variables and
+    replicates are computed with matrix products (see weighted_means). With
+    more than one worker the batches are computed in a pool of processes.
+    Args:
+        df (pandas.DataFrame): The dataset.
+        variables (list): The variables.
+        weight (str): The column with the design weights.
+        cluster (str): The column or index level with the clusters which are drawn.
+        Default value is "hh_id", so that all rows of a household in all waves
+        are drawn together.
+        strata (str): The column or index level with the strata. Default value is
+        None, which treats the sample as one stratum.
+        by (str): The column or index level whose groups are estimated separately
+        (e.g. "wave"). Default value is None.
+        n_replicates (int): The number of replicates. Default value is 200.
+        seed (int): The seed of the replicates. Default value is 0.
+        n_workers (int): The number of processes. Default value is 1.
+    Returns:
+        means (pandas.DataFrame): The weighted means "mean" and their standard errors
+        "se" with the variables as index, or the groups and the variables as index
+        with by.
+    Raises:
+        ValueError: If a cluster is in several strata.
+    """
+    values = df[list(variables)].to_numpy(dtype="float64", na_value=np.nan)
+    weights = df[weight].to_numpy(dtype="float64", na_value=np.nan)
+    valid = ~np.isnan(values) & ~np.isnan(weights)[:, None]
+    codes, groups = group_codes(df, by)
+    clusters, _ = group_codes(df, cluster)
+    rows = np.argsort(codes, kind="stable")
+    if strata is not None:
+        strata = group_codes(df, strata)[0][rows]
+    arrays = _arrays(weights[rows], clusters[rows], strata)
+    arrays["values"] = np.where(valid, values, 0.0)[rows]
+    arrays["valid"] = valid[rows].astype("float64")
+    arrays["starts"] = np.flatnonzero(np.r_[True, np.diff(codes[rows]) != 0])
+    batches = _batches(n_replicates, seed)
+    if n_workers > 1:
+        with ProcessPoolExecutor(
+            max_workers=n_workers, initializer=_share, initargs=(arrays,)
+        ) as pool:
+            parts = list(pool.map(_batch_means, *zip(*batches)))
+    else:
+        _share(arrays)
+        try:
+            parts = [_batch_means(seed, n) for seed, n in batches]
+        finally:
+            _shared.clear()
+    replicated = np.concatenate(parts, axis=2)
+    estimates = weighted_means(
+        arrays["values"], arrays["valid"], arrays["weights"][:, None], arrays["starts"]
+    )[:, :, 0]
+    index = pd.Index(list(variables), name="variable")
+    if by is not None:
+        index = pd.MultiIndex.from_product([groups, index])
+    return pd.DataFrame(
+        {
+            "mean": estimates.ravel(),
+            "se": np.nanstd(replicated, axis=2, ddof=1).ravel(),
+        },
+        index=index,
+    )
@@ -0,0 +1,329 @@
+"""
+This file contains the instrumentation of the tasks and the cleaning functions,
+which records the time, the memory and the size of the data of each call in a run
+report, and the comparison of the reports of two runs
+"""
+import argparse
+import inspect
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from src import config
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+REPORT_COLUMNS = [
+    "run",
+    "name",
+    "kind",
+    "depth",
+    "wall_s",
+    "cpu_s",
+    "peak_rss_mb",
+    "bytes_in",
+    "bytes_out",
+    "rows_in",
+    "rows_out",
+    "rows_per_s",
+]
+
+# The measurements which are compared between runs and the default threshold of
+# a regression: the new run takes at least 20% more time or memory.
+COMPARED = ["wall_s", "cpu_s", "peak_rss_mb"]
+THRESHOLD = 0.2
+
+# Differences below these values are noise and never regressions.
+MINIMUM_DIFFERENCE = {"wall_s": 0.05, "cpu_s": 0.05, "peak_rss_mb": 10}
+
+# The depth of the current call and the peaks of the resident memory of the
+# calls which are running, from the outermost to the innermost call.
+_calls = {"depth": 0, "peaks": []}
+
+
+def run_id():
+    """This function returns the id of the current run. The id is set in the
+    environment by the first call of a run, so that the worker processes of the
+    run ("pytask -n 4" or N_WORKERS) write to the same report."""
+    return os.environ.setdefault(
+        "PASS_INSTRUMENTATION_RUN", datetime.now().strftime("%Y%m%d-%H%M%S")
+    )
+
+
+def report_path(run=None, folder=None):
+    """This function returns the path of the report of a run."""
+    folder = config.INSTRUMENTATION_FOLDER if folder is None else folder
+    return Path(folder) / f"run-{run_id() if run is None else run}.jsonl"
+
+
+def _peak_rss_mb():
+    """Returns the peak of the resident memory of the process in MB since it was
+    last reset (see _reset_peak_rss). ru_maxrss is given in bytes on macOS and in
+    KB on the other platforms."""
+    if resource is None:
+        return float("nan")
+    unit = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 1024**2
+
+
+def _reset_peak_rss():
+    """Resets the peak of the resident memory of the process to its current
+    resident memory, so that the peak of a single call can be measured. This is
+    only possible on Linux, elsewhere False is returned."""
+    try:
+        with open("/proc/self/clear_refs", "w") as stream:
+            stream.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def _start_peak():
+    """Starts measuring the peak of the resident memory of a call. The peak of
+    the running outer call up to now is kept before the peak is reset."""
+    peaks = _calls["peaks"]
+    if peaks:
+        peaks[-1] = max(peaks[-1], _peak_rss_mb())
+    peaks.append(0.0 if _reset_peak_rss() else float("nan"))
+
+
+def _stop_peak():
+    """Returns the peak of the resident memory of the call in MB and adds it to
+    the peak of the outer call. The peak is missing where it cannot be reset."""
+    peaks = _calls["peaks"]
+    peak = max(peaks.pop(), _peak_rss_mb())
+    if peaks:
+        peaks[-1] = max(peaks[-1], peak)
+    return peak
+
+
+def _file_rows(path):
+    """Returns the number of rows of a .parquet or .dta file or None."""
+    try:
+        if path.suffix == ".parquet":
+            return pq.ParquetFile(path).metadata.num_rows
+        if path.suffix == ".dta":
+            with pd.read_stata(path, iterator=True) as reader:
+                return reader.nobs
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def data_size(value):
+    """This function measures the data passed to or returned by a function.
+    DataFrames and Series are measured in memory and paths of files on disk, so
+    that the dependencies and products of a task are measured as well.
+    Args:
+        value: An argument or the result of a function. Dictionaries, lists and
+        tuples are measured item by item.
+    Returns:
+        size (tuple): The bytes and the number of rows.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(index=True, deep=True).sum()), len(value)
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        sizes = [data_size(item) for item in value]
+        return sum(size for size, _ in sizes), sum(rows for _, rows in sizes)
+    if isinstance(value, (str, Path)) and Path(value).suffix and Path(value).is_file():
+        rows = _file_rows(Path(value))
+        return Path(value).stat().st_size, rows or 0
+    return 0, 0
+
+
+def _record(record, path):
+    """Appends a record to a report. Each record is written as one line, so that
+    several processes can write to the same report."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as stream:
+        stream.write(json.dumps(record) + "\n")
+
+
+def instrument(function=None, kind="function"):
+    """This decorator records each call of a function in the report of the run
+    (see report_path) if INSTRUMENTATION in "src/config.py" is set. A record holds
+    the wall time, the CPU time, the peak of the resident memory of the process
+    during the call (on Linux only, without the worker processes of the call), the
+    bytes and rows of the data passed in and returned
+    (see data_size) and the rows passed in per second. The dependencies of a task
+    are its data in and its products its data out. Calls inside an instrumented
+    call have a higher "depth". Without INSTRUMENTATION the function is called
+    as it is.
+    Args:
+        function (function): The function.
+        kind (str): The kind of the function in the report, e.g. "task". Default
+        value is "function".
+    Returns:
+        wrapper (function): The instrumented function.
+    """
+    if function is None:
+        return lambda function: instrument(function, kind)
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if not config.INSTRUMENTATION:
+            return function(*args, **kwargs)
+        depth = _calls["depth"]
+        _calls["depth"] += 1
+        if kind == "task":
+            data_in = data_size(kwargs.get("depends_on"))
+        else:
+            data_in = data_size(list(args) + list(kwargs.values()))
+        _start_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            _calls["depth"] -= 1
+            peak = _stop_peak()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        if kind == "task":
+            data_out = data_size(kwargs.get("produces"))
+        else:
+            data_out = data_size(result)
+        name = function.__name__
+        if kind == "task" and "i" in kwargs:
+            name = f"{name}[{kwargs['i']}]"
+        record = {
+            "run": run_id(),
+            "name": name,
+            "kind": kind,
+            "depth": depth,
+            "wall_s": wall,
+            "cpu_s": cpu,
+            "peak_rss_mb": peak,
+            "bytes_in": data_in[0],
+            "bytes_out": data_out[0],
+            "rows_in": data_in[1],
+            "rows_out": data_out[1],
+            "rows_per_s": data_in[1] / wall if wall > 0 else None,
+        }
+        _record(record, report_path())
+        if kind == "task":
+            write_report()
+        return result
+
+    if kind == "task":
+        # pytask unwraps decorated tasks and would execute the task without the
+        # wrapper, so the wrapper only keeps the signature of the task.
+        del wrapper.__wrapped__
+        wrapper.__signature__ = inspect.signature(function)
+    return wrapper
+
+
+def load_report(path):
+    """This function loads the report of a run.
+    Args:
+        path (str, path object): The path of the report (see report_path).
+    Returns:
+        report (pandas.DataFrame): One row for each call with REPORT_COLUMNS.
+    """
+    with open(path) as stream:
+        records = [json.loads(line) for line in stream if line.strip()]
+    return pd.DataFrame(records, columns=REPORT_COLUMNS)
+
+
+def summarize_report(report):
+    """This function sums the calls of each function or task of a report. The
+    times, bytes and rows are summed, the peak memory is the highest peak.
+    Args:
+        report (pandas.DataFrame): The report (see load_report).
+    Returns:
+        summary (pandas.DataFrame): One row for each function or task with the
+        number of calls "calls".
+    """
+    summary = report.groupby(["kind", "name"]).agg(
+        calls=("wall_s", "size"),
+        wall_s=("wall_s", "sum"),
+        cpu_s=("cpu_s", "sum"),
+        peak_rss_mb=("peak_rss_mb", "max"),
+        bytes_in=("bytes_in", "sum"),
+        bytes_out=("bytes_out", "sum"),
+        rows_in=("rows_in", "sum"),
+        rows_out=("rows_out", "sum"),
+    )
+    summary["rows_per_s"] = summary["rows_in"] / summary["wall_s"]
+    return summary
+
+
+def compare_reports(old, new, threshold=THRESHOLD):
+    """This function compares the reports of two runs. A function or task is a
+    regression if it takes more than threshold more time or memory in the new run
+    than in the old run and the difference is above MINIMUM_DIFFERENCE.
+    Args:
+        old (pandas.DataFrame): The report of the old run (see load_report).
+        new (pandas.DataFrame): The report of the new run.
+        threshold (float): The relative increase which is a regression. Default
+        value is THRESHOLD.
+    Returns:
+        comparison (pandas.DataFrame): The measurements (COMPARED) of both runs,
+        their ratio "{measurement}_ratio" and whether they are a regression
+        "regression", for the functions and tasks in both runs.
+    """
+    old, new = summarize_report(old), summarize_report(new)
+    comparison = old[COMPARED].join(
+        new[COMPARED], lsuffix="_old", rsuffix="_new", how="inner"
+    )
+    comparison["regression"] = False
+    for measurement in COMPARED:
+        before = comparison[f"{measurement}_old"]
+        after = comparison[f"{measurement}_new"]
+        comparison[f"{measurement}_ratio"] = after / before
+        comparison["regression"] |= (after > before * (1 + threshold)) & (
+            after - before > MINIMUM_DIFFERENCE[measurement]
+        )
+    return comparison
+
+
+def write_report(run=None, folder=None):
+    """This function writes the summary of the report of a run as .csv and .json
+    file next to the report.
+    Args:
+        run (str): The id of the run. Default value is None, which uses the
+        current run.
+        folder (str, path object): The folder of the reports. Default value is
+        None, which uses INSTRUMENTATION_FOLDER in "src/config.py".
+    Returns:
+        summary (pandas.DataFrame): The summary (see summarize_report).
+    """
+    path = report_path(run, folder)
+    summary = summarize_report(load_report(path))
+    summary.to_csv(path.with_suffix(".csv"), sep=";")
+    summary.reset_index().to_json(path.with_suffix(".json"), orient="records", indent=1)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Summarize or compare the instrumentation reports of runs."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    summarize = commands.add_parser("report", help="summarize the report of a run")
+    summarize.add_argument("run", help="id of the run, e.g. 20240101-120000")
+    compare = commands.add_parser("compare", help="flag regressions between runs")
+    compare.add_argument("old", help="id of the old run")
+    compare.add_argument("new", help="id of the new run")
+    compare.add_argument("--threshold", type=float, default=THRESHOLD)
+    arguments = parser.parse_args()
+    if arguments.command == "report":
+        print(write_report(arguments.run).to_string())
+    else:
+        comparison = compare_reports(
+            load_report(report_path(arguments.old)),
+            load_report(report_path(arguments.new)),
+            arguments.threshold,
+        )
+        print(comparison.to_string())
+        sys.exit(1 if comparison["regression"].any() else 0)
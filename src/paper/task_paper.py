@@ -4,12 +4,20 @@ import pytask
 
 from src.config import BLD
 from src.config import ROOT
+from src.config import SAMPLE_FRACTION
 from src.config import SRC
 
 
 documents = ["research_paper"]
 
+# The paper includes the figures and tables of "bld", so it is not compiled in
+# development runs on a sample of the households.
+skip_sample = pytask.mark.skipif(
+    SAMPLE_FRACTION is not None, reason="development run on a sample"
+)
+
 
+@skip_sample
 @pytask.mark.latex(
     [
         "--pdf",
@@ -31,6 +39,7 @@ def task_compile_documents():
     pass
 
 
+@skip_sample
 @pytask.mark.parametrize(
     "depends_on, produces",
     [
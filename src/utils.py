@@ -4,17 +4,61 @@ across cleaning modules
 """
 import re
 
+import numpy as np
+import pandas as pd
 
-def _shorten_str(x):
-    """Finds bracketed number in strings and deletes brackets and number."""
-    if type(x) == str:
-        return re.sub(r"\[-?\d*\] ", "", x)
-    else:
-        return x
+# The code in front of a Stata value label, e.g. "[-1] " in "[-1] keine Angabe".
+BRACKETED_CODE = re.compile(r"\[-?\d*\] ")
+
+
+def _normalize_values(values):
+    """Deletes the bracketed numbers in the strings of an array of distinct values.
+    Values which are not strings are kept and arrays without strings are returned
+    with their dtype."""
+    values = pd.Index(values, dtype=getattr(values, "dtype", None))
+    is_str = np.array([isinstance(x, str) for x in values], dtype=bool)
+    if not is_str.any():
+        return values
+    values = values.astype(object)
+    return values.where(~is_str, values.str.replace(BRACKETED_CODE, "", regex=True))
+
+
+def normalize_labels(series):
+    """This function deletes the bracketed numbers in the labels of a column.
+    Each distinct label is rewritten once: categorical columns get new categories
+    and their codes are remapped, object columns are factorized and the distinct
+    values are rewritten with the vectorized string methods of pandas. Labels which
+    are equal after deleting the numbers are merged into one category. Columns of
+    other types are returned as they are.
+    Args:
+        series (pandas.Series): The column.
+    Returns:
+        series (pandas.Series): The column with normalized labels.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = _normalize_values(series.cat.categories)
+        if categories.is_unique:
+            return series.cat.rename_categories(categories)
+        merged = categories.unique()
+        codes = series.cat.codes.to_numpy()
+        codes = np.where(codes >= 0, merged.get_indexer(categories)[codes], -1)
+        labels = pd.Categorical.from_codes(codes, merged, ordered=series.cat.ordered)
+        return pd.Series(labels, index=series.index, name=series.name)
+    if isinstance(series.dtype, pd.StringDtype):
+        return series.str.replace(BRACKETED_CODE, "", regex=True)
+    if not pd.api.types.is_object_dtype(series.dtype):
+        return series
+    codes, uniques = pd.factorize(series.to_numpy())
+    uniques = pd.Index(uniques, dtype=object)
+    normalized = _normalize_values(uniques)
+    if normalized.equals(uniques):
+        return series
+    values = np.where(codes >= 0, normalized.to_numpy()[codes], series.to_numpy())
+    return pd.Series(values, index=series.index, name=series.name, dtype=object)
 
 
 def remove_brackets_in_categorical_values(data):
-    """Applies _shorten_str to a dataframe."""
+    """Applies normalize_labels to each column of a dataframe."""
     for c in data:
-        data[c] = data[c].apply(lambda x: _shorten_str(x))
+        data[c] = normalize_labels(data[c])
     return data